@@ -1,13 +1,15 @@
 import sys
 
-from WarrensGUI.Deprecated.GuiApplication import GuiApplication
-from WarrensGUI.MainWindow import MainWindow
-
 
 """
 Launcher script
 Command line options
     -3D : Starts the opengl based implementation
+    -TEST : Runs the unit tests
+    -SIM [games] [turns] [policy] : Plays games without GUI and reports
+                                    the speed of the game engine
+    -FARM [games] [turns] [processes] [file] : Plays many games in parallel
+                                    and summarizes the results
 """
 if __name__ == '__main__':
     #This is where it all starts!
@@ -16,6 +18,7 @@ if __name__ == '__main__':
         if FirstCommandLineArg == '-3D':
             # Run the 3D interface
             print "Running 3D interface."
+            from WarrensGUI.MainWindow import MainWindow
             _application = MainWindow()
             _application.run()
         elif FirstCommandLineArg == '-TEST':
@@ -25,9 +28,18 @@ if __name__ == '__main__':
             suite = unittest.TestLoader().discover('./WarrensTest', pattern = "*_test.py")
             # Run the discovered suite of tests
             unittest.TextTestRunner(verbosity=2).run(suite)
+        elif FirstCommandLineArg == '-SIM':
+            # Run headless simulation
+            from WarrensGame.Simulation import main
+            main(sys.argv[2:])
+        elif FirstCommandLineArg == '-FARM':
+            # Run simulations in parallel
+            from WarrensGame.SimulationFarm import main
+            main(sys.argv[2:])
         else:
             print 'Bad commandline parameter, exiting'
     else:
+        from WarrensGUI.Deprecated.GuiApplication import GuiApplication
         _application = GuiApplication()
         #Start application
         _application.showMainMenu()
\ No newline at end of file
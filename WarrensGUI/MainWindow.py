@@ -10,6 +10,10 @@ http://www.willmcgugan.com/blog/tech/2007/6/4/opengl-sample-code-for-pygame/
 @author: Frost
 """
 
+import os
+import sys
+import json
+
 import pygame
 from pygame.locals import *
 
@@ -23,14 +27,17 @@ import numpy as np
 
 from WarrensGame.Game import Game
 from WarrensGame.Actors import Character
+from WarrensGame.Profiling import PhaseProfiler, FrameCapture
 
 from WarrensGUI.Util import Utilities
 import WarrensGUI.Util.OpenGlUtilities as og_util
 
-from WarrensGUI.Util.SceneObject import SceneObject
+from WarrensGUI.Util.SceneObject import SceneObject, assembleMeshes, splitInstances, SHAPES
 from WarrensGUI.Util.TileSceneObject import TileSceneObject
 from WarrensGUI.Util.ActorSceneObject import ActorSceneObject
 from WarrensGUI.Util.EffectSceneObject import EffectSceneObject
+from WarrensGUI.Util.MeshBuffers import MeshBuffers, ShapeBuffers, InstanceBatch
+from WarrensGUI.Util.ChunkedMesh import ChunkedMesh
 
 from WarrensGUI.Util.vec3 import vec3
 from WarrensGUI.Util.Constants import *
@@ -55,6 +62,8 @@ class MainWindow(object):
     @game.setter
     def game(self, game):
         self._game = game
+        if game is not None and self.frameProfiler is not None:
+            game.phaseTimer = PhaseProfiler()
         self.refreshStaticObjects()
 
     @property
@@ -293,6 +302,14 @@ class MainWindow(object):
     def sceneObjectSelectionRectangles(self,rectangles):
         self._sceneObjectSelectionRectangles = rectangles
 
+    @property
+    def frameProfiler(self):
+        '''
+        PhaseProfiler that measures the phases of every frame while profiling is active.
+        :return: PhaseProfiler or None
+        '''
+        return self._frameProfiler
+
     @property
     def selectedSceneObject(self):
         '''
@@ -353,6 +370,8 @@ class MainWindow(object):
         self._clock = pygame.time.Clock()
         self._sceneObjectSelectionRectangles = []
         self._selectedObject = None
+        self._frameProfiler = None
+        self._frameCapture = None
         # Initialize uniform class variables
         self.perspectiveMatrixUnif = None
         self.cameraMatrixUnif = None
@@ -363,6 +382,13 @@ class MainWindow(object):
         self.playerPositionUnif = None
         self.fogDistanceUnif = None
         self.fogActiveUnif = None
+        self.staticMesh = ChunkedMesh(CHUNK_SIZE)
+        self.staticChunkBuffers = []
+        self.dynamicBuffers = None
+        self.dynamicBatches = None
+        self.shapeBuffers = None
+        self.instancedUnif = None
+        self.VBO_dynamic_elements_length = 0
 
         self.dynamicObjects = []
         self.staticObjects = []
@@ -443,15 +469,26 @@ class MainWindow(object):
         self.playerPositionUnif = GL.glGetUniformLocation(self.openGlProgram, "playerPosition")
         self.fogDistanceUnif = GL.glGetUniformLocation(self.openGlProgram, "fogDistance")
         self.fogActiveUnif = GL.glGetUniformLocation(self.openGlProgram, "fogActive")
+        # Instanced rendering
+        self.instancedUnif = GL.glGetUniformLocation(self.openGlProgram, "instanced")
 
-        # Generate Vertex Array Object for the static objects
-        self.VAO_static = GL.GLuint(0)
-        GL.ARB.vertex_array_object.glGenVertexArrays(1, self.VAO_static)
+        # The static objects are split in chunks, every chunk gets its own Vertex Array Object and buffers.
+        # These are created when the chunks are loaded.
+        self.staticChunkBuffers = []
+        self.staticMesh.markAllDirty()
 
         # Generate Vertex Array Object for the dynamic objects
         self.VAO_dynamic = GL.GLuint(0)
         GL.ARB.vertex_array_object.glGenVertexArrays(1, self.VAO_dynamic)
 
+        # Buffers for the dynamic meshes, they are created once and grow when needed.
+        # The dynamic meshes change every frame so their storage is orphaned on every upload.
+        self.dynamicBuffers = MeshBuffers(GL.GL_STREAM_DRAW, orphan=True)
+
+        # Unit meshes of the shapes, tiles and actors are drawn as instances of these
+        self.shapeBuffers = dict((shape.name, ShapeBuffers(shape)) for shape in SHAPES)
+        self.dynamicBatches = self.createInstanceBatches(GL.GL_STREAM_DRAW, True)
+
         # Recalculate the perspective matrix
         self.calculatePerspectiveMatrix()
 
@@ -491,18 +528,120 @@ class MainWindow(object):
 
     def playNewGame(self):
         #Initialize a new game
+        self.stopGame()
         self.game = Game()
         self.game.resetGame()
+        self.game.startAutosave(AUTOSAVE_FILE)
         self.refreshStaticObjects()
         self.refreshDynamicObjects()
         # Set Game state (which contains the main loop)
         self.state = GameState(self,self.state)
 
     def saveGame(self):
-        self.game.saveGame(SAVE_FILE)
+        # The following turns are autosaved to the save file
+        self.game.startAutosave(SAVE_FILE)
+
+    def stopGame(self):
+        # Write the remaining turns of the running game to its autosave journal
+        if self.game is not None:
+            self.game.stopPrefetch()
+            self.game.stopAutosave()
+        # The meshes of the game are no longer needed
+        self.releaseBuffers()
+
+    def quit(self):
+        # Flush the autosave journal before the process ends
+        self.stopGame()
+        sys.exit()
+
+    def releaseBuffers(self):
+        '''
+        Frees the GPU storage of the static and dynamic meshes.
+        The chunks of the static mesh get new buffers when they are loaded, a new dynamic buffer is created
+        so the window can keep drawing.
+        :return: None
+        '''
+        for vao, buffers, batches in self.staticChunkBuffers:
+            buffers.release()
+            for batch in batches.values():
+                batch.release()
+            GL.ARB.vertex_array_object.glDeleteVertexArrays(1, [vao])
+        self.staticChunkBuffers = []
+        self.staticMesh.assign([])
+        if self.dynamicBuffers is not None:
+            self.dynamicBuffers.release()
+            self.dynamicBuffers = MeshBuffers(GL.GL_STREAM_DRAW, orphan=True)
+            self.VBO_dynamic_elements_length = 0
+        if self.dynamicBatches is not None:
+            for batch in self.dynamicBatches.values():
+                batch.release()
+            self.dynamicBatches = self.createInstanceBatches(GL.GL_STREAM_DRAW, True)
 
     def loadGame(self):
+        if not os.path.exists(SAVE_FILE):
+            return
+        #Replace the current game with the saved game
+        self.stopGame()
+        self.game = Game()
         self.game.loadGame(SAVE_FILE)
+        self.game.startAutosave(SAVE_FILE)
+        self.refreshStaticObjects()
+        self.refreshDynamicObjects()
+        # Loading from the main menu starts the game, the game menu returns
+        # to the running game state.
+        if isinstance(self.state, MainMenuState):
+            self.state = GameState(self,self.state)
+
+    def toggleProfiling(self):
+        '''
+        Starts or stops measuring the phases of the frames and of the game turns.
+        The measurements are shown in an overlay on the HUD.
+        :return: None
+        '''
+        if self._frameProfiler is None:
+            self._frameProfiler = PhaseProfiler()
+            if self.game is not None:
+                self.game.phaseTimer = PhaseProfiler()
+        else:
+            self._frameProfiler = None
+            if self.game is not None:
+                self.game.phaseTimer = None
+
+    def captureProfile(self, frames=PROFILE_CAPTURE_FRAMES):
+        '''
+        Runs cProfile for the next frames, the statistics are written to PROFILE_CAPTURE_FILE.
+        :param frames: number of frames to capture
+        :return: None
+        '''
+        if self._frameCapture is None:
+            self._frameCapture = FrameCapture(frames, PROFILE_CAPTURE_FILE)
+
+    def dumpProfile(self):
+        '''
+        Writes the histograms of the frame and turn phases to PROFILE_JSON_FILE.
+        :return: None
+        '''
+        if self._frameProfiler is None:
+            return
+        profile = {'frame': self._frameProfiler.toDict()}
+        if self.game is not None and self.game.phaseTimer is not None:
+            profile['turn'] = self.game.phaseTimer.toDict()
+        with open(PROFILE_JSON_FILE, 'w') as jsonFile:
+            json.dump(profile, jsonFile, indent=2, sort_keys=True)
+
+    def startFrame(self):
+        if self._frameProfiler is not None:
+            self._frameProfiler.startTurn()
+
+    def markFrame(self, phase):
+        if self._frameProfiler is not None:
+            self._frameProfiler.mark(phase)
+
+    def endFrame(self):
+        if self._frameProfiler is not None:
+            self._frameProfiler.endTurn()
+        if self._frameCapture is not None and self._frameCapture.frameDone():
+            self._frameCapture = None
 
     def DEPRECATED_playGame(self):
         # #Init Game
@@ -863,7 +1002,10 @@ class MainWindow(object):
 
     def refreshStaticObjects(self):
         self.staticObjects = []
-        if self.level is not None:
+        if self.level is None:
+            # Nothing to draw, free the storage of the level mesh
+            self.releaseBuffers()
+        else:
             for tileRow in self.level.map.tiles:
                 for tile in tileRow:
                     if tile.sceneObject is None:
@@ -872,72 +1014,41 @@ class MainWindow(object):
                         tile.sceneObject.refreshMesh()
                     self.staticObjects.append(tile.sceneObject)
             # Load the static objects in vertex buffers
-            self.loadVAOStaticObjects()
+            self.loadVAOStaticObjects(self.level.map)
 
-    def loadVAOStaticObjects(self):
+    def loadVAOStaticObjects(self, levelMap=None):
         """
-        Initializes the context of the VAO for static objects
-        The level VAO contains the basic level mesh
+        Divides the static objects over the chunks of the static mesh and loads all chunks.
+        The static mesh contains the basic level mesh
         To optimize performance this will only be called when a new level is loaded
+        :param levelMap: Map of the tiles in the static objects, changes to this map are detected after every turn
         """
-        # Create vertex buffers on the GPU, remember the address IDs
-        self.VBO_static_id = GL.glGenBuffers(1)
-        self.VBO_static_elements_id = GL.glGenBuffers(1)
-
-        # Construct the data arrays that will be loaded into the buffer
-        vertexData = []
-        colorData = []
-        normalsData = []
-        elementData = []
-
-        elemOffset = 0
-        for obj in self.staticObjects:
-            vertexData.extend(obj.vertices)
-            colorData.extend(obj.colors)
-            normalsData.extend(obj.normals)
-            for elem in obj.triangleIndices:
-                 elementData.append(elem + elemOffset)
-            elemOffset += obj.vertexCount
-
-        # Merge the datasets into one buffer object
-        # Remember where each data set begins
-        self.VBO_static_color_offset = len(vertexData)
-        vertexData.extend(colorData)
-        self.VBO_static_normals_offset = len(vertexData)
-        vertexData.extend(normalsData)
-        self.VBO_static_length = len(vertexData)
-        self.VBO_static_elements_length = len(elementData)
-
-        # Set up the VAO context
-        GL.glUseProgram(self.openGlProgram)
-        glBindVertexArray(self.VAO_static)
+        self.staticMesh.assign(self.staticObjects, levelMap)
+        self.loadDirtyStaticChunks()
 
-        # Load the constructed vertex and color data array into the created array buffer
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.VBO_static_id)
-        array_type = (GL.GLfloat * len(vertexData))
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, len(vertexData) * SIZE_OF_FLOAT, array_type(*vertexData), GL.GL_STATIC_DRAW)
-        # Enable Vertex inputs and define pointer
-        GL.glEnableVertexAttribArray(0)
-        GL.glVertexAttribPointer(0, VERTEX_COMPONENTS, GL.GL_FLOAT, False, 0, None)
-        # Enable Color inputs and define pointer
-        GL.glEnableVertexAttribArray(1)
-        colorDataStart = self.VBO_static_color_offset * SIZE_OF_FLOAT
-        GL.glVertexAttribPointer(1, VERTEX_COMPONENTS, GL.GL_FLOAT, False, 0, c_void_p(colorDataStart))
-        # Enable Normals inputs and define pointer
-        GL.glEnableVertexAttribArray(2)
-        normalsDataStart = self.VBO_static_normals_offset * SIZE_OF_FLOAT
-        GL.glVertexAttribPointer(2, 3, GL.GL_FLOAT, False, 0, c_void_p(normalsDataStart))
-
-        # Load the constructed element data array into the created element array buffer
-        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.VBO_static_elements_id)
-        array_type = (GL.GLint * len(elementData))
-        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, len(elementData) * SIZE_OF_FLOAT, array_type(*elementData),
-                        GL.GL_STATIC_DRAW)
-
-        # Done
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
-        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
-        GL.glUseProgram(0)
+    def loadDirtyStaticChunks(self):
+        """
+        Loads the chunks of the static mesh that changed since they were last loaded.
+        """
+        for chunk in self.staticMesh.dirtyChunks:
+            while len(self.staticChunkBuffers) <= chunk.index:
+                vao = GL.GLuint(0)
+                GL.ARB.vertex_array_object.glGenVertexArrays(1, vao)
+                batches = self.createInstanceBatches(GL.GL_STATIC_DRAW)
+                self.staticChunkBuffers.append((vao, MeshBuffers(GL.GL_STATIC_DRAW), batches))
+            vao, buffers, batches = self.staticChunkBuffers[chunk.index]
+            chunk.elementsLength = self.loadVAO(vao, buffers, chunk.sceneObjects, batches)
+            chunk.dirty = False
+
+    def createInstanceBatches(self, usage, orphan=False):
+        """
+        Creates an instance batch for every shape.
+        :param usage: usage hint for the instance buffers
+        :param orphan: True for instances that are updated every frame
+        :return: dictionary with an InstanceBatch per shape name
+        """
+        return dict((name, InstanceBatch(shapeBuffers, usage, orphan))
+                    for name, shapeBuffers in self.shapeBuffers.items())
 
     def refreshDynamicObjects(self):
         '''
@@ -985,72 +1096,64 @@ class MainWindow(object):
         '''
         for obj in self.dynamicObjects:
             obj.animate(self.clock.get_time())
+        self.markFrame('animateDynamicObjects')
         # Load the dynamic objects in vertex buffers
         self.loadVAODynamicObjects()
+        self.markFrame('loadVAODynamicObjects')
 
     def loadVAODynamicObjects(self):
         """
-        Initializes the context of the VAO for dynamic objects
+        Loads the dynamic objects in the VAO for dynamic objects
         This should be called whenever there is a change in actor positions or visibility
         """
-        # Create the vertex buffer on the GPU and remember the address ID
-        self.VBO_dynamic_id = GL.glGenBuffers(1)
-        self.VBO_dynamic_elements_id = GL.glGenBuffers(1)
+        self.VBO_dynamic_elements_length = self.loadVAO(self.VAO_dynamic, self.dynamicBuffers, self.dynamicObjects,
+                                                        self.dynamicBatches)
 
-        # Construct the data arrays that will be loaded into the buffer
-        vertexData = []
-        colorData = []
-        normalsData = []
-        elementData = []
+    def loadVAO(self, vao, buffers, sceneObjects, batches=None):
+        """
+        Uploads the meshes of the scene objects into the buffers of a VAO and sets up the VAO context.
+        The buffers are reused, they are only reallocated when the meshes no longer fit.
+        :param vao: Vertex Array Object
+        :param buffers: MeshBuffers of the VAO
+        :param sceneObjects: SceneObjects to load
+        :param batches: optional dictionary with an InstanceBatch per shape name, the scene objects that are
+                        instances of a shape are loaded in these batches instead of the VAO
+        :return: number of elements to draw
+        """
+        if batches is not None:
+            sceneObjects, instances = splitInstances(sceneObjects)
+            for name, batch in batches.items():
+                batch.load(instances[name])
 
-        elemOffset = 0
-        for obj in self.dynamicObjects:
-            vertexData.extend(obj.vertices)
-            colorData.extend(obj.colors)
-            normalsData.extend(obj.normals)
-            for elem in obj.triangleIndices:
-                 elementData.append(elem + elemOffset)
-            elemOffset += obj.vertexCount
-
-        # Merge the datasets into one buffer object
-        # Remember where each data set begins
-        self.VBO_dynamic_color_offset = len(vertexData)
-        vertexData.extend(colorData)
-        self.VBO_dynamic_normals_offset = len(vertexData)
-        vertexData.extend(normalsData)
-        self.VBO_dynamic_length = len(vertexData)
-        self.VBO_dynamic_elements_length = len(elementData)
+        # Batch the meshes into the arrays that will be loaded into the buffers
+        vertexData, colorOffset, normalsOffset, elementData = assembleMeshes(sceneObjects)
 
         # Set up the VAO context
         GL.glUseProgram(self.openGlProgram)
-        glBindVertexArray(self.VAO_dynamic)
+        glBindVertexArray(vao)
 
-        # Load the constructed vertex data array into the created array buffer
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.VBO_dynamic_id)
-        array_type = (GL.GLfloat * len(vertexData))
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, len(vertexData) * SIZE_OF_FLOAT, array_type(*vertexData), GL.GL_STATIC_DRAW)
+        # Load the vertex, color and normals data into the array buffer, numpy arrays are passed without a copy
+        buffers.vertices.upload(vertexData, vertexData.nbytes)
         # Enable Vertex inputs and define pointer
         GL.glEnableVertexAttribArray(0)
         GL.glVertexAttribPointer(0, VERTEX_COMPONENTS, GL.GL_FLOAT, False, 0, None)
         # Enable Color inputs and define pointer
         GL.glEnableVertexAttribArray(1)
-        colorDataStart = self.VBO_dynamic_color_offset * SIZE_OF_FLOAT
+        colorDataStart = colorOffset * SIZE_OF_FLOAT
         GL.glVertexAttribPointer(1, VERTEX_COMPONENTS, GL.GL_FLOAT, False, 0, c_void_p(colorDataStart))
         # Enable Normals inputs and define pointer
         GL.glEnableVertexAttribArray(2)
-        normalsDataStart = self.VBO_dynamic_normals_offset * SIZE_OF_FLOAT
+        normalsDataStart = normalsOffset * SIZE_OF_FLOAT
         GL.glVertexAttribPointer(2, 3, GL.GL_FLOAT, False, 0, c_void_p(normalsDataStart))
 
-        # Load the constructed element data array into the created element array buffer
-        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.VBO_dynamic_elements_id)
-        array_type = (GL.GLint * len(elementData))
-        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, len(elementData) * SIZE_OF_FLOAT, array_type(*elementData),
-                        GL.GL_STATIC_DRAW)
+        # Load the element data into the element array buffer
+        buffers.elements.upload(elementData, elementData.nbytes)
 
         # Done
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
         GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
         GL.glUseProgram(0)
+        return len(elementData)
 
     def drawAll(self):
         # set camera matrix based on current camera mode
@@ -1064,10 +1167,14 @@ class MainWindow(object):
             self.setCameraFirstPersonView()
         elif self.cameraMode == CAM_FOLLOW:
             self.setCameraFollowPlayer()
+        # Load the changed chunks of the static mesh
+        self.loadDirtyStaticChunks()
         # draw Vector Buffer Arrays
         self.drawVBAs()
+        self.markFrame('drawVBAs')
         # draw HUD
         self.drawHUD()
+        self.markFrame('drawHUD')
         # Register time
         #self.clock.tick_busy_loop(40) # This caps the framerate
         self.clock.tick() # No framerate cap
@@ -1079,8 +1186,6 @@ class MainWindow(object):
         GL.glUseProgram(self.openGlProgram)
 
         if len(self.staticObjects) > 0:
-            # Bind VAO context for static objects
-            glBindVertexArray(self.VAO_static)
             # Load uniforms
             # Attention: when loading numpy arrays to opengl we need to set GL.GL_TRUE to transpose from row major to column major.
             GL.glUniformMatrix4fv(self.perspectiveMatrixUnif, 1, GL.GL_TRUE, np.reshape(self.perspectiveMatrix, (16)))
@@ -1107,11 +1212,23 @@ class MainWindow(object):
             GL.glUniform1i(self.fogActiveUnif, 1 if self.fogActive else 0)
             GL.glUniform1f(self.fogDistanceUnif, self.fogDistance)
 
-            # Bind element array
-            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.VBO_static_elements_id)
-            # Draw elements
-            GL.glDrawElements(GL.GL_TRIANGLES, self.VBO_static_elements_length, GL.GL_UNSIGNED_INT, None)
-            glBindVertexArray(0)
+            for chunk in self.staticMesh.chunks:
+                vao, buffers, batches = self.staticChunkBuffers[chunk.index]
+                # Draw the objects with their own mesh
+                if chunk.elementsLength > 0:
+                    GL.glUniform1i(self.instancedUnif, 0)
+                    # Bind VAO context for the chunk of static objects
+                    glBindVertexArray(vao)
+                    # Bind element array
+                    GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, buffers.elements.id)
+                    # Draw elements
+                    GL.glDrawElements(GL.GL_TRIANGLES, chunk.elementsLength, GL.GL_UNSIGNED_INT, None)
+                    glBindVertexArray(0)
+                # Draw the instances of the shapes
+                GL.glUniform1i(self.instancedUnif, 1)
+                for batch in batches.values():
+                    batch.draw()
+            GL.glUniform1i(self.instancedUnif, 0)
 
         if len(self.dynamicObjects) > 0:
             # Bind VAO context for dynamic objects
@@ -1134,11 +1251,17 @@ class MainWindow(object):
             GL.glUniform1f(self.fogDistanceUnif, self.fogDistance)
 
             # Bind element array
-            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.VBO_dynamic_elements_id)
+            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.dynamicBuffers.elements.id)
             # Draw elements
             GL.glDrawElements(GL.GL_TRIANGLES, self.VBO_dynamic_elements_length, GL.GL_UNSIGNED_INT, None)
             glBindVertexArray(0)
 
+            # Draw the instances of the shapes
+            GL.glUniform1i(self.instancedUnif, 1)
+            for batch in self.dynamicBatches.values():
+                batch.draw()
+            GL.glUniform1i(self.instancedUnif, 0)
+
             GL.glUseProgram(0)
 
     def drawHUD(self):
@@ -1243,17 +1366,27 @@ class MainWindow(object):
         GL.glLoadIdentity()
         self.drawText((-0.98, -1, zNear), str(self.clock.get_fps()), FONT_HUD_S, COLOR_PG_HUD_TEXT)
 
+        # Profiling overlay next to the FPS: p50 / p99 of the frame and turn phases
+        if self.frameProfiler is not None:
+            lines = ['frame ' + line for line in self.frameProfiler.summaryLines()]
+            if self.game.phaseTimer is not None:
+                lines += ['game ' + line for line in self.game.phaseTimer.summaryLines()]
+            fontHeight = FONT_HUD_S_HEIGHT / float(self.displayHeight)
+            for i, line in enumerate(lines):
+                self.drawText((-0.7, -1 + 2 * fontHeight * (len(lines) - i - 1), zNear), line, FONT_HUD_S, COLOR_PG_HUD_TEXT)
+
         # Right side: render game messages
         GL.glLoadIdentity()
         widthOffsetInPixels = 200
         heightOffset = 100 / float(self.displayHeight)
         messageCounter = 1
-        nbrOfMessages = len(self.game.messageBuffer)
+        messages = self.game.messageBuffer
+        nbrOfMessages = len(messages)
         fontHeight = FONT_HUD_XL_HEIGHT / float(self.displayHeight)
         while heightOffset > 0:
             if messageCounter > nbrOfMessages: break
             # Retrieve messages from game message buffer, starting from the back
-            message = self.game.messageBuffer[nbrOfMessages - messageCounter]
+            message = messages[nbrOfMessages - messageCounter]
             # Wrap message in multiple lines
             textLines = Utilities.wrap_multi_line(message, FONT_HUD_XL, self.displayWidth - widthOffsetInPixels)
             nbrOfLines = len(textLines)
@@ -1287,6 +1420,10 @@ class MainWindow(object):
         if self.game.tryToPlayTurn():
             # If a turn was played, refresh the dynamic objects (some actors might have moved)
             self.refreshDynamicObjects()
+            # Tiles of the level might have changed, their chunks are loaded before the next draw
+            if self.level is self.previousPassLevel:
+                self.staticMesh.detectChanges()
+        self.markFrame('progressGame')
         # Detect level change (this may happen without a turn being played)
         if self.level is not self.previousPassLevel:
             self.previousPassLevel = self.level
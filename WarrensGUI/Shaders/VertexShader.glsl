@@ -1,8 +1,11 @@
 #version 330
 
 layout(location = 0) in vec4 position;
-layout(location = 1) in vec4 color;
+layout(location = 1) in vec4 vertexColor;
 layout(location = 2) in vec3 normal;
+// Instance attributes: x, y, size, height and the color of the instance
+layout(location = 3) in vec4 instanceTransform;
+layout(location = 4) in vec4 instanceColor;
 
 smooth out vec4 interpColor;
 
@@ -21,12 +24,27 @@ uniform vec4 playerPosition;
 uniform float fogDistance;
 uniform bool fogActive;
 
+// True when drawing instances of a shared unit mesh
+uniform bool instanced;
+
 void main()
 {
+    // Place the unit mesh of an instance in the world
+    vec4 worldPosition = position;
+    vec4 color = vertexColor;
+    if ( instanced == true)
+    {
+        worldPosition = vec4(instanceTransform.x + position.x * instanceTransform.z,
+                             instanceTransform.y + position.y * instanceTransform.z,
+                             position.z * instanceTransform.w,
+                             1.0);
+        color = instanceColor;
+    }
+
 	// Calculate the gl_Position for the vertex position
 	// Attention the same formula has to be set in the python
 	// code where normalized device coordinates are calculated.
-	vec4 camSpacePosition = cameraMatrix * position;
+	vec4 camSpacePosition = cameraMatrix * worldPosition;
 	gl_Position = perspectiveMatrix * camSpacePosition;
 
 	vec3 camSpaceNormal = normalize(lightingMatrix * normal);
@@ -48,7 +66,7 @@ void main()
     interpColor = directLightColor + ambientLightColor;
     if ( fogActive == true)
     {
-        float myDist = distance(playerPosition, position);
+        float myDist = distance(playerPosition, worldPosition);
         float fullViewDist = fogDistance * 0.75;
         float minimumClarity = 0.25;
         if ( myDist <= fullViewDist )
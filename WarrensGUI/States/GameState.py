@@ -32,6 +32,7 @@ class GameState(State):
         #self.window.setCameraCenterOnMap()
 
     def loopDraw(self):
+        self.window.startFrame()
         # Animate every frame
         self.window.animateDynamicObjects()
         # Redraw window
@@ -48,6 +49,7 @@ class GameState(State):
 
         # Handle game events
         self.window.progressGame()
+        self.window.endFrame()
 
     def handlePressedKeys(self):
         pressed = pygame.key.get_pressed()
@@ -121,6 +123,13 @@ class GameState(State):
                 GameMenuState(self.window,self).mainLoop()
             elif event.key == pygame.K_v:
                 self.window.cycleCameraMode()
+            # profiling
+            elif event.key == pygame.K_F3:
+                self.window.toggleProfiling()
+            elif event.key == pygame.K_F4:
+                self.window.captureProfile()
+            elif event.key == pygame.K_F5:
+                self.window.dumpProfile()
 
             # Handle keys that are active while playing
             if self.window.game.state == Game.PLAYING:
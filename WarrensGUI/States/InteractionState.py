@@ -153,9 +153,7 @@ class InteractionState(State):
     def takeAll(self):
         container = self.interaction.container
         player = self.interaction.player
-        for item in list(container.inventory.items):
-            container.removeItem(item)
-            player.addItem(item)
+        container.inventory.transferAll(player.inventory)
 
     def moveItemFromContainerToPlayer(self, item):
         container = self.interaction.container
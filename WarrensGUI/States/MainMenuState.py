@@ -1,7 +1,5 @@
 __author__ = 'Frostlock'
 
-import sys
-
 import pygame
 
 from WarrensGUI.States.State import MenuState
@@ -33,7 +31,7 @@ class MainMenuState(MenuState):
                          self.window.loadGame,
                          self.runDemoState,
                          self.window.legacyGui,
-                         sys.exit]
+                         self.window.quit]
         self.selected = 0
 
     def runDemoState(self):
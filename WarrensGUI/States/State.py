@@ -1,7 +1,5 @@
 __author__ = 'Frostlock'
 
-import sys
-
 import pygame
 from pygame.locals import *
 
@@ -81,7 +79,7 @@ class State(object):
     def handlePyGameEvent(self, event):
         # Quit
         if event.type == pygame.QUIT:
-            sys.exit()
+            self.window.quit()
         # Window resize
         elif event.type == VIDEORESIZE:
             self.window.resizeWindow(event.dict['size'])
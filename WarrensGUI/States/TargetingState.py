@@ -141,6 +141,7 @@ class TargetingState(State):
         # self.window.refreshStaticObjects()
         # self.window.loadVAOStaticObjects()
         # these kill performance as they would trigger whenever the mouse goes over a tile.
+        # Selecting a tile marks its chunk of the static mesh dirty, only that chunk is loaded again.
         #
         # You should not call
         # self.window.refreshStaticObjects()
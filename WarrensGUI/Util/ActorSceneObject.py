@@ -1,6 +1,6 @@
 __author__ = 'pi'
 
-from WarrensGUI.Util.SceneObject import SceneObject
+from WarrensGUI.Util.SceneObject import SceneObject, CUBE, PYRAMID
 from WarrensGUI.Util.OpenGlUtilities import normalizeColor, randomizeColor
 from WarrensGUI.Util.Utilities import getElementColor
 from WarrensGUI.Util.Constants import *
@@ -101,27 +101,43 @@ class ActorSceneObject(SceneObject):
         # Determine scale
         if isinstance(self.actor, Player):
             self.refreshMesh = self.generatePyramidMesh
+            self._shape = PYRAMID
             self.scale = 0.9
         elif isinstance(self.actor, Portal):
             self.refreshMesh = self.generateCubeMesh
+            self._shape = CUBE
             self.scale = 0.95
             self.alpha = 0.5
             variance = (100,10,10)
             self.effectColor = randomizeColor(actor.color, variance)
         elif isinstance(self.actor, Monster):
-            self.refreshMesh = generatePyramidMesh
+            self.refreshMesh = self.generatePyramidMesh
+            self._shape = PYRAMID
             self.scale = 0.7
         elif isinstance(self.actor, Item):
             self.refreshMesh = self.generateCubeMesh
+            self._shape = CUBE
             self.scale = 0.3
         elif isinstance(self.actor, Container):
             self.refreshMesh = self.generateCubeMesh
+            self._shape = CUBE
             self.scale = 0.6
         else:
             raise NotImplementedError("Unknown actor type")
 
         self.refreshMesh()
 
+    @property
+    def instance(self):
+        tile = self.actor.tile
+        # Offset within the tile area
+        offset = ((1 - self.scale) / 2) * TILESIZE
+        size = TILESIZE - (2 * offset)
+        height = size
+        if isinstance(self.actor, Character) and self.actor.currentHitPoints <= 0:
+            height = 0.05
+        return self._shape, (tile.x * TILESIZE + offset, tile.y * TILESIZE + offset, size, height), self.color
+
     def generatePyramidMesh(self):
         self._vertices = []
         self._colors = []
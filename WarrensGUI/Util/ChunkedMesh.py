@@ -0,0 +1,143 @@
+__author__ = 'Frostlock'
+
+
+class MeshChunk(object):
+    '''
+    The scene objects of a square area of the level, they are loaded together in their own buffers.
+    A dirty chunk has to be loaded again before it is drawn.
+    '''
+
+    @property
+    def key(self):
+        '''
+        (x, y) index of the chunk, None for the chunk with the objects that are not tiles.
+        '''
+        return self._key
+
+    @property
+    def index(self):
+        '''
+        Sequence number of the chunk within its mesh.
+        '''
+        return self._index
+
+    @property
+    def sceneObjects(self):
+        return self._sceneObjects
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @dirty.setter
+    def dirty(self, dirty):
+        self._dirty = dirty
+
+    @property
+    def elementsLength(self):
+        '''
+        Number of elements that were loaded for this chunk.
+        '''
+        return self._elementsLength
+
+    @elementsLength.setter
+    def elementsLength(self, length):
+        self._elementsLength = length
+
+    def __init__(self, key, index):
+        self._key = key
+        self._index = index
+        self._sceneObjects = []
+        self._dirty = True
+        self._elementsLength = 0
+
+
+class ChunkedMesh(object):
+    '''
+    Static mesh of a level, split in chunks of chunkSize by chunkSize tiles.
+    The map of the level reports which tiles changed, only the chunks with changed tiles have to be loaded again.
+    '''
+
+    @property
+    def chunkSize(self):
+        return self._chunkSize
+
+    @property
+    def chunks(self):
+        '''
+        List of the chunks in the order of their index.
+        '''
+        return self._chunks
+
+    @property
+    def dirtyChunks(self):
+        return [chunk for chunk in self._chunks if chunk.dirty]
+
+    def __init__(self, chunkSize):
+        '''
+        Constructor
+        :param chunkSize: width and height in tiles of a chunk
+        '''
+        self._chunkSize = chunkSize
+        self._chunks = []
+        self._chunksByKey = {}
+        self._map = None
+        self._tileChanges = None
+
+    def assign(self, sceneObjects, levelMap=None):
+        '''
+        Divides the scene objects over the chunks, all chunks are dirty afterwards.
+        Scene objects of tiles are assigned to the chunk of their tile, other objects share one chunk.
+        :param sceneObjects: list of static SceneObjects
+        :param levelMap: optional Map of the tiles, changes to this map are detected by detectChanges()
+        :return: None
+        '''
+        self._chunks = []
+        self._chunksByKey = {}
+        for obj in sceneObjects:
+            tile = getattr(obj, 'tile', None)
+            if tile is None:
+                key = None
+            else:
+                key = (tile.x // self._chunkSize, tile.y // self._chunkSize)
+            chunk = self._chunksByKey.get(key)
+            if chunk is None:
+                chunk = self._chunksByKey[key] = MeshChunk(key, len(self._chunks))
+                self._chunks.append(chunk)
+            chunk.sceneObjects.append(obj)
+            obj.chunk = chunk
+        self._map = levelMap
+        self._tileChanges = None
+        if levelMap is not None:
+            self._tileChanges = levelMap.trackChanges()
+
+    def markAllDirty(self):
+        '''
+        Marks all chunks dirty, for example after their buffers were lost.
+        :return: None
+        '''
+        for chunk in self._chunks:
+            chunk.dirty = True
+
+    def chunkAt(self, x, y):
+        '''
+        Returns the chunk with the tile at (x, y), None if there is no such chunk.
+        '''
+        return self._chunksByKey.get((x // self._chunkSize, y // self._chunkSize))
+
+    def detectChanges(self):
+        '''
+        Refreshes the meshes of the tiles that changed since the last call and marks their chunks dirty.
+        A tile changes when its data changes, for example when it gets blocked or unblocked, is explored or
+        changes color. Only the tiles reported by the map are visited.
+        :return: number of changed tiles
+        '''
+        if self._map is None:
+            return 0
+        positions = self._tileChanges.take()
+        for x, y in positions:
+            sceneObject = self._map.tiles[x][y].sceneObject
+            if sceneObject is not None and sceneObject.chunk is not None:
+                sceneObject.refreshMesh()
+                sceneObject.chunk.dirty = True
+        return len(positions)
@@ -27,6 +27,17 @@ CAM_LAST = 6 # Leave this one last, used to detect last mode when cycling camera
 CAM_MINIMUM_DISTANCE = 0.4
 CAM_MAXIMUM_DISTANCE = 5.0
 SAVE_FILE = "save.warrens"
+# New games are autosaved here so they do not overwrite the save file
+AUTOSAVE_FILE = "autosave.warrens"
+
+# Width and height in tiles of the chunks of the static level mesh
+CHUNK_SIZE = 16
+
+# Profiling output: F3 toggles the overlay, F4 captures cProfile statistics of
+# a number of frames and F5 writes the histograms of the overlay to JSON
+PROFILE_CAPTURE_FRAMES = 100
+PROFILE_CAPTURE_FILE = "frames.prof"
+PROFILE_JSON_FILE = "profile.json"
 
 ##########
 # COLORS #
@@ -0,0 +1,236 @@
+__author__ = 'Frostlock'
+
+from ctypes import c_void_p
+
+import numpy as np
+from OpenGL import GL
+from OpenGL.GL.ARB.vertex_array_object import glBindVertexArray, glGenVertexArrays, glDeleteVertexArrays
+from OpenGL.GL.ARB.instanced_arrays import glVertexAttribDivisorARB
+
+# Buffers never shrink below this size (in bytes) and grow by this factor
+MINIMUM_CAPACITY = 4096
+GROWTH_FACTOR = 2
+
+
+def growCapacity(capacity, needed):
+    '''
+    Returns the capacity a buffer needs to hold the given number of bytes.
+    The capacity grows geometrically so a slowly growing mesh only causes a few reallocations.
+    :param capacity: current capacity in bytes
+    :param needed: number of bytes the buffer has to hold
+    :return: new capacity in bytes
+    '''
+    capacity = max(capacity, MINIMUM_CAPACITY)
+    while capacity < needed:
+        capacity *= GROWTH_FACTOR
+    return capacity
+
+
+class GrowingBuffer(object):
+    '''
+    OpenGl buffer object that is created once and reused for every upload.
+    The storage is only reallocated when the data no longer fits.
+    '''
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def capacity(self):
+        '''
+        Number of bytes allocated on the GPU.
+        '''
+        return self._capacity
+
+    @property
+    def size(self):
+        '''
+        Number of bytes of the last upload.
+        '''
+        return self._size
+
+    def __init__(self, target, usage, orphan=False):
+        '''
+        Constructor
+        :param target: buffer target, GL_ARRAY_BUFFER or GL_ELEMENT_ARRAY_BUFFER
+        :param usage: usage hint for the storage, for example GL_STATIC_DRAW
+        :param orphan: True to orphan the storage before every upload. This avoids waiting for the GPU to finish
+                       drawing from a buffer that is updated every frame.
+        '''
+        self._target = target
+        self._usage = usage
+        self._orphan = orphan
+        self._id = GL.glGenBuffers(1)
+        self._capacity = 0
+        self._size = 0
+
+    def upload(self, data, size):
+        '''
+        Uploads data to the buffer, the buffer stays bound to its target.
+        :param data: ctypes array or numpy array with the data
+        :param size: number of bytes to upload
+        :return: None
+        '''
+        GL.glBindBuffer(self._target, self._id)
+        if size > self._capacity:
+            self._capacity = growCapacity(self._capacity, size)
+            GL.glBufferData(self._target, self._capacity, None, self._usage)
+        elif self._orphan:
+            GL.glBufferData(self._target, self._capacity, None, self._usage)
+        if size > 0:
+            GL.glBufferSubData(self._target, 0, size, data)
+        self._size = size
+
+    def release(self):
+        '''
+        Frees the buffer on the GPU, the buffer can not be used afterwards.
+        :return: None
+        '''
+        if self._id is not None:
+            GL.glDeleteBuffers(1, [self._id])
+        self._id = None
+        self._capacity = 0
+        self._size = 0
+
+
+class MeshBuffers(object):
+    '''
+    Pair of a vertex buffer and an element buffer for the meshes drawn by one vertex array object.
+    '''
+
+    @property
+    def vertices(self):
+        return self._vertices
+
+    @property
+    def elements(self):
+        return self._elements
+
+    def __init__(self, usage, orphan=False):
+        '''
+        Constructor
+        :param usage: usage hint for both buffers
+        :param orphan: True for buffers that are updated every frame
+        '''
+        self._vertices = GrowingBuffer(GL.GL_ARRAY_BUFFER, usage, orphan)
+        self._elements = GrowingBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, usage, orphan)
+
+    def release(self):
+        '''
+        Frees both buffers on the GPU.
+        :return: None
+        '''
+        self._vertices.release()
+        self._elements.release()
+
+
+# Floats per instance: x, y, size, height, R, G, B, A
+INSTANCE_COMPONENTS = 8
+SIZE_OF_FLOAT = 4
+
+
+class ShapeBuffers(MeshBuffers):
+    '''
+    Buffers with the unit mesh of a Shape, they are loaded once and shared by all instance batches of the shape.
+    '''
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def normalsOffset(self):
+        '''
+        Offset in bytes of the normals in the vertex buffer.
+        '''
+        return self._shape.vertices.nbytes
+
+    def __init__(self, shape):
+        super(ShapeBuffers, self).__init__(GL.GL_STATIC_DRAW)
+        self._shape = shape
+        vertexData = np.concatenate((shape.vertices.ravel(), shape.normals.ravel()))
+        self.vertices.upload(vertexData, vertexData.nbytes)
+        self.elements.upload(shape.triangleIndices, shape.triangleIndices.nbytes)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+
+
+class InstanceBatch(object):
+    '''
+    Instances of one shape that are drawn with a single glDrawElementsInstanced call.
+    Only the instance attributes are uploaded, the unit mesh comes from the shared ShapeBuffers.
+    '''
+
+    @property
+    def count(self):
+        '''
+        Number of loaded instances.
+        '''
+        return self._count
+
+    def __init__(self, shapeBuffers, usage, orphan=False):
+        '''
+        Constructor, sets up a Vertex Array Object that combines the unit mesh with the instance buffer.
+        :param shapeBuffers: ShapeBuffers of the shape
+        :param usage: usage hint for the instance buffer
+        :param orphan: True for instances that are updated every frame
+        '''
+        self._shapeBuffers = shapeBuffers
+        self._instances = GrowingBuffer(GL.GL_ARRAY_BUFFER, usage, orphan)
+        self._count = 0
+        self._vao = GL.GLuint(0)
+        glGenVertexArrays(1, self._vao)
+        glBindVertexArray(self._vao)
+        # Unit mesh: positions and normals, the color comes from the instance
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, shapeBuffers.vertices.id)
+        GL.glEnableVertexAttribArray(0)
+        GL.glVertexAttribPointer(0, 4, GL.GL_FLOAT, False, 0, None)
+        GL.glDisableVertexAttribArray(1)
+        GL.glEnableVertexAttribArray(2)
+        GL.glVertexAttribPointer(2, 3, GL.GL_FLOAT, False, 0, c_void_p(shapeBuffers.normalsOffset))
+        # Instance attributes advance once per instance
+        self._instances.upload(None, 0)
+        stride = INSTANCE_COMPONENTS * SIZE_OF_FLOAT
+        GL.glEnableVertexAttribArray(3)
+        GL.glVertexAttribPointer(3, 4, GL.GL_FLOAT, False, stride, None)
+        glVertexAttribDivisorARB(3, 1)
+        GL.glEnableVertexAttribArray(4)
+        GL.glVertexAttribPointer(4, 4, GL.GL_FLOAT, False, stride, c_void_p(4 * SIZE_OF_FLOAT))
+        glVertexAttribDivisorARB(4, 1)
+        # The element buffer binding is part of the VAO
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, shapeBuffers.elements.id)
+        glBindVertexArray(0)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+    def load(self, instanceData):
+        '''
+        Uploads the instances.
+        :param instanceData: float32 array with a row of INSTANCE_COMPONENTS attributes per instance
+        :return: None
+        '''
+        instanceData = np.ascontiguousarray(instanceData, np.float32)
+        self._instances.upload(instanceData, instanceData.nbytes)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        self._count = len(instanceData)
+
+    def draw(self):
+        '''
+        Draws the instances, the shader program has to be active with its instanced uniform set.
+        :return: None
+        '''
+        if self._count == 0:
+            return
+        glBindVertexArray(self._vao)
+        GL.glDrawElementsInstanced(GL.GL_TRIANGLES, len(self._shapeBuffers.shape.triangleIndices),
+                                   GL.GL_UNSIGNED_INT, None, self._count)
+        glBindVertexArray(0)
+
+    def release(self):
+        '''
+        Frees the instance buffer and the Vertex Array Object, the shared unit mesh stays.
+        :return: None
+        '''
+        self._instances.release()
+        glDeleteVertexArrays(1, [self._vao])
+        self._count = 0
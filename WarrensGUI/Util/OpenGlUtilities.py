@@ -128,11 +128,15 @@ def RGBcolor(color):
     elif len(color) == 4:
         return (int(color[0] * 255), int(color[1] * 255), int(color[2] * 255), int(color[3] * 255))
         
-def randomizeColor(color, variance):
+# Separate random stream for cosmetic color variations, this way rendering
+# does not influence the random numbers used by the game.
+colorRandom = random.Random(0)
+
+def randomizeColor(color, variance, rng=colorRandom):
         varianceR, varianceG, varianceB = variance
-        r = random.randrange(-varianceR / 2, varianceR / 2)
-        g = random.randrange(-varianceG / 2, varianceG / 2)
-        b = random.randrange(-varianceB / 2, varianceB / 2)
+        r = rng.randrange(-varianceR / 2, varianceR / 2)
+        g = rng.randrange(-varianceG / 2, varianceG / 2)
+        b = rng.randrange(-varianceB / 2, varianceB / 2)
         newColor = [color[0] + r, color[1] + g, color[2] + b]
         if newColor[0] < 0: newColor[0] = 0
         if newColor[0] > 255: newColor[0] = 255
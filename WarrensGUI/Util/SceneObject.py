@@ -1,8 +1,88 @@
 __author__ = 'pi'
 
 import random
+import numpy as np
 from WarrensGUI.Util.vec3 import vec3
 
+
+class Shape(object):
+    '''
+    Unit mesh that is shared by all instances of the shape.
+    The base of the mesh covers the unit square, the top is at height 1.
+    An instance places the base at (x, y), scales it by size and scales the height by height.
+    '''
+
+    def __init__(self, name, vertices, normals, triangleIndices):
+        self.name = name
+        self.vertices = np.array(vertices, np.float32)
+        self.normals = np.array(normals, np.float32)
+        self.triangleIndices = np.array(triangleIndices, np.uint32)
+
+
+# Same vertex order, normals and triangles as the tile and actor meshes
+CUBE = Shape('cube',
+             [(0.0, 0.0, 0.0, 1.0), (0.0, 1.0, 0.0, 1.0), (1.0, 1.0, 0.0, 1.0), (1.0, 0.0, 0.0, 1.0),
+              (0.0, 0.0, 1.0, 1.0), (0.0, 1.0, 1.0, 1.0), (1.0, 1.0, 1.0, 1.0), (1.0, 0.0, 1.0, 1.0)],
+             [(-1.0, -1.0, -0.01), (1.0, -1.0, -0.01), (1.0, 1.0, -0.01), (-1.0, 1.0, -0.01),
+              (-1.0, -1.0, -1.0), (1.0, -1.0, -1.0), (1.0, 1.0, -1.0), (-1.0, 1.0, -1.0)],
+             [0, 1, 2, 0, 2, 3, 0, 7, 4, 0, 3, 7, 3, 6, 7, 3, 2, 6,
+              2, 5, 6, 2, 1, 5, 1, 4, 5, 1, 0, 4, 4, 6, 5, 4, 7, 6])
+PYRAMID = Shape('pyramid',
+                [(0.0, 0.0, 0.0, 1.0), (0.0, 1.0, 0.0, 1.0), (1.0, 1.0, 0.0, 1.0), (1.0, 0.0, 0.0, 1.0),
+                 (0.5, 0.5, 1.0, 1.0)],
+                [(-1.0, 1.0, -0.2), (1.0, 1.0, -0.2), (1.0, -1.0, -0.2), (-1.0, -1.0, -0.2), (0.0, 0.0, -1.0)],
+                [0, 1, 2, 0, 2, 3, 0, 3, 4, 3, 2, 4, 2, 1, 4, 1, 0, 4])
+SHAPES = (CUBE, PYRAMID)
+
+
+def splitInstances(sceneObjects):
+    '''
+    Separates the scene objects that can be drawn as an instance of a shape from the ones that need their own mesh.
+    :param sceneObjects: list of SceneObjects
+    :return: tuple (meshObjects, instances), meshObjects is a list of SceneObjects and instances is a dictionary
+             with a float32 array per shape name. Every row of the array holds the instance attributes
+             x, y, size, height, R, G, B, A.
+    '''
+    meshObjects = []
+    rows = dict((shape.name, []) for shape in SHAPES)
+    for obj in sceneObjects:
+        instance = obj.instance
+        if instance is None:
+            meshObjects.append(obj)
+        else:
+            shape, transform, color = instance
+            rows[shape.name].append(transform + tuple(color))
+    instances = {}
+    for name, shapeRows in rows.items():
+        instances[name] = np.array(shapeRows, np.float32).reshape((len(shapeRows), 8))
+    return meshObjects, instances
+
+
+def assembleMeshes(sceneObjects):
+    '''
+    Batches the meshes of scene objects into the arrays that are loaded in the OpenGl buffers.
+    The vertex data holds all vertices, followed by all colors and all normals.
+    The triangle indices of every object are offset by the number of vertices that precede the object.
+    :param sceneObjects: list of SceneObjects
+    :return: tuple (vertexData, colorOffset, normalsOffset, elementData), vertexData is a float32 array,
+             the offsets are counted in floats and elementData is a uint32 array
+    '''
+    if len(sceneObjects) == 0:
+        return np.zeros(0, np.float32), 0, 0, np.zeros(0, np.uint32)
+    vertices = [obj.vertexArray for obj in sceneObjects]
+    colors = [obj.colorArray for obj in sceneObjects]
+    indices = [obj.indexArray for obj in sceneObjects]
+    vertexData = np.concatenate(vertices + colors + [obj.normalArray for obj in sceneObjects])
+    colorOffset = sum(len(v) for v in vertices)
+    normalsOffset = colorOffset + sum(len(c) for c in colors)
+    # Offset the indices of every object by the vertices of the objects before it
+    vertexCounts = np.array([len(v) // 4 for v in vertices], np.uint32)
+    firstVertex = np.cumsum(vertexCounts) - vertexCounts
+    indexCounts = [len(i) for i in indices]
+    elementData = np.concatenate(indices) + np.repeat(firstVertex, indexCounts)
+    return vertexData, colorOffset, normalsOffset, elementData.astype(np.uint32)
+
+
 class SceneObject(object):
     '''
     SceneObject defines an object that can be rendered in OpenGl
@@ -41,6 +121,42 @@ class SceneObject(object):
     def vertexCount(self):
         return len(self._vertices) / 4
 
+    @property
+    def instance(self):
+        '''
+        Description of this object as an instance of a shared shape.
+        :return: tuple (Shape, (x, y, size, height), RGBA color) or None if the object needs its own mesh
+        '''
+        return None
+
+    @property
+    def vertexArray(self):
+        '''
+        The vertices as a contiguous float32 numpy array.
+        '''
+        return self._asArray('_vertices', np.float32)
+
+    @property
+    def colorArray(self):
+        '''
+        The colors as a contiguous float32 numpy array.
+        '''
+        return self._asArray('_colors', np.float32)
+
+    @property
+    def normalArray(self):
+        '''
+        The normals as a contiguous float32 numpy array.
+        '''
+        return self._asArray('_normals', np.float32)
+
+    @property
+    def indexArray(self):
+        '''
+        The triangle indices as a contiguous uint32 numpy array.
+        '''
+        return self._asArray('_triangleIndices', np.uint32)
+
     @property
     def timeSinceLastAnimation(self):
         return self._timeSinceLastAnimation
@@ -67,6 +183,16 @@ class SceneObject(object):
         self._alpha = 1.0
         self._timeSinceLastAnimation = 0
         self._selected = False
+        self._arrays = {}
+
+    def _asArray(self, name, dtype):
+        # Meshes are rebuilt in new lists, the array is converted again when the list is replaced or grows
+        source = getattr(self, name)
+        cached = self._arrays.get(name)
+        if cached is None or cached[0] is not source or cached[1] != len(source):
+            cached = (source, len(source), np.array(source, dtype))
+            self._arrays[name] = cached
+        return cached[2]
 
     def animate(self, timePassed):
         self.timeSinceLastAnimation += timePassed
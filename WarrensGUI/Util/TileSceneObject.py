@@ -2,7 +2,7 @@ __author__ = 'pi'
 
 import random
 
-from WarrensGUI.Util.SceneObject import SceneObject
+from WarrensGUI.Util.SceneObject import SceneObject, CUBE
 from WarrensGUI.Util.OpenGlUtilities import randomizeColor
 from WarrensGUI.Util.Constants import *
 
@@ -14,6 +14,39 @@ class TileSceneObject(SceneObject):
     def tile(self):
         return self._tile
 
+    @property
+    def chunk(self):
+        '''
+        MeshChunk of the static level mesh that contains this tile, None if the tile is not in the mesh.
+        '''
+        return self._chunk
+
+    @chunk.setter
+    def chunk(self, chunk):
+        self._chunk = chunk
+
+    @property
+    def selected(self):
+        return self._selected
+
+    @selected.setter
+    def selected(self, selected):
+        if selected != self._selected:
+            self._selected = selected
+            # The selection changes the mesh, the chunk with this tile has to be loaded again
+            self.refreshMesh()
+            if self._chunk is not None:
+                self._chunk.dirty = True
+
+    @property
+    def instance(self):
+        # Water gets animated colors per vertex, it needs its own mesh
+        if self.tile.material == MaterialType.WATER:
+            return None
+        x = self.tile.x * TILESIZE
+        y = self.tile.y * TILESIZE
+        return CUBE, (x, y, TILESIZE, self.height), self._meshColor
+
     @property
     def height(self):
         if self.tile.blocked:
@@ -35,19 +68,12 @@ class TileSceneObject(SceneObject):
         super(TileSceneObject, self).__init__()
 
         self._tile = tile
+        self._chunk = None
         tile.sceneObject = self
 
-        #TODO: Unexplored tiles should not have any vertices. Easy to implement here but since all tiles are static objects they will not get rendered properly.
-        # Some ideas for review:
-        #   Add sceneobjects for gameobjects as these are encountered.
-        #   Add them first to dynamic objects
-        #   Move sceneobjects that go out of sight to static
-        #   Move tileSceneObjects that are empty to static
-        # Alternatively
-        #   Update only specific sections of the static buffer
-        #   Would need to use https://www.opengl.org/sdk/docs/man3/xhtml/glBufferSubData.xml
-        # Alternatively
-        #   Create more buffer objects (one per sceneObject is probably too many), only update changed buffer objects
+        #TODO: Unexplored tiles should not have any vertices.
+        # The static level mesh is split in chunks (see ChunkedMesh), a changed tile only causes its chunk to be
+        # loaded again. This makes it possible to leave unexplored tiles out of the mesh.
         self.refreshMesh()
 
     def refreshMesh(self):
@@ -74,6 +100,7 @@ class TileSceneObject(SceneObject):
         # Store the vertex colors
         # 4 components per color: R, G, B, A, one color for every vertex
         color = self.color
+        self._meshColor = color
         # 4 vertices for the bottom
         self.colors.extend(color)
         self.colors.extend(color)
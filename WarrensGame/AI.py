@@ -5,7 +5,8 @@
 ######
 import Actors
 import Utilities
-import random
+import CONSTANTS
+from Messages import MessageCategory
 
 # Possible directions for movement
 DIRECTIONS = [(-1, +0),
@@ -67,44 +68,56 @@ class BasicMonsterAI(AI):
         """
         Take one turn
         """
-        Utilities.message(self.character.name + ' at ' + str(self.character.tile) +
-                ' takes turn.', "AI")
+        #The tile is only converted to text when someone reads AI messages
+        bus = self.character.messageBus
+        bus.post(MessageCategory.AI, '%s at %s takes turn.', self.character.name, self.character.tile)
         #Only take action if we are in a level
         if self.character.level is None:
-            Utilities.message("   Not in a level, can't take action.", "AI")
+            bus.post(MessageCategory.AI, "   Not in a level, can't take action.")
             return
         #Only take action if we find the player
         if self.character.level.game.player is None:
-            Utilities.message("   No player found, staying put", "AI")
+            bus.post(MessageCategory.AI, "   No player found, staying put")
             return
 
         player = self.character.level.game.player
         #Only take action if player is not dead.
         if player.state == Actors.Character.DEAD:
-            Utilities.message("   Player is dead, no action needed", "AI")
+            bus.post(MessageCategory.AI, "   Player is dead, no action needed")
+            return
+
+        #Only take action if the player is on the same level
+        if player.level is not self.character.level:
+            bus.post(MessageCategory.AI, "   Player is on another level, staying put")
             return
 
         #TODO medium: read this from the config file via monsterlibrary via
         #new class variable in Character class
-        RoS = 8  # Range of Sight
         RoA = 2  # Range of Attack
-        distance = Utilities.distanceBetween(self.character, player)
+        #All monsters share the goal map of the player position, it is only
+        #computed once per turn and only as far as monsters can see.
+        goalMap = self.character.tile.map.getGoalMap([(player.tile.x, player.tile.y)],
+                                                     CONSTANTS.MONSTER_RANGE_OF_SIGHT)
+        x = self.character.tile.x
+        y = self.character.tile.y
+        distance = goalMap.cost(x, y)
         #message('   Player ' + self.player.name + ' found at ' + \
         #        str(self.player.tile) + ' distance: ' + str(distance), "AI")
 
         #Only take action if player is within range of sight
-        if distance > RoS:
+        if distance is None:
             #message("   Player out of range of sight", "AI")
             return
         #Attack if player is within range of attack
         elif distance < RoA:
-            Utilities.message("   Attacking player", "AI")
+            bus.post(MessageCategory.AI, "   Attacking player")
             self.character.attack(player)
             return
         else:
-            Utilities.message("   Moving towards player", "AI")
-            self.character.moveTowards(player)
-            return
+            bus.post(MessageCategory.AI, "   Moving towards player")
+            step = goalMap.nextStep(x, y)
+            if step is not None:
+                self.character.moveAlongVector(step[0] - x, step[1] - y)
 
 
 class ConfusedMonsterAI(AI):
@@ -132,7 +145,7 @@ class ConfusedMonsterAI(AI):
         Take one turn
         """
         # Try to move in a random direction
-        Utilities.message(self.character.name + ' stumbles around (confused).', "GAME")
+        self.character.messageBus.post(MessageCategory.GAME, '%s stumbles around (confused).', self.character.name)
         direction = self.randomDirection()
         if not direction is None:
             self.character.moveAlongVector(*direction)
@@ -141,7 +154,7 @@ class ConfusedMonsterAI(AI):
         self.confusedTurns -= 1
         if self.confusedTurns == 0:
             self.character.AI = self.originalAI
-            Utilities.message(self.character.name + ' is no longer confused.', "GAME")
+            self.character.messageBus.post(MessageCategory.GAME, '%s is no longer confused.', self.character.name)
 
     def randomDirection(self):
         '''
@@ -152,9 +165,10 @@ class ConfusedMonsterAI(AI):
         # Available directions, take a copy to work with
         directions = list(DIRECTIONS)
         targetDirection = None
+        rng = self.character.level.game.randomStreams.getStream('ai')
         while len(directions) > 0:
             # Find a random tile to move to
-            direction = random.choice(directions)
+            direction = rng.choice(directions)
             # Don't try the same direction again
             directions.remove(direction)
             x = self.character.tile.x + direction[0]
@@ -3,13 +3,18 @@
 #from Maps import Tile
 
 import random
-from Utilities import message, rollHitDie, GameError, distanceBetween, clamp
+from collections import namedtuple
+from Utilities import message, rollHitDie, GameError, distanceBetween, clamp, getMessageBus
+from Messages import MessageCategory
 import CONSTANTS
 import Effects #this is used in an eval statement
 import AI #this is used in an eval statement
 from Inventory import Inventory
 from Interaction import Interaction
 
+# Derived combat stats, see Character.stats and Item.stats
+Stats = namedtuple('Stats', ('accuracy', 'dodge', 'damage', 'armor', 'body', 'mind'))
+
 ##########
 # ACTORS #
 ##########
@@ -92,6 +97,8 @@ class Actor(object):
             self._tile.removeActor(self)
         self._tile = targetTile
         targetTile.addActor(self)
+        if self._level is not None:
+            self._level.moveActor(self, targetTile)
 
     @property
     def level(self):
@@ -158,6 +165,27 @@ class Actor(object):
     def sceneObject(self, sceneObject):
         self._sceneObject = sceneObject
 
+    @property
+    def messageBus(self):
+        """
+        Message bus of the game of this actor. Actors that are not on a level
+        use the message bus of the current thread.
+        """
+        if self._level is not None:
+            return self._level.game.messageBus
+        return getMessageBus()
+
+    @property
+    def random(self):
+        """
+        Random number generator for the actions of this actor.
+        Actors on a level use the combat stream of the game, other actors use
+        the random module.
+        """
+        if self._level is not None:
+            return self._level.game.randomStreams.getStream('combat')
+        return random
+
     def __init__(self):
         """
         Creates a new basic Actor, normally not used directly but should
@@ -193,7 +221,7 @@ class Actor(object):
         moves this actor to a random tile on the current level
         """
         if self.level is not None:
-            self.moveToTile(self.level.getRandomEmptyTile)
+            self.moveToTile(self.level.getRandomEmptyTile())
 
     def moveToTile(self, targetTile):
         """
@@ -214,6 +242,7 @@ class Actor(object):
         This method removes this actor from the level
         """
         if self.tile is not None:
+            self.tile.map.forgetPath(self)
             self.tile.removeActor(self)
         self._tile = None
         if self.level is not None:
@@ -237,19 +266,32 @@ class Actor(object):
 
     def moveTowards(self, targetActor):
         """
-        Moves this actor towards the provided actor.
+        Moves this actor one step along the shortest path towards the
+        provided actor. If there is no path, it moves in a straight line.
         arguments
             actor - the target Actor object
         """
-        #vector towards the target
-        dx = targetActor.tile.x - self.tile.x
-        dy = targetActor.tile.y - self.tile.y
-        #distance towards the target
-        distance = distanceBetween(self, targetActor)
-        #normalize it to length 1 (preserving direction), then round it and
-        #convert to integer so the movement is restricted to the map grid
-        dx = int(round(dx / distance))
-        dy = int(round(dy / distance))
+        myMap = self.tile.map
+        start = (self.tile.x, self.tile.y)
+        goal = (targetActor.tile.x, targetActor.tile.y)
+        path = myMap.getPath(self, start, goal, CONSTANTS.PATH_MAX_COST)
+        if path is None:
+            #vector towards the target
+            dx = targetActor.tile.x - self.tile.x
+            dy = targetActor.tile.y - self.tile.y
+            #distance towards the target
+            distance = distanceBetween(self, targetActor)
+            #normalize it to length 1 (preserving direction), then round it and
+            #convert to integer so the movement is restricted to the map grid
+            dx = int(round(dx / distance))
+            dy = int(round(dy / distance))
+        elif len(path) > 0 and path[0] != goal:
+            #first step of the path
+            dx = path[0][0] - start[0]
+            dy = path[0][1] - start[1]
+        else:
+            #already next to the target
+            return
         #move along the vector
         self.moveAlongVector(dx, dy)
 
@@ -289,6 +331,14 @@ class Portal(Actor):
         """
         return self._destination
 
+    @property
+    def destinationSeed(self):
+        """
+        The seed of the level where this portal leads to.
+        The destination level can be generated again from this seed.
+        """
+        return self._destination.level.seed
+
     def __init__(self):
         """
         Constructor to create a new portal
@@ -359,6 +409,13 @@ class Character(Actor):
         """
         return self._state
 
+    @property
+    def killer(self):
+        """
+        The Actor that killed this character, None while it is alive.
+        """
+        return self._killer
+
     @property
     def maxHitPoints(self):
         """
@@ -440,24 +497,47 @@ class Character(Actor):
     def baseMind(self):
         return self._baseMind
 
+    @property
+    def stats(self):
+        """
+        Derived combat stats of this character, the base stats plus the
+        bonuses of the equipment. They are computed once and kept until
+        invalidateStats() is called.
+        """
+        if self._stats is None:
+            self._stats = self._computeStats()
+        return self._stats
+
     @property
     def accuracy(self):
-        return self.baseAccuracy + self.equipmentBonusAccuracy
+        return self.stats.accuracy
     @property
     def dodge(self):
-        return self.baseDodge + self.equipmentBonusDodge
+        return self.stats.dodge
     @property
     def damage(self):
-        return self.baseDamage + self.equipmentBonusDamage
+        return self.stats.damage
     @property
     def armor(self):
-        return self.baseArmor + self.equipmentBonusArmor
+        return self.stats.armor
     @property
     def body(self):
-        return self.baseBody + self.equipmentBonusBody
+        return self.stats.body
     @property
     def mind(self):
-        return self.baseMind + self.equipmentBonusMind
+        return self.stats.mind
+
+    @property
+    def speed(self):
+        """
+        Speed of this character, a character of normal speed
+        (CONSTANTS.NORMAL_SPEED) acts once per turn.
+        """
+        return self._speed
+
+    @speed.setter
+    def speed(self, newSpeed):
+        self._speed = newSpeed
 
     @property
     def AI(self):
@@ -487,11 +567,14 @@ class Character(Actor):
         self._baseArmor = 10
         self._baseBody = 10
         self._baseMind = 10
+        self._stats = None
+        self._speed = CONSTANTS.NORMAL_SPEED
 
         #call super class constructor
         super(Character, self).__init__()
 
         self._xpValue = 0
+        self._killer = None
         self._AI = None
         self._state = Character.ACTIVE
 
@@ -511,6 +594,25 @@ class Character(Actor):
         """
         level.addCharacter(self)
 
+    def _computeStats(self):
+        """
+        Computes the derived combat stats of this character.
+        """
+        return Stats(self.baseAccuracy + self.equipmentBonusAccuracy,
+                     self.baseDodge + self.equipmentBonusDodge,
+                     self.baseDamage + self.equipmentBonusDamage,
+                     self.baseArmor + self.equipmentBonusArmor,
+                     self.baseBody + self.equipmentBonusBody,
+                     self.baseMind + self.equipmentBonusMind)
+
+    def invalidateStats(self):
+        """
+        Forgets the derived combat stats, they are computed again on the next
+        access. This has to be called when the base stats or the equipment of
+        this character change.
+        """
+        self._stats = None
+
     def addItem(self, item):
         """
         adding item puts it in this characters inventory
@@ -533,13 +635,14 @@ class Character(Actor):
         equipment slots. Should be overridden in subclass implementations.
         """
         #can only equip if item is in inventory
-        if item in self.inventory.items:
+        if item in self.inventory:
             #can only equip if not yet equiped
             if item not in self.equipedItems:
                 self.equipedItems.append(item)
                 item.isEquiped = True
-                message(self.name.capitalize() + ' equips a '
-                        + item.name + '.', "GAME")
+                self.invalidateStats()
+                self.messageBus.post(MessageCategory.GAME, '%s equips a %s.',
+                                     self.name.capitalize(), item.name)
 
     def unEquipItem(self, item):
         """
@@ -550,8 +653,9 @@ class Character(Actor):
         if item in self.equipedItems:
             self.equipedItems.remove(item)
             item.isEquiped = False
-            message(self.name.capitalize() + ' unequips a '
-                        + item.name + '.', "GAME")
+            self.invalidateStats()
+            self.messageBus.post(MessageCategory.GAME, '%s unequips a %s.',
+                                 self.name.capitalize(), item.name)
 
     def pickUpItem(self, item):
         """
@@ -564,8 +668,8 @@ class Character(Actor):
         #add the item to the inventory of this character
         self.addItem(item)
         #message
-        message(self.name.capitalize() + ' picks up a '
-                    + item.name + '.', "GAME")
+        self.messageBus.post(MessageCategory.GAME, '%s picks up a %s.',
+                             self.name.capitalize(), item.name)
 
     def dropItem(self, item):
         """
@@ -577,13 +681,13 @@ class Character(Actor):
         if item in self.equipedItems:
             self.unEquipItem(item)
         #if it is in the inventory remove it
-        if item in self.inventory.items:
+        if item in self.inventory:
             self.inventory.remove(item)
         #add it to the current tile of the character
         item.moveToLevel(self.level, self.tile)
         #message
-        message(self.name.capitalize() + ' drops a '
-                    + item.name + '.', "GAME")
+        self.messageBus.post(MessageCategory.GAME, '%s drops a %s.',
+                             self.name.capitalize(), item.name)
 
     def attack(self, target):
         """
@@ -592,13 +696,18 @@ class Character(Actor):
             target - the Character to be attacked
         """
         # Check if the attack hits
-        hitRoll = rollHitDie("1d100")
+        hitRoll = rollHitDie("1d100", self.random)
         # In case of an equal accuracy and dodge rating there is a 50% chance to hit
         toHit = 100 - (50 + self.accuracy - target.dodge)
-        message(self.name.capitalize() + ' attacks ' + target.name + ': ' + str(hitRoll) + ' vs ' + str(toHit), "COMBAT")
+        # Only name the attacker when someone reads the combat messages
+        bus = self.messageBus
+        name = None
+        if bus.isEnabled(MessageCategory.COMBAT):
+            name = self.name.capitalize()
+            bus.post(MessageCategory.COMBAT, '%s attacks %s: %s vs %s', name, target.name, hitRoll, toHit)
         if hitRoll < toHit:
             # Miss, no damage
-            message(self.name.capitalize() + ' attacks ' + target.name + ' but misses!', "COMBAT")
+            bus.post(MessageCategory.COMBAT, '%s attacks %s but misses!', name, target.name)
         else:
             # Hit, there will be damage, bonusDamage depends on how strongly the hit connects
             bonusDamagePercent = (hitRoll - toHit) / 100.0
@@ -606,10 +715,11 @@ class Character(Actor):
             # targets armor neutralizes part of the damage
             damage = int(damagePercent * self.damage) - target.armor
             if damage > 0:
-                message(self.name.capitalize() + ' attacks ' + target.name + ' and hits for ' + str(damage) + ' Damage (' + str(damagePercent) +' damage factor)', "COMBAT")
+                bus.post(MessageCategory.COMBAT, '%s attacks %s and hits for %s Damage (%s damage factor)',
+                         name, target.name, damage, damagePercent)
                 target.takeDamage(damage, self)
             else:
-                message(self.name.capitalize() + ' attacks ' + target.name + ' and hits but it has no effect.', "COMBAT")
+                bus.post(MessageCategory.COMBAT, '%s attacks %s and hits but it has no effect.', name, target.name)
 
     def takeDamage(self, amount, attacker):
         """
@@ -624,7 +734,9 @@ class Character(Actor):
                 self.currentHitPoints -= amount
             #check for death
             if self.currentHitPoints <= 0:
-                message(self.name.capitalize() + ' is killed!', "COMBAT")
+                bus = self.messageBus
+                if bus.isEnabled(MessageCategory.COMBAT):
+                    bus.post(MessageCategory.COMBAT, '%s is killed!', self.name.capitalize())
                 self._killedBy(attacker)
 
     def _killedBy(self, attacker):
@@ -634,16 +746,17 @@ class Character(Actor):
         if self.state == Character.ACTIVE:
             if type(attacker) is Player:
                 #yield experience to the player
-                message(attacker.name + ' gains ' + str(self.xpValue) + ' XP.', "GAME")
+                self.messageBus.post(MessageCategory.GAME, '%s gains %s XP.', attacker.name, self.xpValue)
                 attacker.gainXp(self.xpValue)
             if type(attacker) is Monster:
                 if attacker.killedByText != '':
-                    message(attacker.killedByText, "GAME")
+                    self.messageBus.post(MessageCategory.GAME, attacker.killedByText)
             #transform this character into a corpse and remove AI
             self._char = '%'
             self._AI = None
             self._name = self.name + ' corpse'
             self._state = Character.DEAD
+            self._killer = attacker
 
     def takeHeal(self, amount, healer):
         """
@@ -655,9 +768,8 @@ class Character(Actor):
         #heal by the given amount
         if amount > 0:
             self.currentHitPoints += amount
-            message(self.name.capitalize() + ' gains '
-                    + str(amount) + ' hitpoints from a ' +  healer.name
-                    + '.', "GAME")
+            self.messageBus.post(MessageCategory.GAME, '%s gains %s hitpoints from a %s.',
+                                 self.name.capitalize(), amount, healer.name)
 
     def takeTurn(self):
         """
@@ -703,10 +815,12 @@ class Player(Character):
     def direction(self,direction):
         self._direction = direction
 
-    def __init__(self):
+    def __init__(self, rng=random):
         """
         Creates and initializes new player object. Note that the object is not
         linked to a game tile. It should be moved to the tile after creation.
+        Arguments
+            rng - optional random.Random used to pick a name
         """
         #call super class constructor
         super(Player, self).__init__()
@@ -715,7 +829,7 @@ class Player(Character):
         #Actor properties
         self._key = 'player'
         self._char = '@'
-        self._name = random.choice(('Joe', 'Wesley', 'Frost'))
+        self._name = rng.choice(('Joe', 'Wesley', 'Frost'))
         #player is white
         self._color = (250,250,250)
         #Character properties
@@ -744,7 +858,7 @@ class Player(Character):
         '''
         Increase level of this player
         '''
-        message("You feel stronger!", "GAME")
+        self.messageBus.post(MessageCategory.GAME, "You feel stronger!")
         self._playerLevel += 1
         self._nextLevelXp = CONSTANTS.GAME_XP_BASE + CONSTANTS.GAME_XP_BASE * CONSTANTS.GAME_XP_FACTOR * (self.playerLevel * self.playerLevel - 1)
 
@@ -754,6 +868,7 @@ class Player(Character):
         self._baseArmor += CONSTANTS.GAME_PLAYER_LEVEL_ARMOR
         self._baseBody += CONSTANTS.GAME_PLAYER_LEVEL_BODY
         self._baseMind += CONSTANTS.GAME_PLAYER_LEVEL_MIND
+        self.invalidateStats()
          
     def gainXp(self, amount):
         """
@@ -771,9 +886,11 @@ class Player(Character):
         Send player through specified portal.
         """
         #Game message
-        message(portal.message, "GAME")
+        self.messageBus.post(MessageCategory.GAME, portal.message)
         #Move the player to the destination
         destinationLevel = portal.destinationPortal.level
+        #the destination level is generated the first time it is visited
+        destinationLevel.generate()
         destinationTile = portal.destinationPortal.tile
         self.moveToLevel(destinationLevel, destinationTile)
         #change the current level of the game to the destinationlevel
@@ -894,10 +1011,12 @@ class NPC(Character):
 
     NPC_NAMES = ["John", "Jake", "jacob", "Jeremy", "Mr J"]
 
-    def __init__(self):
+    def __init__(self, rng=random):
         """
         Creates and initializes new player object. Note that the object is not
         linked to a game tile. It should be moved to the tile after creation.
+        Arguments
+            rng - optional random.Random used to pick a name
         """
         #call super class constructor
         super(NPC, self).__init__()
@@ -906,7 +1025,7 @@ class NPC(Character):
         #Actor properties
         self._key = 'npc'
         self._char = '@'
-        self._name = random.choice(self.NPC_NAMES)
+        self._name = rng.choice(self.NPC_NAMES)
         #npcs are light grey
         self._color = (200,200,200)
         #Character properties
@@ -921,25 +1040,6 @@ class Monster(Character):
     Later we can consider more specialised subclasses
     for example Humanoid, Undead, Animal
     """
-    @property
-    def accuracy(self):
-        return self.baseAccuracy + self.modifierBonusAccuracy + self.equipmentBonusAccuracy
-    @property
-    def dodge(self):
-        return self.baseDodge + self.modifierBonusDodge + self.equipmentBonusDodge
-    @property
-    def damage(self):
-        return self.baseDamage + self.modifierBonusDamage + self.equipmentBonusDamage
-    @property
-    def armor(self):
-        return self.baseArmor + self.modifierBonusArmor + self.equipmentBonusArmor
-    @property
-    def body(self):
-        return self.baseBody + self.modifierBonusBody + self.equipmentBonusBody
-    @property
-    def mind(self):
-        return self.baseMind + self.modifierBonusMind + self.equipmentBonusMind
-
     @property
     def baseMonster(self):
         return self._baseMonster
@@ -1019,10 +1119,13 @@ class Monster(Character):
         """
         return self.baseMonster.killedBy
 
-    def __init__(self, baseMonster):
+    def __init__(self, baseMonster, rng=None):
         """
         Creates a new uninitialized Monster object.
         Use MonsterLibrary.createMonster() to create an initialized Monster.
+        Arguments
+            baseMonster - BaseMonster with the monster data
+            rng - optional random.Random used to roll the hit points
         """
         self._baseMonster = baseMonster
         self._modifiers = []
@@ -1033,7 +1136,7 @@ class Monster(Character):
         #Actor components
         self._key = baseMonster.key
         self._char = baseMonster.char
-        self._baseMaxHitPoints = rollHitDie(baseMonster.hitdie)
+        self._baseMaxHitPoints = rollHitDie(baseMonster.hitdie, rng)
         self._currentHitPoints = self._baseMaxHitPoints
         self._name = baseMonster.name
         self._flavorText = baseMonster.flavor
@@ -1045,6 +1148,26 @@ class Monster(Character):
         ai_class = eval('AI.' + baseMonster.AI)
         self._AI = ai_class and ai_class(self) or None
 
+    def _computeStats(self):
+        """
+        Computes the derived combat stats, monsters add the bonuses of their
+        modifiers.
+        """
+        stats = super(Monster, self)._computeStats()
+        return Stats(stats.accuracy + self.modifierBonusAccuracy,
+                     stats.dodge + self.modifierBonusDodge,
+                     stats.damage + self.modifierBonusDamage,
+                     stats.armor + self.modifierBonusArmor,
+                     stats.body + self.modifierBonusBody,
+                     stats.mind + self.modifierBonusMind)
+
+    def addModifier(self, modifier):
+        """
+        Attaches a modifier to this monster.
+        """
+        self._modifiers.append(modifier)
+        self.invalidateStats()
+
 #########
 # ITEMS #
 #########
@@ -1085,25 +1208,43 @@ class Item(Actor):
         Stack size setter
         '''
         self._stackSize = newStackSize
+        # The name shows the stack size
+        self._itemName = None
+
+    @property
+    def stats(self):
+        '''
+        Combat stats of this item, the bonuses of the base item plus the
+        bonuses of the modifiers. They are computed once, modifiers are
+        attached with addModifier().
+        '''
+        if self._stats is None:
+            self._stats = Stats(self.baseAccuracy + self.modifierBonusAccuracy,
+                                self.baseDodge + self.modifierBonusDodge,
+                                self.baseDamage + self.modifierBonusDamage,
+                                self.baseArmor + self.modifierBonusArmor,
+                                self.baseBody + self.modifierBonusBody,
+                                self.baseMind + self.modifierBonusMind)
+        return self._stats
 
     @property
     def accuracy(self):
-        return self.baseAccuracy + self.modifierBonusAccuracy
+        return self.stats.accuracy
     @property
     def dodge(self):
-        return self.baseDodge + self.modifierBonusDodge
+        return self.stats.dodge
     @property
     def damage(self):
-        return self.baseDamage + self.modifierBonusDamage
+        return self.stats.damage
     @property
     def armor(self):
-        return self.baseArmor + self.modifierBonusArmor
+        return self.stats.armor
     @property
     def body(self):
-        return self.baseBody + self.modifierBonusBody
+        return self.stats.body
     @property
     def mind(self):
-        return self.baseMind + self.modifierBonusMind
+        return self.stats.mind
 
     @property
     def baseItem(self):
@@ -1178,6 +1319,15 @@ class Item(Actor):
         '''
         Name of this Item
         '''
+        if self._itemName is None:
+            self._itemName = self._composeName()
+        return self._itemName
+
+    def _composeName(self):
+        '''
+        Composes the name of this item from the base item, the modifiers and
+        the stack size.
+        '''
         name = self.baseItem.name
         # Apply modifiers
         for modifier in self.modifiers:
@@ -1222,6 +1372,17 @@ class Item(Actor):
         """
         level.addItem(self)
 
+    def addModifier(self, modifier):
+        """
+        Attaches a modifier to this item.
+        """
+        self._modifiers.append(modifier)
+        self._stats = None
+        self._itemName = None
+        # The stats of the owner include the stats of the equipped items
+        if isinstance(self.owner, Character) and self in self.owner.equipedItems:
+            self.owner.invalidateStats()
+
     def __init__(self, baseItem):
         """
         Creates a new Item object, normally not used directly but called
@@ -1237,6 +1398,8 @@ class Item(Actor):
         self._currentHitPoints = self._baseMaxHitPoints
         self._name = baseItem.name
         self._modifiers = []
+        self._stats = None
+        self._itemName = None
         self._owner = None
 
         #Basic items are not stackable
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+###############
+# Alias table #
+###############
+
+# Weighted random selection with Walker's alias method. Building the table
+# takes linear time, after that every pick takes constant time: one random
+# number selects a column of the table and its fraction decides between the
+# entry of the column and the alias of the column.
+
+from Utilities import GameError
+
+
+class AliasTable(object):
+    """
+    Table for weighted random selection among a fixed list of entries.
+    """
+
+    @property
+    def entries(self):
+        """
+        Tuple with the entries of the table.
+        """
+        return self._entries
+
+    def __init__(self, entries, weights=None):
+        """
+        Constructor
+        Arguments
+            entries - list of the entries to pick from
+            weights - optional list with a positive weight per entry, by
+                      default all entries are equally likely
+        """
+        self._entries = tuple(entries)
+        n = len(self._entries)
+        if weights is None:
+            weights = [1] * n
+        if len(weights) != n:
+            raise GameError('An alias table needs one weight per entry')
+        if n > 0 and min(weights) <= 0:
+            raise GameError('The weights of an alias table must be positive')
+        self._probability = [1.0] * n
+        self._alias = range(n)
+        if n == 0:
+            return
+        # Scale the weights so that the average column is full
+        total = float(sum(weights))
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        # Fill up every column that is not full with a part of a large entry
+        while len(small) > 0 and len(large) > 0:
+            less = small.pop()
+            more = large.pop()
+            self._probability[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # The remaining columns are full, apart from rounding errors
+
+    def __len__(self):
+        return len(self._entries)
+
+    def pick(self, rng):
+        """
+        Returns a random entry.
+        Arguments
+            rng - random.Random or the random module
+        """
+        if len(self._entries) == 0:
+            raise GameError('Can not pick from an empty alias table')
+        column = rng.random() * len(self._entries)
+        # Rounding can make the column reach the size of the table
+        index = min(int(column), len(self._entries) - 1)
+        if column - index >= self._probability[index]:
+            index = self._alias[index]
+        return self._entries[index]
+
+    def sample(self, n, rng):
+        """
+        Returns a list of n random entries, entries can be picked more than
+        once.
+        Arguments
+            n - number of entries
+            rng - random.Random or the random module
+        """
+        if n > 0 and len(self._entries) == 0:
+            raise GameError('Can not pick from an empty alias table')
+        entries = self._entries
+        probability = self._probability
+        alias = self._alias
+        size = len(entries)
+        draw = rng.random
+        picks = []
+        for i in range(n):
+            column = draw() * size
+            index = min(int(column), size - 1)
+            if column - index >= probability[index]:
+                index = alias[index]
+            picks.append(entries[index])
+        return picks
@@ -39,13 +39,35 @@ TOWN_RADIUS = 30
 DATA_MONSTERS = "./WarrensGame/Monsters.csv"
 DATA_ITEMS = "./WarrensGame/Items.csv"
 DATA_ITEM_MODIFIERS = "./WarrensGame/ItemModifiers.csv"
+#binary cache of the compiled data files
+DATA_CACHE = "./WarrensGame/DataTables.cache"
 
 #config switches
+#number of game messages that are kept for the GUI
+MESSAGE_LOG_SIZE = 20
 SHOW_GAME_LOGGING = True
 SHOW_AI_LOGGING = False
 SHOW_COMBAT_LOGGING = True
 SHOW_GENERATION_LOGGING = True
 QUICKSTART = True
+#generate the levels next to the current level in a background thread
+PREFETCH_LEVELS = True
+#number of turns after which the autosave journal is compacted into the save file
+AUTOSAVE_COMPACT_TURNS = 200
+#maximum cost of a path that a monster looks for, this limits the search when the target can not be reached
+PATH_MAX_COST = 20
+#range in which monsters notice the player, measured along the path towards the player
+MONSTER_RANGE_OF_SIGHT = 8
+#width and height in tiles of the buckets in the spatial actor index of a level
+ACTOR_INDEX_BUCKET_SIZE = 8
+#number of latest durations that are kept in the rolling histograms of the profiler
+PROFILE_WINDOW = 300
+#monsters within this radius hear the player and wake up
+MONSTER_WAKE_RADIUS = 5
+#monsters that are further away from the player and out of view fall asleep
+MONSTER_SLEEP_RADIUS = 16
+#speed of a normal character, a character with twice this speed acts twice per turn
+NORMAL_SPEED = 100
 
 # Enumerator to describe the element of an effect.
 # The naming is intentionally without prefix, it looks nicer in the CSV files.
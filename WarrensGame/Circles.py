@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+###########
+# Circles #
+###########
+
+# Discs and rings of tiles around a center. The offsets of the tiles of a
+# disc only depend on its radius, they are computed once per radius and
+# shifted to the center when needed. Clipping to the map and filtering the
+# blocked tiles are done on the whole array of positions at once.
+
+import numpy
+
+# Offset tables per radius, every table is a tuple (dx, dy) of int arrays
+_discs = {}
+_rings = {}
+
+
+def discOffsets(radius):
+    """
+    Returns the offsets of the tiles of a filled disc, the tiles whose center
+    is within half a tile of the radius. The center comes first, the other
+    tiles are ordered by their distance to the center.
+    Returns
+        tuple (dx, dy) of numpy int arrays, do not modify them
+    """
+    offsets = _discs.get(radius)
+    if offsets is None:
+        dx, dy = numpy.mgrid[-radius:radius + 1, -radius:radius + 1]
+        distance = dx * dx + dy * dy
+        mask = distance <= radius * radius + radius
+        dx, dy, distance = dx[mask], dy[mask], distance[mask]
+        order = numpy.argsort(distance, kind='mergesort')
+        offsets = _discs[radius] = (dx[order], dy[order])
+    return offsets
+
+
+def ringOffsets(radius):
+    """
+    Returns the offsets of the tiles on the border of a disc: the tiles of
+    the disc with this radius that are not part of the disc with a radius
+    that is one smaller.
+    Returns
+        tuple (dx, dy) of numpy int arrays, do not modify them
+    """
+    offsets = _rings.get(radius)
+    if offsets is None:
+        dx, dy = discOffsets(radius)
+        if radius > 0:
+            inner = radius - 1
+            mask = dx * dx + dy * dy > inner * inner + inner
+            dx, dy = dx[mask], dy[mask]
+        offsets = _rings[radius] = (dx, dy)
+    return offsets
+
+
+def circlePositions(x, y, radius, width, height, ring=False, blocked=None, visible=None):
+    """
+    Returns the positions of a disc or a ring around (x, y) that are on the map.
+    Arguments
+        x, y - center of the circle
+        radius - radius of the circle
+        width, height - size of the map, positions outside are dropped
+        ring - True for the border of the circle only
+        blocked - optional 2D boolean array indexed [x, y], the positions
+                  where it is True are dropped
+        visible - optional set of (x, y) tuples, only these positions are
+                  kept
+    Returns
+        tuple (xs, ys) of numpy int arrays
+    """
+    if ring:
+        dx, dy = ringOffsets(radius)
+    else:
+        dx, dy = discOffsets(radius)
+    xs = dx + x
+    ys = dy + y
+    keep = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height)
+    xs, ys = xs[keep], ys[keep]
+    if blocked is not None:
+        keep = ~blocked[xs, ys]
+        xs, ys = xs[keep], ys[keep]
+    if visible is not None:
+        keep = numpy.array([(px, py) in visible for px, py in zip(xs.tolist(), ys.tolist())], dtype=bool)
+        if len(keep) > 0:
+            xs, ys = xs[keep], ys[keep]
+    return xs, ys
@@ -0,0 +1,274 @@
+#!/usr/bin/python
+
+###############
+# Data tables #
+###############
+
+# The monster, item and item modifier data is kept in CSV files. The files
+# are compiled once: every field is validated and converted to its type and
+# every row becomes an immutable template. The compiled tables are shared by
+# all games in the process and are cached in a binary file next to the CSV
+# files. The cache is keyed by a hash of the CSV files, editing a file
+# compiles the tables again.
+
+import ast
+import csv
+import hashlib
+import marshal
+import os
+
+import AI
+import CONSTANTS
+import Effects
+from Utilities import GameError
+
+# Increase when the columns or the conversions change, it invalidates the cache
+DATA_TABLES_VERSION = 1
+
+
+class Template(dict):
+    """
+    Immutable row of a data table, the fields are available as attributes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Constructor
+        Arguments
+            the same as for a dictionary
+        """
+        dict.__init__(self, *args, **kwargs)
+        object.__setattr__(self, '__dict__', self)
+
+    def _readOnly(self, *args, **kwargs):
+        raise GameError('Templates of the data tables can not be changed')
+
+    __setattr__ = __delattr__ = _readOnly
+    __setitem__ = __delitem__ = _readOnly
+    clear = pop = popitem = setdefault = update = _readOnly
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+class BaseMonster(Template):
+    """
+    Base monster, template with the data of a monster.
+    """
+
+
+class BaseItem(Template):
+    """
+    Base item, template with the data of an item.
+    """
+
+
+class ItemModifier(Template):
+    """
+    Item modifier, template with the data of an item modifier.
+    """
+
+
+def _text(value):
+    return value
+
+
+def _boolean(value):
+    if value not in ('True', 'False'):
+        raise ValueError('expected True or False')
+    return value == 'True'
+
+
+def _optionalBoolean(value):
+    if value == 'None':
+        return None
+    return _boolean(value)
+
+
+def _element(value):
+    """
+    Effect elements are written with the name of their CONSTANTS value.
+    """
+    if value == 'None':
+        return None
+    element = getattr(CONSTANTS, value, None)
+    if type(element) is not int:
+        raise ValueError('unknown element')
+    return element
+
+
+def _color(value):
+    color = ast.literal_eval(value)
+    if len(color) != 3 or not all(type(c) is int and 0 <= c <= 255 for c in color):
+        raise ValueError('expected [R,G,B]')
+    return tuple(color)
+
+
+def _classIn(module):
+    """
+    Returns a conversion that checks that the value names a class of the
+    module, 'None' is allowed for no class.
+    """
+    def convert(value):
+        if value != 'None' and not hasattr(module, value):
+            raise ValueError('unknown class')
+        return value
+    return convert
+
+
+_STATS = [('accuracy', int), ('dodge', int), ('damage', int),
+          ('armor', int), ('body', int), ('mind', int)]
+_BONUSES = [('bonusAccuracy', int), ('bonusDodge', int), ('bonusDamage', int),
+            ('bonusArmor', int), ('bonusBody', int), ('bonusMind', int)]
+
+# Columns of every table with the conversion of the fields
+MONSTER_COLUMNS = ([('key', _text), ('char', _text), ('name', _text), ('hitdie', _text),
+                    ('xp', int), ('unique', _boolean), ('challengeRating', int)]
+                   + _STATS +
+                   [('color', _color), ('flavor', _text), ('killedBy', _text), ('AI', _classIn(AI))])
+ITEM_COLUMNS = ([('key', _text), ('type', _text), ('char', _text), ('name', _text), ('itemLevel', int),
+                 ('effect', _classIn(Effects)), ('targeted', _optionalBoolean), ('effectRadius', int),
+                 ('effectHitDie', _text), ('effectDuration', int), ('effectElement', _element)]
+                + _BONUSES)
+MODIFIER_COLUMNS = ([('key', _text), ('type', _text), ('position', _text), ('name', _text),
+                     ('modifierLevel', int), ('effect', _classIn(Effects)), ('targeted', _optionalBoolean),
+                     ('effectRadius', int), ('effectHitDie', int), ('effectDuration', int),
+                     ('effectElement', _element)]
+                    + _BONUSES)
+
+
+def compileTable(fileName, columns):
+    """
+    Reads and validates a CSV data file.
+    Arguments
+        fileName - path of the CSV file
+        columns - list of (column name, conversion) tuples
+    Returns
+        list of rows, every row is a tuple with the converted fields in the
+        order of the columns
+    Raises
+        GameError that names the file, line and column of an invalid field
+    """
+    rows = []
+    keys = set()
+    with open(fileName, 'rb') as csvFile:
+        reader = csv.DictReader(csvFile, delimiter=',', quotechar='"')
+        missing = [name for name, convert in columns if name not in (reader.fieldnames or [])]
+        if len(missing) > 0:
+            raise GameError('%s misses the columns %s' % (fileName, ', '.join(missing)))
+        for rowData in reader:
+            row = []
+            for name, convert in columns:
+                try:
+                    row.append(convert(rowData[name]))
+                except (ValueError, TypeError, SyntaxError) as e:
+                    raise GameError('%s line %d, column %s: invalid value %r (%s)' % (
+                        fileName, reader.line_num, name, rowData[name], e))
+            if row[0] in keys:
+                raise GameError('%s line %d: duplicate key %s' % (fileName, reader.line_num, row[0]))
+            keys.add(row[0])
+            rows.append(tuple(row))
+    return rows
+
+
+class DataTables(object):
+    """
+    Compiled monster, item and item modifier tables. The tables hold
+    immutable templates and can be shared by any number of games.
+    """
+
+    def __init__(self, monsterRows, itemRows, modifierRows):
+        """
+        Constructor
+        Arguments
+            monsterRows, itemRows, modifierRows - rows as returned by
+                                                   compileTable()
+        """
+        self.monsters = self._templates(BaseMonster, MONSTER_COLUMNS, monsterRows)
+        self.items = self._templates(BaseItem, ITEM_COLUMNS, itemRows)
+        self.modifiers = self._templates(ItemModifier, MODIFIER_COLUMNS, modifierRows)
+        self.monsterIndex = dict((m.key, m) for m in self.monsters)
+        self.itemIndex = dict((i.key, i) for i in self.items)
+        self.modifierIndex = dict((m.key, m) for m in self.modifiers)
+        self.challengeIndex = self._levels(self.monsters, 'challengeRating')
+        self.itemLevelIndex = self._levels(self.items, 'itemLevel')
+        self.modifierLevelIndex = self._levels(self.modifiers, 'modifierLevel')
+
+    @staticmethod
+    def _templates(templateClass, columns, rows):
+        names = [name for name, convert in columns]
+        return tuple(templateClass(zip(names, row)) for row in rows)
+
+    @staticmethod
+    def _levels(templates, field):
+        """
+        Groups the templates by the value of a field, in file order.
+        """
+        levels = {}
+        for template in templates:
+            levels.setdefault(template[field], []).append(template)
+        return dict((level, tuple(group)) for level, group in levels.items())
+
+
+def sourceHash(fileNames):
+    """
+    Returns a hash of the contents of the data files and of the version of
+    the compiler.
+    """
+    digest = hashlib.sha1(str(DATA_TABLES_VERSION))
+    for fileName in fileNames:
+        with open(fileName, 'rb') as dataFile:
+            digest.update(dataFile.read())
+    return digest.hexdigest()
+
+
+def compileDataTables(monsterFile, itemFile, modifierFile, cacheFile=None):
+    """
+    Compiles the data files, the compiled rows are taken from the cache file
+    if it was written for the same data files.
+    Arguments
+        monsterFile, itemFile, modifierFile - paths of the CSV files
+        cacheFile - optional path of the binary cache file
+    Returns
+        DataTables
+    """
+    fileNames = (monsterFile, itemFile, modifierFile)
+    key = sourceHash(fileNames)
+    if cacheFile is not None:
+        try:
+            with open(cacheFile, 'rb') as cache:
+                cachedKey, rows = marshal.load(cache)
+            if cachedKey == key:
+                return DataTables(*rows)
+        except (IOError, EOFError, ValueError, TypeError):
+            # No usable cache, compile the tables again
+            pass
+    rows = (compileTable(monsterFile, MONSTER_COLUMNS),
+            compileTable(itemFile, ITEM_COLUMNS),
+            compileTable(modifierFile, MODIFIER_COLUMNS))
+    if cacheFile is not None:
+        try:
+            # Write a new file and move it in place, other processes never read half a cache
+            temporaryFile = '%s.%d' % (cacheFile, os.getpid())
+            with open(temporaryFile, 'wb') as cache:
+                marshal.dump((key, rows), cache)
+            os.rename(temporaryFile, cacheFile)
+        except (IOError, OSError):
+            # The tables work without a cache
+            pass
+    return DataTables(*rows)
+
+
+_dataTables = None
+
+
+def getDataTables():
+    """
+    Returns the data tables of the data files in CONSTANTS, they are
+    compiled on the first call and shared by all games in the process.
+    """
+    global _dataTables
+    if _dataTables is None:
+        _dataTables = compileDataTables(CONSTANTS.DATA_MONSTERS, CONSTANTS.DATA_ITEMS,
+                                        CONSTANTS.DATA_ITEM_MODIFIERS, CONSTANTS.DATA_CACHE)
+    return _dataTables
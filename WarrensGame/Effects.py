@@ -4,7 +4,8 @@
 # Magic/Event system #
 ######################
 
-from Utilities import rollHitDie, GameError, message
+from Utilities import rollHitDie, GameError
+from Messages import MessageCategory
 import AI
 import Actors
 from Maps import Tile
@@ -112,6 +113,15 @@ class Effect(object):
     def sceneObject(self, sceneObject):
         self._sceneObject = sceneObject
 
+    @property
+    def random(self):
+        """
+        Random number generator used to roll the size of this effect.
+        This is the effects stream of the game once the effect is applied,
+        None until then (rollHitDie falls back on the random module).
+        """
+        return self._random
+
     def __init__(self, source):
         """
         Constructor for a new Effect, meant to be used by the Effect subclasses.
@@ -125,6 +135,7 @@ class Effect(object):
         self._effectDuration = self.source.effectDuration
         self._effectDescription = "Description not set"
         self._sceneObject = None
+        self._random = None
 
     def applyTo(self, target):
         """
@@ -167,7 +178,9 @@ class HealEffect(MagicEffect):
         if not isinstance(target, Actors.Character):
             raise GameError("Can not apply healing effect to " + str(target))
         self.actors.append(target)
-        target.tile.map.level.game.activeEffects.append(self)
+        game = target.tile.map.level.game
+        self._random = game.randomStreams.getStream('effects')
+        game.activeEffects.append(self)
         self.tick()
 
     def tick(self):
@@ -180,7 +193,7 @@ class HealEffect(MagicEffect):
         self.effectDuration -= 1
         # Apply healing
         for target in self.actors:
-            healAmount = rollHitDie(self.effectHitDie)
+            healAmount = rollHitDie(self.effectHitDie, self.random)
             target.takeHeal(healAmount, self.source)
 
 class ConfuseEffect(MagicEffect):
@@ -207,7 +220,7 @@ class ConfuseEffect(MagicEffect):
         confusedTurns = self.effectDuration
         AI.ConfusedMonsterAI(self, target, confusedTurns)
         target.level.game.activeEffects.append(self)
-        message(target.name + ' is confused for ' + str(confusedTurns) + ' turns.', "GAME")
+        target.messageBus.post(MessageCategory.GAME, '%s is confused for %s turns.', target.name, confusedTurns)
 
     def tick(self):
         '''
@@ -241,6 +254,7 @@ class DamageEffect(MagicEffect):
         self._effectDescription = "The area is bombarded by magical energy."
         self._targetType = EffectTarget.TILE
         self._centerTile = None
+        self._positions = set()
 
     def applyTo(self, target):
         '''
@@ -276,10 +290,13 @@ class DamageEffect(MagicEffect):
         if not self.targeted:
             #exclude the center of the nova
             self.tiles.remove(self.centerTile)
+        self._positions = set((tile.x, tile.y) for tile in self.tiles)
+        game = self.centerTile.map.level.game
+        self._random = game.randomStreams.getStream('effects')
         # Tick for damage
         self.tick()
         # Register effect with Game
-        self.centerTile.map.level.game.activeEffects.append(self)
+        game.activeEffects.append(self)
 
     def tick(self):
         '''
@@ -290,13 +307,18 @@ class DamageEffect(MagicEffect):
         if self.effectDuration == 0: return
         self.effectDuration -= 1
         #find all targets in range
-        self._actors = []
-        for tile in self.tiles:
-            for actor in tile.actors:
-                self.actors.append(actor)
+        level = self.centerTile.map.level
+        #the circle tiles are rounded, they can be one tile beyond the radius
+        radius = self.effectRadius + 1
+        x = self.centerTile.x
+        y = self.centerTile.y
+        positions = level.actorIndex.position
+        self._actors = [actor for actor in level.actorsInRect(x - radius, y - radius, x + radius, y + radius)
+                        if positions(actor) in self._positions]
         #apply damage to every target
-        damageAmount = rollHitDie(self.effectHitDie)
+        damageAmount = rollHitDie(self.effectHitDie, self.random)
+        bus = level.game.messageBus
         for target in self.actors:
-            message(self.source.name.capitalize() + ' hits '
-                    + target.name + ' for ' + str(damageAmount) + ' Damage.', "GAME")
+            bus.post(MessageCategory.GAME, '%s hits %s for %s Damage.',
+                     self.source.name.capitalize(), target.name, damageAmount)
             target.takeDamage(damageAmount, self.source.owner)
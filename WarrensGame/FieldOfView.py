@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+#################
+# Field of view #
+#################
+
+import Utilities
+
+
+class FieldOfViewMode():
+    """
+    Enumerator for the available field of view algorithms.
+    """
+    # Reference implementation, checks line of sight towards every map position
+    BRESENHAM = 0
+    # Symmetric shadowcasting, only visits the positions within range of view
+    SHADOWCASTING = 1
+
+
+# Quadrant transformations, (depth, column) is mapped to
+# (x + depth * xx + column * xy, y + depth * yx + column * yy)
+_QUADRANTS = [(0, 1, -1, 0),  # north
+              (1, 0, 0, 1),   # east
+              (0, 1, 1, 0),   # south
+              (-1, 0, 0, 1)]  # west
+
+
+def computeFieldOfView(matrix, x, y, radius, mode=FieldOfViewMode.SHADOWCASTING):
+    """
+    Calculates the field of view from position (x, y).
+    Arguments
+        matrix - blocked sight matrix created with make_matrix(), values of
+                 0 or False are transparent, 1 or True block line of sight
+        x - x coordinate of the point of view
+        y - y coordinate of the point of view
+        radius - range of view
+        mode - FieldOfViewMode that selects the algorithm
+    Returns
+        set of (x, y) tuples for all visible positions
+    """
+    if mode == FieldOfViewMode.SHADOWCASTING:
+        return shadowcastFieldOfView(matrix, x, y, radius)
+    elif mode == FieldOfViewMode.BRESENHAM:
+        return bresenhamFieldOfView(matrix, x, y, radius)
+    else:
+        raise Utilities.GameError("Unknown field of view mode " + str(mode))
+
+
+def bresenhamFieldOfView(matrix, x, y, radius):
+    """
+    Reference field of view implementation.
+    Checks the Bresenham line of sight towards every position on the map.
+    This is slow (every map position is checked) but straightforward, it is
+    kept to validate the other algorithms.
+    """
+    visible = set()
+    width = len(matrix)
+    height = len(matrix[0]) if width > 0 else 0
+    for tx in range(width):
+        for ty in range(height):
+            if Utilities.distanceBetweenPoints(x, y, tx, ty) > radius:
+                continue
+            if Utilities.line_of_sight(matrix, x, y, tx, ty):
+                visible.add((tx, ty))
+    return visible
+
+
+def shadowcastFieldOfView(matrix, x, y, radius):
+    """
+    Symmetric shadowcasting field of view.
+    The area around the origin is split in four quadrants, each quadrant is
+    scanned row by row moving away from the origin. Blocking positions cast a
+    shadow on the rows behind them, only positions that are not in shadow and
+    within the radius are visited.
+
+    Slopes are kept as integer (numerator, denominator) pairs, this avoids
+    both floating point rounding issues and the cost of Fraction objects.
+
+    Source: https://www.albertford.com/shadowcasting/
+    """
+    width = len(matrix)
+    height = len(matrix[0]) if width > 0 else 0
+    radiusSquared = radius * radius
+    visible = set()
+    if 0 <= x < width and 0 <= y < height:
+        visible.add((x, y))
+
+    for xx, xy, yx, yy in _QUADRANTS:
+        # Transforms (depth, column) in this quadrant to map coordinates
+        def transform(depth, col):
+            return x + depth * xx + col * xy, y + depth * yx + col * yy
+
+        def isWall(depth, col):
+            mx, my = transform(depth, col)
+            # Positions off the map block line of sight
+            if mx < 0 or my < 0 or mx >= width or my >= height:
+                return True
+            return bool(matrix[mx][my])
+
+        def scan(depth, startSlope, endSlope):
+            # Slopes are (numerator, denominator) tuples
+            if depth > radius:
+                return
+            startNum, startDen = startSlope
+            endNum, endDen = endSlope
+            # Column range for this row, rounding ties towards the center
+            minCol = (2 * depth * startNum + startDen) // (2 * startDen)
+            maxCol = -((endDen - 2 * depth * endNum) // (2 * endDen))
+            prevWall = None
+            for col in range(minCol, maxCol + 1):
+                wall = isWall(depth, col)
+                # Reveal walls and the positions that are symmetrically visible
+                if wall or (col * startDen >= depth * startNum and col * endDen <= depth * endNum):
+                    if depth * depth + col * col <= radiusSquared:
+                        mx, my = transform(depth, col)
+                        if 0 <= mx < width and 0 <= my < height:
+                            visible.add((mx, my))
+                if prevWall is True and not wall:
+                    startNum, startDen = 2 * col - 1, 2 * depth
+                if prevWall is False and wall:
+                    scan(depth + 1, (startNum, startDen), (2 * col - 1, 2 * depth))
+                prevWall = wall
+            if prevWall is False:
+                scan(depth + 1, (startNum, startDen), (endNum, endDen))
+
+        scan(1, (-1, 1), (1, 1))
+    return visible
@@ -7,15 +7,22 @@ the class design documentation on the wiki first!
 @author: pi
 """
 
+import random
+import threading
+
 # Load proprietary modules
 import CONSTANTS
 import Utilities
+from Messages import MessageBus, MessageConsumer, ConsoleConsumer, MessageCategory, consoleMask
 from Maps import *
 from Levels import *
 from Actors import *
 from Libraries import *
 from AI import *
 from Effects import *
+from RandomStreams import RandomStreams
+import SaveGame
+import Journal
 
 
 class Game(object):
@@ -43,10 +50,18 @@ class Game(object):
     @property
     def messageBuffer(self):
         """
-        Returns a queue of game messages.
+        Returns a list with the text of the latest game messages.
         This is meant to be used by the GUI application to show the latest relevant game messages. 
         """
-        return Utilities.messageBuffer
+        return self._messageLog.texts
+
+    @property
+    def messageBus(self):
+        """
+        The message bus of this game, subscribe a Messages.MessageConsumer
+        to receive messages.
+        """
+        return self._messageBus
 
     @property
     def player(self):
@@ -75,6 +90,7 @@ class Game(object):
         Sets the current level
         """
         self._currentLevel = level
+        self.prefetchLevels(level)
 
     @property
     def activeEffects(self):
@@ -84,6 +100,14 @@ class Game(object):
         """
         return self._activeEffects
 
+    @property
+    def randomStreams(self):
+        """
+        The random number generators of this game.
+        :return: RandomStreams
+        """
+        return self._randomStreams
+
     @property
     def monsterLibrary(self):
         """
@@ -98,6 +122,28 @@ class Game(object):
         """
         return self._itemLibrary
 
+    @property
+    def generationLock(self):
+        """
+        Lock that is held while a level of this game is generated or
+        restored. Levels are generated in the background and on demand, the
+        lock ensures only one level at a time changes the libraries.
+        :return: threading.RLock
+        """
+        return self._generationLock
+
+    @property
+    def phaseTimer(self):
+        """
+        Optional Profiling.PhaseTimer that measures the phases of every turn
+        and the turn of every character, None by default.
+        """
+        return self._phaseTimer
+
+    @phaseTimer.setter
+    def phaseTimer(self, timer):
+        self._phaseTimer = timer
+
     def __init__(self):
         """
         Constructor to create a new game
@@ -107,24 +153,47 @@ class Game(object):
         self._player = None
         self._currentLevel = None
         self._activeEffects = []
+        self._prefetchThreads = []
+        self._prefetchStop = threading.Event()
+        self._generationLock = threading.RLock()
+        self._journal = None
+        self._phaseTimer = None
+        self._messageBus = MessageBus()
+        # The latest game and combat messages are kept for the GUI
+        self._messageLog = MessageConsumer(MessageCategory.GAME | MessageCategory.COMBAT,
+                                           CONSTANTS.MESSAGE_LOG_SIZE)
+        self._messageBus.subscribe(self._messageLog)
+        self._console = ConsoleConsumer()
+        self._messageBus.subscribe(self._console)
+        self._randomStreams = RandomStreams()
         # Initialize libraries
         self._monsterLibrary = MonsterLibrary()
         self._itemLibrary = ItemLibrary()
 
-    def resetGame(self):
+    def resetGame(self, seed=None):
         """
         Resets this Game class to a play a new game.
+        :param seed: optional world seed, the same seed results in the same world
         :rtype : None
         """
-        # Clear up
-        Utilities.resetMessageBuffer()
+        # Clear up, background generation of the previous game has to end first
+        self.stopPrefetch()
+        self._resetMessages()
         self._levels = []
 
-        # Generate a town level
+        # Initialize the random number generators
+        self._randomStreams = RandomStreams(seed)
+        # A new game starts without the monsters and items of the previous game
+        self._monsterLibrary = MonsterLibrary()
+        self._itemLibrary = ItemLibrary()
+        self.monsterLibrary.random = self.randomStreams.getStream('monsters')
+        self.itemLibrary.random = self.randomStreams.getStream('items')
+
+        # Create a town level, the other levels are only generated when
+        # they are needed.
         levelName = "Town"
         levelDifficulty = 1
-        Utilities.message("Generating level: " + levelName + '(difficulty:' + str(levelDifficulty) + ')', "GENERATION")
-        town = TownLevel(self, levelDifficulty, levelName)
+        town = TownLevel(self, levelDifficulty, levelName, self.getLevelSeed(levelName))
         self._levels.append(town)
         self._currentLevel = town
 
@@ -137,17 +206,32 @@ class Game(object):
         # Add a cave level
         self.addCaveLevel(2, [town, prevLevel])
 
+        # Decide where the unique monsters live
+        self.assignUniqueMonsters()
+
         # Create player
         self.resetPlayer()
 
         # Set the game state
         self._state = Game.PLAYING
 
+        # Prepare the levels the player can reach from the town
+        self.prefetchLevels(town)
+
         # Send welcome message to the player
-        Utilities.message('You are ' + self.player.name +
-                          ', a young and fearless adventurer. It is time to begin your '
-                          + 'legendary and without doubt heroic expedition into the '
-                          + 'unknown. Good luck!', "GAME")
+        self.messageBus.post(MessageCategory.GAME,
+                             'You are %s, a young and fearless adventurer. It is time to begin your '
+                             'legendary and without doubt heroic expedition into the '
+                             'unknown. Good luck!', self.player.name)
+
+    def _resetMessages(self):
+        """
+        Forgets the messages of the previous game and makes this game the
+        target of Utilities.message() on the current thread.
+        """
+        self._messageLog.clear()
+        self._console.mask = consoleMask()
+        Utilities.setMessageBus(self._messageBus)
 
     def addDungeonLevel(self, difficulty, connectedLevels):
         """
@@ -158,8 +242,7 @@ class Game(object):
         :rtype : None
         """
         levelName = 'Dungeon level ' + str(difficulty)
-        Utilities.message("Generating level: " + levelName + '(difficulty:' + str(difficulty) + ')', "GENERATION")
-        dungeonLevel = DungeonLevel(self, difficulty, levelName)
+        dungeonLevel = DungeonLevel(self, difficulty, levelName, self.getLevelSeed(levelName))
         self._levels.append(dungeonLevel)
         for lvl in connectedLevels:
             # Add portal in previous level to current level
@@ -167,13 +250,13 @@ class Game(object):
             downPortal.char = '>'
             downPortal.name = 'stairs down'
             downPortal.message = 'You follow the stairs down, looking for more adventure.'
-            downPortal.moveToLevel(lvl, lvl.getRandomEmptyTile())
+            lvl.placePortal(downPortal)
             # Add portal in current level to previous level
             upPortal = Portal()
             upPortal.char = '<'
             upPortal.name = 'stairs up'
             upPortal.message = 'You follow the stairs up, hoping to find the exit.'
-            upPortal.moveToLevel(dungeonLevel, dungeonLevel.getRandomEmptyTile())
+            dungeonLevel.placePortal(upPortal)
             # Connect the two portals
             downPortal.connectTo(upPortal)
 
@@ -186,8 +269,7 @@ class Game(object):
         :rtype : None
         """
         levelName = 'Cave of the Cannibal'
-        Utilities.message("Generating level: " + levelName + '(difficulty:' + str(difficulty) + ')', "GENERATION")
-        caveLevel = CaveLevel(self, difficulty, levelName)
+        caveLevel = CaveLevel(self, difficulty, levelName, self.getLevelSeed(levelName))
         self._levels.append(caveLevel)
 
         # For each connected level
@@ -198,22 +280,93 @@ class Game(object):
             downPortal.name = 'Pit'
             downPortal.message = 'You jump into the pit. As you fall deeper and deeper, you realize you didn\'t ' \
                                   'think about how to get back out afterward...'
-            downPortal.moveToLevel(lvl, lvl.getRandomEmptyTile())
+            lvl.placePortal(downPortal)
             # create a portal in the new cave that leads back
             upPortal = Portal()
             upPortal.char = '<'
             upPortal.name = 'Opening above'
             upPortal.message = 'After great difficulties you manage to get out of the pit.'
-            upPortal.moveToLevel(caveLevel, caveLevel.getRandomEmptyTile())
+            caveLevel.placePortal(upPortal)
             # connect the two portals
             downPortal.connectTo(upPortal)
 
+    def assignUniqueMonsters(self):
+        """
+        Decides on which dungeon level every unique monster lives. The
+        decision is derived from the world seed before any level is
+        generated, it does not depend on the order in which the levels are
+        visited.
+        :rtype : None
+        """
+        rng = random.Random(self.randomStreams.getSeed('uniques'))
+        dungeonLevels = [level for level in self.levels if isinstance(level, DungeonLevel)]
+        self.monsterLibrary.assignUniqueMonsters(dungeonLevels, rng)
+
+    def getLevelSeed(self, levelName):
+        """
+        Returns the seed for the level with the given name.
+        A level can be generated again from the world seed and its name.
+        :param levelName: unique name of the level
+        :rtype : integer
+        """
+        return self.randomStreams.getSeed('level:' + levelName)
+
+    def prefetchLevels(self, level):
+        """
+        Generates the levels that can be reached through the portals on the
+        given level in a background thread. This way the next level is
+        usually ready by the time the player follows a portal.
+        :param level: Level on which the player is located
+        :rtype : None
+        """
+        if not CONSTANTS.PREFETCH_LEVELS or level is None:
+            return
+        toGenerate = []
+        for portal in level.portals:
+            destinationLevel = portal.destinationPortal.level
+            if not destinationLevel.isGenerated and destinationLevel not in toGenerate:
+                toGenerate.append(destinationLevel)
+        if len(toGenerate) == 0:
+            return
+        # Forget the threads that are done, waitForPrefetch() joins the others
+        self._prefetchThreads = [t for t in self._prefetchThreads if t.is_alive()]
+        prefetchThread = threading.Thread(target=self._generateLevels, args=(toGenerate,))
+        prefetchThread.daemon = True
+        self._prefetchThreads.append(prefetchThread)
+        prefetchThread.start()
+
+    def _generateLevels(self, levels):
+        for level in levels:
+            if self._prefetchStop.is_set():
+                return
+            level.generate()
+
+    def waitForPrefetch(self):
+        """
+        Waits until the levels that are generated in the background are
+        ready.
+        :rtype : None
+        """
+        while len(self._prefetchThreads) > 0:
+            self._prefetchThreads.pop().join()
+
+    def stopPrefetch(self):
+        """
+        Stops the background generation of levels. The level that is being
+        generated is finished, the others are left for later.
+        This should be called before the game is shut down.
+        :rtype : None
+        """
+        self._prefetchStop.set()
+        self.waitForPrefetch()
+        self._prefetchStop.clear()
+
     def resetPlayer(self):
         """
         Reset the player for this game.
         :rtype : None
         """
-        self._player = Player()
+        self._player = Player(self.randomStreams.getStream('player'))
         firstLevel = self.levels[0]
         self.player.moveToLevel(firstLevel, firstLevel.getRandomEmptyTile())
 
@@ -258,7 +411,7 @@ class Game(object):
             chest.name = "Ancient chest"
             chest.flavorText = "A sturdy wooden chest. It looks very old."
             for i in range(1,15):
-                item = self.itemLibrary.getRandomItem(i)
+                item = self.itemLibrary.getRandomItem(i, self.randomStreams.getStream('quickstart'))
                 chest.inventory.add(item)
 
         firstLevel.map.updateFieldOfView(
@@ -269,21 +422,51 @@ class Game(object):
     def loadGame(self, fileName):
         """
         Loads game state from a file
-        :param fileName:
+        Only the current level is restored immediately, the other levels are
+        restored from the file when they are visited. Turns in the autosave
+        journal of the file are replayed.
+        :param fileName: path of the save file
         :rtype : None
         """
-        #TODO: Implement saving and loading of gamestate
-        raise NotImplementedError ("Loading not implemented.")
-        pass
+        self.stopAutosave()
+        self._resetMessages()
+        SaveGame.loadGame(self, fileName)
+        Journal.replay(self, fileName)
+        self.prefetchLevels(self.currentLevel)
 
     def saveGame(self, fileName):
         """
         Saves state of current game to a file.
-        :param fileName:
+        :param fileName: path of the save file
         :rtype : None
         """
-        raise NotImplementedError ("Saving not implemented.")
-        pass
+        if self._journal is not None and self._journal.fileName == fileName:
+            # Saving to the autosave file starts a new journal
+            self.startAutosave(fileName)
+            return
+        self.waitForPrefetch()
+        SaveGame.saveGame(self, fileName)
+
+    def startAutosave(self, fileName):
+        """
+        Saves the game to a file and records every following turn in the
+        autosave journal of the file. The journal is written in the
+        background, loading the file replays it.
+        :param fileName: path of the save file
+        :rtype : None
+        """
+        self.stopAutosave()
+        self.saveGame(fileName)
+        self._journal = Journal.Journal(self, fileName)
+
+    def stopAutosave(self):
+        """
+        Writes the remaining turns to the autosave journal and stops it.
+        :rtype : None
+        """
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
 
     def tryToPlayTurn(self):
         """
@@ -294,14 +477,22 @@ class Game(object):
         """
         # Wait for player to take action
         if self.player.actionTaken:
-            # Let characters take a turn
-            for c in self.currentLevel.characters:
-                assert isinstance(c, Character)
-                if c.state == Character.ACTIVE:
-                    c.takeTurn()
-                    c.actionTaken = False
+            Utilities.setMessageBus(self._messageBus)
+            timer = self._phaseTimer
+            # The turn is measured here unless the caller already started it
+            ownTurn = timer is not None and not timer.inTurn
+            if ownTurn:
+                timer.startTurn()
+            # Let the characters around the player take a turn
+            self.currentLevel.scheduler.playTurn(self.player)
+            # The next turn waits for a new action of the player
+            self.player.actionTaken = False
+            if timer is not None:
+                timer.mark('AI')
             # Update field of view
             self.currentLevel.map.updateFieldOfView(self.player.tile.x, self.player.tile.y)
+            if timer is not None:
+                timer.mark('FOV')
             # Let effects tick
             toRemove = []
             for effect in self.activeEffects:
@@ -312,6 +503,15 @@ class Game(object):
             # Remove effects that are no longer active
             for effect in toRemove:
                 self.activeEffects.remove(effect)
+            if timer is not None:
+                timer.mark('effects')
+            # Record the turn in the autosave journal
+            if self._journal is not None:
+                self._journal.recordTurn()
+                if timer is not None:
+                    timer.mark('journal')
+            if ownTurn:
+                timer.endTurn()
             return True
         else:
             return False
@@ -327,11 +527,7 @@ class Game(object):
             return []
         elif seeker.baseItem.effect == "DamageEffect":
             # Target can be an Actor or a Tile
-            targets = []
-            for tile in self.currentLevel.map.visible_tiles:
-                for actor in tile.actors:
-                    if isinstance(actor, Actor):
-                        targets.append(actor)
+            targets = self.currentLevel.actorsInView()
             targets.extend(self.currentLevel.map.visible_tiles)
             return targets
         elif seeker.baseItem.effect == "HealEffect":
@@ -340,11 +536,6 @@ class Game(object):
             return [self.player]
         elif seeker.baseItem.effect == "ConfuseEffect":
             # Target has to be of type Monster
-            targets = []
-            for tile in self.currentLevel.map.visible_tiles:
-                for actor in tile.actors:
-                    if isinstance(actor, Monster):
-                        targets.append(actor)
-            return targets
+            return [c for c in self.currentLevel.charactersInView() if isinstance(c, Monster)]
         else:
             raise GameError("Unknown effect type")
@@ -4,16 +4,29 @@ Created on Apr 13, 2014
 @author: pi
 '''
 
+def stackSignature(item):
+    '''
+    Returns the stack signature of an item, items with the same signature
+    stack. The signature is the key of the base item together with the
+    sorted keys of the modifiers, the order in which the modifiers were
+    added does not matter.
+    '''
+    return (item.key, tuple(sorted(mod.key for mod in item.modifiers)))
+
 class Inventory(object):
     '''
     This class represents an inventory of Items.
     It will stack incoming items if they are stackable.
+    The stackable items are indexed on their stack signature, finding,
+    stacking and removing an item does not scan the inventory.
     '''
 
     @property
     def items(self):
         '''
         Basic array of all items in this inventory
+        Use add() and remove() to change the inventory, the array should not
+        be changed directly.
         '''
         return self._items
 
@@ -30,7 +43,20 @@ class Inventory(object):
         '''
         self._items = []
         self._owner = character
-        
+        #set of the items, for fast membership tests
+        self._itemSet = set()
+        #stack signature -> stackable item
+        self._stacks = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __contains__(self, item):
+        return item in self._itemSet
+
     def add(self,newItem):
         '''
         Add an item to this inventory
@@ -38,36 +64,112 @@ class Inventory(object):
         newItem.owner = self.owner
         #if item is stackable
         if newItem.stackable:
+            signature = stackSignature(newItem)
             #Check if there is an identical item
-            existingItem = self.find(newItem)
+            existingItem = self._stacks.get(signature)
             if existingItem is None:
                 #If there is no existing item just add the new one
-                self.items.append(newItem)
+                self._stacks[signature] = newItem
+                self._append(newItem)
             else:
-                #Item already exists, increase the stack with one
-                existingItem.stackSize +=1
+                #Item already exists, increase the stack with the new stack
+                existingItem.stackSize += newItem.stackSize
         else:
             #Add non stackable item
-            self.items.append(newItem)
-    
+            self._append(newItem)
+
+    def _append(self, newItem):
+        self._items.append(newItem)
+        self._itemSet.add(newItem)
+
     def remove(self, removeItem):
         '''
         Remove an item from this inventory
+        Raises ValueError if the item is not in this inventory
+        '''
+        if removeItem not in self._itemSet:
+            raise ValueError('Item is not in the inventory')
+        self._forget(removeItem)
+        self._items.remove(removeItem)
+
+    def _forget(self, item):
         '''
-        self.items.remove(removeItem)
+        Removes an item from the set and the stack index, not from the list.
+        '''
+        self._itemSet.discard(item)
+        if item.stackable:
+            signature = stackSignature(item)
+            if self._stacks.get(signature) is item:
+                del self._stacks[signature]
+
+    def clear(self):
+        '''
+        Removes all items from this inventory
+        '''
+        del self._items[:]
+        self._itemSet.clear()
+        self._stacks.clear()
 
     def find(self, item):
         '''
-        Search this inventory for the specified item. with the specified itemID.
-        Matching is done based on itemID and modifierIDs.
+        Search this inventory for the specified item.
+        Matching is done based on the stack signature: the item key and the
+        modifier keys.
         Returns None if the item is not found
         '''
-        for availableItem in self.items:
-            # Same base item
-            if availableItem.key == item.key:
-                availableModKeys = [mod.key for mod in availableItem.modifiers]
-                itemModKeys = [mod.key for mod in item.modifiers]
-                # TODO: sort itemModKeys and availableModKeys alphabetically
-                if str(availableModKeys) == str(itemModKeys):
-                    return availableItem
+        signature = stackSignature(item)
+        if item.stackable:
+            return self._stacks.get(signature)
+        for availableItem in self._items:
+            if stackSignature(availableItem) == signature:
+                return availableItem
         return None
+
+    def transferMany(self, items, target):
+        '''
+        Moves items from this inventory to another inventory in one pass.
+        Equipped items are unequipped by the owner of this inventory first.
+        The items stack with the items of the target inventory.
+        Arguments
+            items - iterable of items of this inventory
+            target - Inventory that receives the items
+        Raises ValueError if one of the items is not in this inventory,
+        nothing is moved in that case.
+        '''
+        moving = set(items)
+        if len(moving) == 0 or target is self:
+            return
+        if not moving <= self._itemSet:
+            raise ValueError('Item is not in the inventory')
+        for item in moving:
+            if getattr(item, 'isEquiped', False):
+                self.owner.unEquipItem(item)
+        #keep the order of this inventory
+        remaining = []
+        moved = []
+        for item in self._items:
+            if item in moving:
+                moved.append(item)
+            else:
+                remaining.append(item)
+        for item in moved:
+            self._forget(item)
+        self._items[:] = remaining
+        for item in moved:
+            target.add(item)
+
+    def transferAll(self, target):
+        '''
+        Moves all items from this inventory to another inventory.
+        Arguments
+            target - Inventory that receives the items
+        '''
+        if target is self:
+            return
+        moved = list(self._items)
+        for item in moved:
+            if getattr(item, 'isEquiped', False):
+                self.owner.unEquipItem(item)
+        self.clear()
+        for item in moved:
+            target.add(item)
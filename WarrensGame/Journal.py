@@ -0,0 +1,388 @@
+#!/usr/bin/python
+
+####################
+# Autosave journal #
+####################
+
+# The journal is an append only file next to a save file. It contains the
+# changes of every turn that was played since the save file was written:
+# actor moves, hit point changes, newly explored tiles, items that are picked
+# up or dropped and effects that start or end. Recording a turn only looks at
+# the current level, the size of an entry depends on what changed.
+#
+# Entries are written by a background thread. Every so many turns the
+# journal is compacted: the save file is loaded, the journal is replayed on
+# it and the result is saved again, after which the journal starts over.
+# After a crash, loading the save file replays the journal.
+
+import marshal
+import os
+import Queue
+import struct
+import threading
+from itertools import chain
+
+import numpy
+
+import CONSTANTS
+from Messages import MessageCategory
+import Actors
+import SaveGame
+
+_ENTRY = struct.Struct('<I')
+
+# Markers for the writer thread
+_COMPACT = object()
+_STOP = object()
+
+
+def getJournalFileName(fileName):
+    """
+    Returns the name of the journal file of a save file.
+    """
+    return fileName + '.journal'
+
+
+class Journal(object):
+    """
+    Records the changes of every turn of a game in the journal of a save
+    file. The save file has to be written before the journal is started.
+    """
+
+    @property
+    def game(self):
+        """
+        The game that is recorded.
+        """
+        return self._game
+
+    @property
+    def fileName(self):
+        """
+        Path of the save file to which this journal belongs.
+        """
+        return self._fileName
+
+    def __init__(self, game, fileName):
+        """
+        Constructor to start a new journal, an existing journal of the save
+        file is discarded.
+        Arguments
+            game - Game to record
+            fileName - path of the save file that contains the game state
+        """
+        self._game = game
+        self._fileName = fileName
+        levels = SaveGame.allLevels(game)
+        self._levelIndex = dict((id(level), i) for i, level in enumerate(levels))
+        self._turns = 0
+        self._reset()
+        self._queue = Queue.Queue()
+        self._file = open(getJournalFileName(fileName), 'wb')
+        self._thread = threading.Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reset(self):
+        """
+        Forgets what was recorded, the next turn is recorded in full.
+        """
+        self._level = None
+        # Tracked actors on the current level, the position in the list is
+        # the reference to the actor.
+        self._actors = []
+        self._records = []
+        self._references = {}
+        self._explored = None
+        self._tileChanges = None
+        self._player = None
+        self._effects = []
+        self._state = None
+
+    def recordTurn(self):
+        """
+        Records the changes since the previous turn.
+        This is called by the Game after every turn.
+        """
+        game = self.game
+        changes = []
+        if game.currentLevel is not self._level:
+            changes.append(self._enterLevel(game.currentLevel))
+        else:
+            changes.extend(self._actorChanges())
+            explored = self._exploredChanges()
+            if len(explored) > 0:
+                changes.append(('explored', explored))
+        player = game.player
+        playerRecord = (self._levelIndex[id(player.level)], player.tile.x, player.tile.y,
+                        SaveGame.playerRecord(player))
+        if playerRecord != self._player:
+            self._player = playerRecord
+            changes.append(('player',) + playerRecord)
+        if len(game.activeEffects) > 0 or len(self._effects) > 0:
+            effects = self._effectRecords()
+            if effects != self._effects:
+                self._effects = effects
+                changes.append(('effects', effects))
+        if game.state != self._state:
+            self._state = game.state
+            changes.append(('state', game.state))
+        if len(changes) > 0:
+            self._queue.put(marshal.dumps(changes))
+        self._turns += 1
+        if self._turns >= CONSTANTS.AUTOSAVE_COMPACT_TURNS:
+            self._turns = 0
+            self._queue.put(_COMPACT)
+            # The compacted journal starts over with a full turn
+            self._reset()
+
+    def _track(self, actor, record):
+        self._references[id(actor)] = len(self._actors)
+        self._actors.append(actor)
+        self._records.append(record)
+
+    def _enterLevel(self, level):
+        """
+        Starts tracking a new current level, returns a change with the
+        state of all actors on the level.
+        """
+        self._reset()
+        self._level = level
+        records = []
+        for column in level.map.tiles:
+            for tile in column:
+                for actor in tile.actors:
+                    if actor is self.game.player or isinstance(actor, Actors.Portal):
+                        continue
+                    record = SaveGame.actorRecord(actor)
+                    self._track(actor, record)
+                    records.append(record)
+        self._explored = level.map.exploredLayer.copy()
+        self._tileChanges = level.map.trackChanges()
+        explored = numpy.flatnonzero(self._explored).tolist()
+        return ('level', self._levelIndex[id(level)], records, explored)
+
+    def _actorChanges(self):
+        """
+        Returns the changes of the actors on the current level.
+        """
+        changes = []
+        level = self._level
+        for reference, actor in enumerate(self._actors):
+            if actor is None:
+                continue
+            if actor.tile is None or actor.tile.map is not level.map:
+                # Picked up or otherwise removed from the level
+                changes.append(('remove', reference))
+                self._actors[reference] = None
+                del self._references[id(actor)]
+                continue
+            record = SaveGame.actorRecord(actor)
+            if record != self._records[reference]:
+                self._records[reference] = record
+                changes.append(('actor', reference, record))
+        for actor in chain(level.characters, level.items):
+            if actor is not self.game.player and id(actor) not in self._references:
+                # Dropped on the level
+                record = SaveGame.actorRecord(actor)
+                self._track(actor, record)
+                changes.append(('spawn', record))
+        return changes
+
+    def _exploredChanges(self):
+        """
+        Returns the flat indices of the tiles that were explored since the
+        previous turn. Only the tiles that changed since the previous turn
+        are checked.
+        """
+        explored = self._level.map.exploredLayer
+        height = explored.shape[1]
+        newlyExplored = []
+        for x, y in self._tileChanges.take():
+            if explored[x, y] and not self._explored[x, y]:
+                self._explored[x, y] = True
+                newlyExplored.append(x * height + y)
+        return sorted(newlyExplored)
+
+    def _effectRecords(self):
+        levelIndex = self._levelIndex
+        level = levelIndex[id(self._level)]
+        actorIndex = dict((actorId, (level, reference))
+                          for actorId, reference in self._references.items())
+        actorIndex[id(self.game.player)] = SaveGame.PLAYER_REFERENCE
+        return [SaveGame.effectRecord(effect, actorIndex, levelIndex)
+                for effect in self.game.activeEffects]
+
+    def flush(self):
+        """
+        Waits until all recorded turns are written.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes the recorded turns and stops the journal.
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._file.close()
+
+    def _write(self):
+        """
+        Main loop of the writer thread.
+        """
+        stop = False
+        while not stop:
+            entries = [self._queue.get()]
+            # Write everything that is waiting at once
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            for entry in entries:
+                if entry is _STOP:
+                    stop = True
+                elif entry is _COMPACT:
+                    self._sync()
+                    self._compact()
+                else:
+                    self._file.write(_ENTRY.pack(len(entry)))
+                    self._file.write(entry)
+            self._sync()
+            for entry in entries:
+                self._queue.task_done()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _compact(self):
+        """
+        Replays the journal on the save file and saves the result, after
+        which the journal is emptied.
+        """
+        try:
+            game = self.game.__class__()
+            SaveGame.loadGame(game, self.fileName)
+            replay(game, self.fileName)
+            SaveGame.saveGame(game, self.fileName)
+        except Exception as e:
+            # Keep the journal, it is replayed on the old save file
+            self.game.messageBus.post(MessageCategory.GAME, 'Autosave failed: %s', e)
+            return
+        self._file.seek(0)
+        self._file.truncate()
+
+
+class _Replay(object):
+    """
+    Applies the changes of journal entries to a game.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.levels = SaveGame.allLevels(game)
+        self.level = game.currentLevel
+        self.actors = []
+
+    def apply(self, change):
+        kind = change[0]
+        getattr(self, '_' + kind)(*change[1:])
+
+    def _resolveActor(self, reference):
+        if reference == SaveGame.PLAYER_REFERENCE:
+            return self.game.player
+        return self.actors[reference[1]]
+
+    def _level(self, levelNbr, records, explored):
+        game = self.game
+        level = self.levels[levelNbr]
+        self.level = level
+        game._currentLevel = level
+        # The recorded actors replace the actors that are on the level
+        lib = game.monsterLibrary
+        for column in level.map.tiles:
+            for tile in column:
+                for actor in list(tile.actors):
+                    if actor is game.player or isinstance(actor, Actors.Portal):
+                        continue
+                    actor.removeFromLevel()
+                    if actor in lib.uniqueMonsters:
+                        lib.uniqueMonsters.remove(actor)
+                    elif actor in lib.regularMonsters:
+                        lib.regularMonsters.remove(actor)
+        self.actors = [SaveGame.restoreActor(game, level, record) for record in records]
+        self._explored(explored)
+
+    def _explored(self, explored):
+        if len(explored) == 0:
+            return
+        myMap = self.level.map
+        myMap.exploredLayer.flat[explored] = True
+        myMap.tilesChanged(numpy.unravel_index(explored, myMap.exploredLayer.shape))
+
+    def _actor(self, reference, record):
+        SaveGame.updateActor(self.game, self.actors[reference], record, self.level)
+
+    def _spawn(self, record):
+        self.actors.append(SaveGame.restoreActor(self.game, self.level, record))
+
+    def _remove(self, reference):
+        self.actors[reference].removeFromLevel()
+        self.actors[reference] = None
+
+    def _player(self, levelNbr, x, y, record):
+        player = self.game.player
+        SaveGame.updatePlayer(self.game, player, record)
+        level = self.levels[levelNbr]
+        tile = level.map.tiles[x][y]
+        if player.level is not level:
+            player.moveToLevel(level, tile)
+        elif player.tile is not tile:
+            player.moveToTile(tile)
+
+    def _effects(self, records):
+        effects = [SaveGame.restoreEffect(self.game, self.levels, record, self._resolveActor)
+                   for record in records]
+        self.game._activeEffects = [effect for effect in effects if effect is not None]
+
+    def _state(self, state):
+        self.game._state = state
+
+
+def replay(game, fileName):
+    """
+    Replays the journal of a save file on a game that was loaded from the
+    save file. An incomplete entry at the end of the journal, for example
+    because the game crashed while writing it, is ignored.
+    Arguments
+        game - Game that was loaded from the save file
+        fileName - path of the save file
+    Returns
+        the number of replayed turns
+    """
+    journalFileName = getJournalFileName(fileName)
+    if not os.path.exists(journalFileName):
+        return 0
+    with open(journalFileName, 'rb') as journalFile:
+        data = journalFile.read()
+    journalReplay = _Replay(game)
+    turns = 0
+    offset = 0
+    while offset + _ENTRY.size <= len(data):
+        length, = _ENTRY.unpack_from(data, offset)
+        start = offset + _ENTRY.size
+        if start + length > len(data):
+            break
+        try:
+            changes = marshal.loads(data[start:start + length])
+        except (EOFError, ValueError, TypeError):
+            break
+        for change in changes:
+            journalReplay.apply(change)
+        offset = start + length
+        turns += 1
+    if turns > 0:
+        game.currentLevel.map.updateFieldOfView(game.player.tile.x, game.player.tile.y)
+    return turns
@@ -4,6 +4,9 @@ import CONSTANTS
 import Utilities
 import Actors 
 import Maps
+from SpatialIndex import ActorIndex
+from Scheduler import TurnScheduler
+from Messages import MessageCategory
 
 import random
 
@@ -34,11 +37,49 @@ class Level(object):
         """
         return self._difficulty
 
+    @property
+    def seed(self):
+        """
+        The seed used to generate this level.
+        """
+        return self._seed
+
+    @property
+    def random(self):
+        """
+        Random number generator used to generate this level.
+        It is seeded with the seed of the level.
+        """
+        return self._random
+
+    @property
+    def savedLevel(self):
+        """
+        Saved level data from which this level will be restored instead of
+        generated. None for levels that are not loaded from a saved game.
+        """
+        return self._savedLevel
+
+    @savedLevel.setter
+    def savedLevel(self, savedLevel):
+        self._savedLevel = savedLevel
+
+    @property
+    def isGenerated(self):
+        """
+        Boolean indicating if the map and the population of this level have
+        been generated.
+        """
+        return self._generated
+
     @property
     def map(self):
         """
         The map of this level
+        The level is generated the first time the map is requested.
         """
+        if not self._generated:
+            self.generate()
         return self._map
 
     @property
@@ -62,6 +103,21 @@ class Level(object):
         """
         return self._items
 
+    @property
+    def actorIndex(self):
+        """
+        Spatial index of the actors on this level, it is kept up to date
+        when actors move.
+        """
+        return self._actorIndex
+
+    @property
+    def scheduler(self):
+        """
+        Turn scheduler that decides which characters on this level act.
+        """
+        return self._scheduler
+
     @property
     def subLevels(self):
         """
@@ -70,13 +126,16 @@ class Level(object):
         return self._subLevels
 
     #constructor
-    def __init__(self, owner, difficulty, name):
+    def __init__(self, owner, difficulty, name, seed=None):
         """
         Constructor to create a new level.
+        The level is not generated yet, this happens when generate() is
+        called or when the map of the level is first requested.
         Arguments
             owner - Game object that owns this level
             difficulty - Difficulty of this level
             name - a textual name for this level
+            seed - optional seed for the generation of this level
         """
         self._game = owner
         self._difficulty = difficulty
@@ -84,7 +143,64 @@ class Level(object):
         self._portals = []
         self._characters = []
         self._items = []
+        # Position of every registered actor in the list it belongs to
+        self._listPositions = {}
+        self._actorIndex = ActorIndex(CONSTANTS.ACTOR_INDEX_BUCKET_SIZE)
+        self._scheduler = TurnScheduler(self)
         self._subLevels = []
+        if seed is None:
+            seed = random.getrandbits(32)
+        self._seed = seed
+        self._random = random.Random(seed)
+        self._map = None
+        self._generated = False
+        self._savedLevel = None
+        # Levels can be generated in a background thread. All levels of a game
+        # share one lock because generating a level changes the libraries of
+        # the game. Reentrant because the generation itself requests the map
+        # of the level and places portals on other levels.
+        self._generationLock = owner.generationLock
+
+    def generate(self):
+        """
+        Generates the map and the population of this level.
+        Levels from a saved game are restored from the saved data instead.
+        Portals that were placed on this level before it was generated are
+        moved to a random empty tile. Calling this on a level that is
+        already generated has no effect.
+        """
+        with self._generationLock:
+            if self._map is not None:
+                return
+            if self._savedLevel is not None:
+                self._savedLevel.restore()
+                self._savedLevel = None
+            else:
+                self.game.messageBus.post(MessageCategory.GENERATION, 'Generating level: %s(difficulty:%s)',
+                                          self.name, self.difficulty)
+                self._generateLevel()
+            for portal in self.portals:
+                if portal.tile is None:
+                    portal.moveToTile(self.getRandomEmptyTile())
+            self._generated = True
+
+    def _generateLevel(self):
+        """
+        This function generates the map and the population of the level.
+        It has to be overridden in the Level subclasses.
+        """
+        raise Utilities.GameError('Missing implementation _generateLevel()')
+
+    def placePortal(self, portal):
+        """
+        Places the given portal on a random empty tile of this level.
+        If the level is not generated yet, the portal is placed when the
+        level is generated.
+        """
+        with self._generationLock:
+            portal.level = self
+            if self._generated:
+                portal.moveToTile(self.getRandomEmptyTile())
 
     def removeActor(self, myActor):
         """
@@ -92,34 +208,90 @@ class Level(object):
         arguments
             myActor - the actor that should be removed
         """
-        for c in self.characters:
-            if c is myActor:
-                self.characters.remove(c)
-        for i in self.items:
-            if i is myActor:
-                self.items.remove(i)
+        self._actorIndex.remove(myActor)
+        self._scheduler.sleep(myActor)
+        entry = self._listPositions.pop(id(myActor), None)
+        if entry is None:
+            return
+        actors, position = entry
+        # Fill the gap with the last actor, this avoids shifting the list
+        last = actors.pop()
+        if last is not myActor:
+            actors[position] = last
+            self._listPositions[id(last)] = (actors, position)
+
+    def _register(self, actors, myActor):
+        if id(myActor) in self._listPositions:
+            return
+        self._listPositions[id(myActor)] = (actors, len(actors))
+        actors.append(myActor)
 
     def addPortal(self, portal):
         """
         Register the given portal to this level.
         """
-        self.portals.append(portal)
+        self._register(self.portals, portal)
 
     def addCharacter(self, character):
         """
         Register the given character to this level.
         """
-        self.characters.append(character)
+        self._register(self.characters, character)
 
     def addItem(self, item):
         """
         Register the given item to this level.
         """
-        self.items.append(item)
+        self._register(self.items, item)
+
+    def moveActor(self, myActor, tile):
+        """
+        Updates the position of an actor in the spatial index.
+        This is called when the actor moves to another tile.
+        arguments
+            myActor - the actor that moved
+            tile - the tile to which the actor moved
+        """
+        self._actorIndex.move(myActor, tile.x, tile.y)
+
+    def actorsInRadius(self, x, y, radius):
+        """
+        Returns the actors within the given distance of position (x, y).
+        """
+        return self._actorIndex.inRadius(x, y, radius)
+
+    def actorsInRect(self, x0, y0, x1, y1):
+        """
+        Returns the actors in the rectangle from (x0, y0) up to and including
+        (x1, y1).
+        """
+        return self._actorIndex.inRect(x0, y0, x1, y1)
+
+    def actorsInView(self):
+        """
+        Returns the actors on the tiles that are in view of the player.
+        """
+        myMap = self.map
+        visiblePositions = myMap.visiblePositions
+        if visiblePositions is None or myMap.viewOrigin is None:
+            return []
+        x, y = myMap.viewOrigin
+        reach = myMap.rangeOfView
+        positions = self._actorIndex.position
+        return [actor for actor in self._actorIndex.inRect(x - reach, y - reach, x + reach, y + reach)
+                if positions(actor) in visiblePositions]
+
+    def charactersInView(self):
+        """
+        Returns the characters on the tiles that are in view of the player.
+        """
+        return [actor for actor in self.actorsInView() if isinstance(actor, Actors.Character)]
 
     def getRandomEmptyTile(self):
         """
         Returns a randomly selected empty tile on this level.
+        Raises
+            GameError if the level has no empty tile left
         """
         if self.map is None:
             return None
@@ -131,16 +303,7 @@ class DungeonLevel(Level):
     Class representing a randomly generated dungeon level.
     """
 
-    def __init__(self, owner, difficulty, name):
-        """
-        Constructor to create a new generated level.
-        Arguments
-            owner - Game object that owns this level
-            difficulty - Difficulty of this level
-            name - a textual name for this level
-        """
-        #call constructor of super class
-        super(DungeonLevel, self).__init__(owner, difficulty, name)
+    def _generateLevel(self):
         #generate the map
         self._map = Maps.DungeonMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT, self)
         #add some monsters
@@ -161,19 +324,16 @@ class DungeonLevel(Level):
         #generate monsters for every room
         for room in self.map.rooms:
             #choose random number of monsters to create
-            num_monsters = random.randrange(0, max_monsters)
-            for i in range(num_monsters + 1):
-                #choose random spot for new monster
-                x = random.randrange(room.x1 + 1, room.x2 - 1)
-                y = random.randrange(room.y1 + 1, room.y2 - 1)
-                target_tile = self.map.tiles[x][y]
-
-                #only place it if the tile is not blocked and empty
-                if not target_tile.blocked and target_tile.empty:
+            num_monsters = self.random.randrange(0, max_monsters)
+            target_tiles = self._randomRoomTiles(room, num_monsters + 1)
+            #create the monsters of the room in one go
+            monsters = lib.getRandomMonsters(self.difficulty, len(target_tiles), self.random)
+            for new_monster, target_tile in zip(monsters, target_tiles):
+                new_monster.moveToLevel(self, target_tile)
 
-                    # get a random monster
-                    new_monster = lib.getRandomMonster(self.difficulty)
-                    new_monster.moveToLevel(self, target_tile)
+        #the unique monsters that live on this level
+        for new_monster in lib.createUniqueMonsters(self.name, self.random):
+            new_monster.moveToLevel(self, self.map.getRandomEmptyTile())
 
     def _placeItems(self):
         """
@@ -188,19 +348,29 @@ class DungeonLevel(Level):
         #generate items for every room
         for room in self.map.rooms:
             #choose random number of items to create
-            num_items = random.randrange(0, max_items)
-            for i in range(num_items + 1):
-                #choose random spot for new item
-                x = random.randrange(room.x1 + 1, room.x2 - 1)
-                y = random.randrange(room.y1 + 1, room.y2 - 1)
-                target_tile = self.map.tiles[x][y]
+            num_items = self.random.randrange(0, max_items)
+            target_tiles = self._randomRoomTiles(room, num_items + 1)
+            #create the items of the room in one go
+            items = lib.getRandomItems(self.difficulty, len(target_tiles), self.random)
+            for new_item, target_tile in zip(items, target_tiles):
+                new_item.moveToLevel(self, target_tile)
 
-                #only place it if the tile is not blocked and empty
-                if not target_tile.blocked and target_tile.empty:
-
-                    # get a random item
-                    new_item = lib.getRandomItem(self.difficulty)
-                    new_item.moveToLevel(self, target_tile)
+    def _randomRoomTiles(self, room, attempts):
+        """
+        Picks random spots inside a room, only the tiles that are not blocked
+        and empty are kept and every tile is kept only once.
+        arguments
+            room - Room in which the spots are picked
+            attempts - number of spots to pick
+        """
+        target_tiles = []
+        for i in range(attempts):
+            x = self.random.randrange(room.x1 + 1, room.x2 - 1)
+            y = self.random.randrange(room.y1 + 1, room.y2 - 1)
+            target_tile = self.map.tiles[x][y]
+            if not target_tile.blocked and target_tile.empty and target_tile not in target_tiles:
+                target_tiles.append(target_tile)
+        return target_tiles
 
 
 class TownLevel(Level):
@@ -208,16 +378,7 @@ class TownLevel(Level):
     Class representing a randomly generated town level.
     """
 
-    def __init__(self, owner, difficulty, name):
-        """
-        Constructor to create a new generated level.
-        Arguments
-            owner - Game object that owns this level
-            difficulty - Difficulty of this level
-            name - a textual name for this level
-        """
-        #call constructor of super class
-        super(TownLevel, self).__init__(owner, difficulty, name)
+    def _generateLevel(self):
         #generate the map
         self._map = Maps.TownMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT, self)
         #generate sublevels for the houses
@@ -238,7 +399,7 @@ class TownLevel(Level):
                 for x in [house.x1, house.x2]
                 for y in range(house.y1 + 1, house.y2 - 1)]
         #Select actual location randomly
-        doorX, doorY = random.choice(doorLocations)
+        doorX, doorY = self.random.choice(doorLocations)
         doorTile = self.map.tiles[doorX][doorY]
         #Cut a hole in the wall for the door (this time in the town map)
         doorTile.blocked = False
@@ -250,28 +411,20 @@ class TownLevel(Level):
         doorIn._name = 'door'
         doorIn._message = 'You enter the house.'
         doorIn.moveToLevel(self, doorTile)
-        #Generate the level that represents the interior of the house
-        houseLevel = SingleRoomLevel(self.game, self.difficulty, 'house', house)
+        #Create the level that represents the interior of the house, it is
+        #generated when the player enters the house
+        houseLevel = SingleRoomLevel(self.game, self.difficulty, 'house', house,
+                                     self.random.getrandbits(32))
         self.subLevels.append(houseLevel)
-        doorTile = houseLevel.map.tiles[doorX][doorY]
-        #Cut a hole in the wall for the door (this time in the House map)
-        doorTile.blocked = False
-        doorTile.blockSight = False
-        doorTile.material = Maps.MaterialType.DOOR
         #Create the door that leads out of the house
         doorOut = Actors.Portal()
         doorOut._char = '<'
         doorOut._name = 'door'
         doorOut._message = 'You leave the house.'
-        doorOut.moveToLevel(houseLevel, doorTile)
+        houseLevel.addDoor(doorOut, doorX, doorY)
         #Connect the two doors
         doorIn.connectTo(doorOut)
 
-        #Add an NPC in the house
-        tile = houseLevel.getRandomEmptyTile()
-        npc = Actors.NPC()
-        npc.moveToLevel(houseLevel, tile)
-
 
 class SingleRoomLevel(Level):
     """
@@ -280,11 +433,42 @@ class SingleRoomLevel(Level):
     arguments
         area - the area that represents the room
     """
-    def __init__(self, owner, difficulty, name, area):
+    def __init__(self, owner, difficulty, name, area, seed=None):
         #call constructor of super class
-        super(SingleRoomLevel, self).__init__(owner, difficulty, name)
+        super(SingleRoomLevel, self).__init__(owner, difficulty, name, seed)
+        self._area = area
+        self._doors = []
+
+    def addDoor(self, portal, x, y):
+        """
+        Adds a door in the wall of the room.
+        arguments
+            portal - Portal that represents the door
+            x, y - location of the door in the wall of the room
+        """
+        with self._generationLock:
+            portal.level = self
+            self._doors.append((portal, x, y))
+            if self.isGenerated:
+                self._cutDoor(portal, x, y)
+
+    def _cutDoor(self, portal, x, y):
+        doorTile = self.map.tiles[x][y]
+        #Cut a hole in the wall for the door
+        doorTile.blocked = False
+        doorTile.blockSight = False
+        doorTile.material = Maps.MaterialType.DOOR
+        portal.moveToTile(doorTile)
+
+    def _generateLevel(self):
         #generate the map
-        self._map = Maps.SingleRoomMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT, self, area)
+        self._map = Maps.SingleRoomMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT, self, self._area)
+        for portal, x, y in self._doors:
+            self._cutDoor(portal, x, y)
+        #Add an NPC in the room
+        tile = self.getRandomEmptyTile()
+        npc = Actors.NPC(self.random)
+        npc.moveToLevel(self, tile)
 
 
 class CaveLevel(Level):
@@ -292,16 +476,7 @@ class CaveLevel(Level):
     Class representing a randomly generated cave level.
     """
     
-    def __init__(self, owner, difficulty, name):
-        """
-        Constructor to create a new generated level.
-        Arguments
-            owner - Game object that owns this level
-            difficulty - Difficulty of this level
-            name - a textual name for this level
-        """
-        #call constructor of super class
-        super(CaveLevel, self).__init__(owner, difficulty, name)
+    def _generateLevel(self):
         #generate the map
         self._map = Maps.CaveMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT, self)
         #add some monsters
@@ -313,9 +488,9 @@ class CaveLevel(Level):
         #Grab the MonsterLibrary
         lib = self.game.monsterLibrary
         #Randomly determine nbr of monsters
-        nbr = random.randrange(0, 4)
+        nbr = self.random.randrange(0, 4)
         for i in range(0, nbr):
             randTile = self.map.getRandomEmptyTile()
-            new_monster = lib.generateMonster(2)
+            new_monster = lib.generateMonster(2, self.random)
             new_monster.moveToLevel(self, randTile)
             
\ No newline at end of file
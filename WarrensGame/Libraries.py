@@ -2,24 +2,11 @@
 from Actors import *
 from CONSTANTS import *
 from Utilities import GameError
+from DataTables import BaseMonster, BaseItem, ItemModifier, getDataTables
+from AliasTable import AliasTable
 
-import csv
 import random
 
-class BaseMonster(dict):
-    '''
-    Base monster, properties are generated from the dictionary
-    '''
-    def __init__(self, *args, **kwargs):
-        '''
-        Constructor
-        :param args: Dictionary object with the monster data
-        :param kwargs:
-        :return:
-        '''
-        super(BaseMonster, self).__init__(*args, **kwargs)
-        self.__dict__ = self
-
 class MonsterModifier(dict):
     '''
     Monster modifier, properties are generated from the dictionary
@@ -41,6 +28,18 @@ class MonsterLibrary():
     a population of monsters.
     '''
 
+    @property
+    def random(self):
+        """
+        Random number generator used when no other generator is given.
+        Defaults to the random module, the Game sets its monsters stream.
+        """
+        return self._random
+
+    @random.setter
+    def random(self, rng):
+        self._random = rng
+
     @property
     def uniqueMonsters(self):
         """
@@ -86,43 +85,35 @@ class MonsterLibrary():
     @property
     def challengeIndex(self):
         '''
-        Dictionary with an array of monster data dictionaries per challenge rating
+        Dictionary with a tuple of regular monster templates per challenge rating
         Keys are challenge rating.
-        :return: Dictionary of arrays
+        Unique monsters are not picked at random, see assignUniqueMonsters().
+        :return: Dictionary of tuples
         '''
         return self._challengeIndex
 
     def __init__(self):
         #initialize class variables
+        self._random = random
         self._uniqueMonsters = []
         self._regularMonsters = []
-        self._monsterIndex = {}
-        self._challengeIndex = {}
 
-        # read data from CSV file
-        with open(DATA_MONSTERS, "rb") as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
-            for monsterDataDict in reader:
-                # Ensure incoming data from csv file is interpreted correctly
-                monsterDataDict["accuracy"] = int(monsterDataDict["accuracy"])
-                monsterDataDict["dodge"] = int(monsterDataDict["dodge"])
-                monsterDataDict["damage"] = int(monsterDataDict["damage"])
-                monsterDataDict["armor"] = int(monsterDataDict["armor"])
-                monsterDataDict["body"] = int(monsterDataDict["body"])
-                monsterDataDict["mind"] = int(monsterDataDict["mind"])
-
-                monsterDataDict["xp"] = int(monsterDataDict["xp"])
-                monsterDataDict["unique"] = eval(monsterDataDict["unique"])
-                monsterDataDict["challengeRating"] = int(monsterDataDict["challengeRating"])
-                monsterDataDict["color"] = eval(monsterDataDict["color"])
-                # Create the BaseMonster object
-                baseMonster = BaseMonster(monsterDataDict)
-                # Register the monster data in the data dictionary
-                self.monsterIndex[baseMonster.key]=baseMonster
-                # Register the monster data in the challenge dictionary
-                if not int(baseMonster.challengeRating) in self.challengeIndex.keys():
-                    self.challengeIndex[baseMonster.challengeRating] = []
-                self.challengeIndex[baseMonster.challengeRating].append(baseMonster)
+        # The monster templates are shared, unique monsters are left out of
+        # the challenge index. The index and the spawn tables never change, the
+        # monsters of a level do not depend on the levels generated before it.
+        tables = getDataTables()
+        self._monsterIndex = dict(tables.monsterIndex)
+        self._challengeIndex = {}
+        for rating, group in tables.challengeIndex.items():
+            regular = tuple(m for m in group if not m.unique)
+            if len(regular) > 0:
+                self._challengeIndex[rating] = regular
+        # Keys of the unique monsters that exist on a level that is not loaded
+        self._reservedUniques = set()
+        # Keys of the unique monsters that live on a level, per level name
+        self._uniqueLevels = {}
+        # Spawn table per maximum challenge rating, built when first needed
+        self._spawnTables = {}
 
     def getMaxMonstersPerRoomForDifficulty(self, difficulty):
         #maximum number of monsters per room
@@ -130,24 +121,61 @@ class MonsterLibrary():
         if max_monsters == 0: max_monsters = 1
         return max_monsters
 
-    def getRandomMonster(self, maxChallengeRating):
-        # Determine possibilities
-        while not maxChallengeRating in self.challengeIndex.keys():
-            maxChallengeRating -= 1
-            if maxChallengeRating <= 0: raise GameError("No monsters available below the give challenge rating")
-        # Make a random choice
-        possibilities = self.challengeIndex[maxChallengeRating]
-        selection = random.choice(possibilities)
+    def getRandomMonster(self, maxChallengeRating, rng=None):
+        '''
+        Creates a random monster up to the given challenge rating.
+        :param maxChallengeRating: maximum challenge rating
+        :param rng: optional random.Random, defaults to the random of this library
+        :return: Monster
+        '''
+        if rng is None:
+            rng = self.random
+        selection = self._spawnTable(maxChallengeRating).pick(rng)
         # create the monster
-        monster = self.createMonster(selection.key)
+        monster = self.createMonster(selection.key, rng)
         return monster
 
-    def createMonster(self, monster_key):
+    def getRandomMonsters(self, maxChallengeRating, count, rng=None):
+        '''
+        Creates a number of random monsters up to the given challenge rating in one go.
+        This is used to populate a whole room or level at once.
+        :param maxChallengeRating: maximum challenge rating
+        :param count: number of monsters
+        :param rng: optional random.Random, defaults to the random of this library
+        :return: list of Monsters
+        '''
+        if rng is None:
+            rng = self.random
+        monsters = []
+        for selection in self._spawnTable(maxChallengeRating).sample(count, rng):
+            monsters.append(self.createMonster(selection.key, rng))
+        return monsters
+
+    def _spawnTable(self, maxChallengeRating):
+        '''
+        Returns the table to pick monsters up to the given challenge rating from.
+        The table holds the monsters of the highest available challenge rating.
+        :param maxChallengeRating: maximum challenge rating
+        :return: AliasTable
+        '''
+        table = self._spawnTables.get(maxChallengeRating)
+        if table is None:
+            ratings = [rating for rating in self.challengeIndex.keys() if 0 < rating <= maxChallengeRating]
+            if len(ratings) == 0:
+                raise GameError("No monsters available below the give challenge rating")
+            table = AliasTable(self.challengeIndex[max(ratings)])
+            self._spawnTables[maxChallengeRating] = table
+        return table
+
+    def createMonster(self, monster_key, rng=None):
         '''
         Function to create and initialize a new Monster.
         :param monster_key: string that identifies a monster in the config file.
+        :param rng: optional random.Random, defaults to the random of this library
         :return: Monster
         '''
+        if rng is None:
+            rng = self.random
         # load the monster data from the config
         baseMonster = self.monsterIndex[monster_key]
 
@@ -161,23 +189,73 @@ class MonsterLibrary():
                 raise GameError('Unique monster' + monster_key + ' already exists.')
 
         #create monster
-        newMonster = Monster(baseMonster)
+        newMonster = Monster(baseMonster, rng)
 
         # register the monster
         if baseMonster.unique:
             self.uniqueMonsters.append(newMonster)
-            #Avoid randomly recreating the same unique monster in the future
-            self.challengeIndex[baseMonster.challengeRating].remove(baseMonster)
-            if len(self.challengeIndex[baseMonster.challengeRating]) == 0:
-                del self.challengeIndex[baseMonster.challengeRating]
+            #Avoid recreating the same unique monster in the future
+            self.reserveUniqueMonster(monster_key)
         else:
             self.regularMonsters.append(newMonster)
         return newMonster
 
-    def generateMonster(self,difficulty):
+    def reserveUniqueMonster(self, monster_key):
+        '''
+        Ensures a unique monster is no longer created by createUniqueMonsters().
+        This is used when a unique monster already exists, for example on a
+        level of a saved game that is not yet loaded.
+        :param monster_key: string that identifies a unique monster
+        :return: None
+        '''
+        self._reservedUniques.add(monster_key)
+
+    def assignUniqueMonsters(self, levels, rng):
+        '''
+        Decides on which level every unique monster lives. A unique monster
+        goes to one of the levels on which monsters of its challenge rating
+        are picked. The assignment only depends on the given random number
+        generator, not on the order in which the levels are generated.
+        :param levels: list of the levels that can hold unique monsters
+        :param rng: random.Random, the Game seeds it from the world seed
+        :return: None
+        '''
+        ratings = [rating for rating in set(m.challengeRating for m in self.monsterIndex.values())
+                   if rating > 0]
+        self._uniqueLevels = {}
+        for key in sorted(self.monsterIndex.keys()):
+            baseMonster = self.monsterIndex[key]
+            if not baseMonster.unique:
+                continue
+            candidates = []
+            for level in levels:
+                levelRatings = [rating for rating in ratings if rating <= level.difficulty]
+                if len(levelRatings) > 0 and max(levelRatings) == baseMonster.challengeRating:
+                    candidates.append(level)
+            if len(candidates) > 0:
+                levelName = rng.choice(candidates).name
+                self._uniqueLevels.setdefault(levelName, []).append(key)
+
+    def createUniqueMonsters(self, levelName, rng=None):
+        '''
+        Creates the unique monsters that live on a level, unique monsters
+        that already exist are skipped.
+        :param levelName: name of the level
+        :param rng: optional random.Random, defaults to the random of this library
+        :return: list of Monsters
+        '''
+        if rng is None:
+            rng = self.random
+        existing = set(m.key for m in self.uniqueMonsters) | self._reservedUniques
+        return [self.createMonster(key, rng) for key in self._uniqueLevels.get(levelName, [])
+                if key not in existing]
+
+    def generateMonster(self, difficulty, rng=None):
         '''
         Completely random generation of a monster, not based on the csv data file.
         '''
+        if rng is None:
+            rng = self.random
         #message('generating monster from scratch', 'GENERATION')
 
         monster_data = {}
@@ -206,46 +284,30 @@ class MonsterLibrary():
 
         #create monster
         baseMonster = BaseMonster(monster_data)
-        newMonster = Monster(baseMonster)
+        newMonster = Monster(baseMonster, rng)
 
         # register the monster
         self.regularMonsters.append(newMonster)
         return newMonster
 
-class BaseItem(dict):
-    '''
-    Base Item, properties are generated from the dictionary
-    '''
-    def __init__(self, *args, **kwargs):
-        '''
-        Constructor
-        :param args: Dictionary object with the item data
-        :param kwargs:
-        :return:
-        '''
-        super(BaseItem, self).__init__(*args, **kwargs)
-        self.__dict__ = self
-
-class ItemModifier(dict):
-    '''
-    Item modifier, properties are generated from the dictionary
-    '''
-    def __init__(self, *args, **kwargs):
-        '''
-        Constructor
-        :param args: Dictionary object with the item modifier data
-        :param kwargs:
-        :return:
-        '''
-        super(ItemModifier, self).__init__(*args, **kwargs)
-        self.__dict__ = self
-
 class ItemLibrary():
     '''
     This class represents a library of items. Logic to create items is
     implemented in this class.
     '''
 
+    @property
+    def random(self):
+        """
+        Random number generator used when no other generator is given.
+        Defaults to the random module, the Game sets its items stream.
+        """
+        return self._random
+
+    @random.setter
+    def random(self, rng):
+        self._random = rng
+
     @property
     def items(self):
         '''
@@ -272,9 +334,9 @@ class ItemLibrary():
     @property
     def itemLevelIndex(self):
         '''
-        Dictionary with an array of item data dictionaries per Item Level
+        Dictionary with a tuple of item templates per Item Level
         Keys are Item Level.
-        :return: Dictionary of arrays
+        :return: Dictionary of tuples
         '''
         return self._itemLevelIndex
 
@@ -296,9 +358,9 @@ class ItemLibrary():
     @property
     def modifierLevelIndex(self):
         '''
-        Dictionary with an array of item modifier data dictionaries per modifier level
+        Dictionary with a tuple of item modifier templates per modifier level
         Keys are Modifier Level.
-        :return: Dictionary of arrays
+        :return: Dictionary of tuples
         '''
         return self._modifierLevelIndex
 
@@ -307,62 +369,18 @@ class ItemLibrary():
         Constructor to create a new item library
         '''
         #initialize class variables
+        self._random = random
         self._items = []
-        self._itemIndex = {}
-        self._itemLevelIndex = {}
-        self._modifierIndex = {}
-        self._modifierLevelIndex = {}
-
-        # read item data from CSV file
-        with open(DATA_ITEMS, "rb") as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
-            for itemDataDict in reader:
-                # Ensure incoming data from csv file is interpreted correctly
-                itemDataDict["itemLevel"] = int(itemDataDict["itemLevel"])
-                itemDataDict["targeted"] = eval(itemDataDict["targeted"])
-                itemDataDict["effectRadius"] = int(itemDataDict["effectRadius"])
-                itemDataDict["effectDuration"] = int(itemDataDict["effectDuration"])
-                itemDataDict["effectElement"] = eval(itemDataDict["effectElement"])
-                itemDataDict["bonusAccuracy"]= int(itemDataDict["bonusAccuracy"])
-                itemDataDict["bonusDodge"] = int(itemDataDict["bonusDodge"])
-                itemDataDict["bonusDamage"] = int(itemDataDict["bonusDamage"])
-                itemDataDict["bonusArmor"] = int(itemDataDict["bonusArmor"])
-                itemDataDict["bonusBody"] = int(itemDataDict["bonusBody"])
-                itemDataDict["bonusMind"] = int(itemDataDict["bonusMind"])
-                # Create the BaseItem object
-                baseItem = BaseItem(itemDataDict)
-                # Register the item data in the data dictionary
-                self.itemIndex[baseItem.key]=baseItem
-                # Register the item data in the item level dictionary
-                if not int(baseItem.itemLevel) in self.itemLevelIndex.keys():
-                    self.itemLevelIndex[int(baseItem.itemLevel)] = []
-                self.itemLevelIndex[int(baseItem.itemLevel)].append(baseItem)
-
-        # read item modifier data from CSV file
-        with open(DATA_ITEM_MODIFIERS, "rb") as csvfile:
-            reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
-            for modifierDataDict in reader:
-                # Ensure incoming data from csv file is interpreted correctly
-                modifierDataDict["modifierLevel"] = int(modifierDataDict["modifierLevel"])
-                modifierDataDict["targeted"] = eval(modifierDataDict["targeted"])
-                modifierDataDict["effectRadius"] = int(modifierDataDict["effectRadius"])
-                modifierDataDict["effectHitDie"] = int(modifierDataDict["effectHitDie"])
-                modifierDataDict["effectDuration"] = int(modifierDataDict["effectDuration"])
-                modifierDataDict["effectElement"] = eval(modifierDataDict["effectElement"])
-                modifierDataDict["bonusAccuracy"]= int(modifierDataDict["bonusAccuracy"])
-                modifierDataDict["bonusDodge"] = int(modifierDataDict["bonusDodge"])
-                modifierDataDict["bonusDamage"] = int(modifierDataDict["bonusDamage"])
-                modifierDataDict["bonusArmor"] = int(modifierDataDict["bonusArmor"])
-                modifierDataDict["bonusBody"] = int(modifierDataDict["bonusBody"])
-                modifierDataDict["bonusMind"] = int(modifierDataDict["bonusMind"])
-                # Create the ItemModifier object
-                itemModifier = ItemModifier(modifierDataDict)
-                # Register the item modifier data in the data dictionary
-                self.modifierIndex[itemModifier.key]=itemModifier
-                # Register the item modifier data in the modifier level dictionary
-                if not int(itemModifier.modifierLevel) in self.modifierLevelIndex.keys():
-                    self.modifierLevelIndex[int(itemModifier.modifierLevel)] = []
-                self.modifierLevelIndex[int(itemModifier.modifierLevel)].append(itemModifier)
+
+        # The item and modifier templates are shared, the indexes belong to this library
+        tables = getDataTables()
+        self._itemIndex = dict(tables.itemIndex)
+        self._itemLevelIndex = dict(tables.itemLevelIndex)
+        self._modifierIndex = dict(tables.modifierIndex)
+        self._modifierLevelIndex = dict(tables.modifierLevelIndex)
+        # Loot and modifier tables per maximum level, built when first needed
+        self._lootTables = {}
+        self._modifierTables = {}
 
     def createItem(self, item_key, modifier_key=None):
         '''
@@ -371,21 +389,19 @@ class ItemLibrary():
         :param modifier_key: string that identifies the item modifier
         :return: Item object
         '''
-        # load the monster data from the config
-        item_data = self.itemIndex[item_key]
+        # the item data is a shared template
+        baseItem = self.itemIndex[item_key]
 
         #create the correct type of item
-        baseItem = BaseItem(item_data)
         item_class = eval(baseItem.type)
         newItem = item_class and item_class(baseItem) or None
         if newItem is None:
-            raise GameError('Failed to create item with key: ' + item_key + '; unknown item type: ' + item_data['type'])
+            raise GameError('Failed to create item with key: ' + item_key + '; unknown item type: ' + baseItem.type)
 
         if modifier_key is not None:
-            modifier_data = self.modifierIndex[modifier_key]
-            mod = ItemModifier(modifier_data)
+            mod = self.modifierIndex[modifier_key]
             if baseItem.type == mod.type:
-                newItem.modifiers.append(mod)
+                newItem.addModifier(mod)
             else:
                 raise GameError("Incompatible item modifier type. Can not apply " + modifier_key + " to " + item_key)
 
@@ -399,49 +415,108 @@ class ItemLibrary():
         if max_items == 0: max_items = 1
         return max_items
 
-    def getRandomItem(self, maxItemLevel):
-        # Determine max item level at which items are available
-        itemLevel = maxItemLevel
-        while not itemLevel in self.itemLevelIndex.keys():
-            itemLevel -= 1
-            if itemLevel <= 0: raise GameError("No items available below the give item level")
-        # Determine possibilities
-        possibilities = self.itemLevelIndex[itemLevel]
-        if itemLevel + 1 in self.itemLevelIndex.keys() : possibilities.extend(self.itemLevelIndex[itemLevel + 1])
-        if itemLevel - 1 in self.itemLevelIndex.keys() : possibilities.extend(self.itemLevelIndex[itemLevel - 1])
-        if itemLevel - 2 in self.itemLevelIndex.keys() : possibilities.extend(self.itemLevelIndex[itemLevel - 2])
-        # Make a random choice
-        selection = random.choice(possibilities)
-        # Create the item
-        newItem = self.createItem(selection.key)
-        # Apply modifiers
-        maxModifierLevel = maxItemLevel - itemLevel + 1
-        if maxModifierLevel > 0:
-            modifier = self.getRandomModifier(maxModifierLevel)
-            if newItem.type == modifier.type:
-                newItem.modifiers.append(modifier)
-        return newItem
+    def getRandomItem(self, maxItemLevel, rng=None):
+        '''
+        Creates a random item up to the given item level.
+        :param maxItemLevel: maximum item level
+        :param rng: optional random.Random, defaults to the random of this library
+        :return: Item
+        '''
+        return self.getRandomItems(maxItemLevel, 1, rng)[0]
 
-    def getRandomModifier(self, maxModifierLevel):
-        # Determine max modifier level at which modifiers are available
-        modifierLevel = maxModifierLevel
-        while not modifierLevel in self.modifierLevelIndex.keys():
-            modifierLevel -= 1
-            if modifierLevel <= 0: raise GameError("No modifiers available below the give modifier level")
-        # Determine possibilities
-        possibilities = self.modifierLevelIndex[modifierLevel]
-        if modifierLevel + 1 in self.modifierLevelIndex.keys() : possibilities.extend(self.modifierLevelIndex[modifierLevel+1])
-        if modifierLevel - 1 in self.modifierLevelIndex.keys() : possibilities.extend(self.modifierLevelIndex[modifierLevel-1])
-        if modifierLevel - 2 in self.modifierLevelIndex.keys() : possibilities.extend(self.modifierLevelIndex[modifierLevel-2])
-        # Include negative modifiers
-        for key in self.modifierLevelIndex.keys():
-            if key <= 0:
-                possibilities.extend(self.modifierLevelIndex[key])
-        # Make a random choice
-        selection = random.choice(possibilities)
-        # Create the item
-        modifier = ItemModifier(selection)
-        return modifier
+    def getRandomItems(self, maxItemLevel, count, rng=None):
+        '''
+        Creates a number of random items up to the given item level in one go.
+        This is used to populate a whole room or level at once.
+        :param maxItemLevel: maximum item level
+        :param count: number of items
+        :param rng: optional random.Random, defaults to the random of this library
+        :return: list of Items
+        '''
+        if rng is None:
+            rng = self.random
+        itemLevel, table = self._lootTable(maxItemLevel)
+        maxModifierLevel = maxItemLevel - itemLevel + 1
+        items = []
+        for selection in table.sample(count, rng):
+            # Create the item
+            newItem = self.createItem(selection.key)
+            # Apply modifiers
+            if maxModifierLevel > 0:
+                modifier = self.getRandomModifier(maxModifierLevel, rng)
+                if newItem.type == modifier.type:
+                    newItem.addModifier(modifier)
+            items.append(newItem)
+        return items
+
+    def getRandomModifier(self, maxModifierLevel, rng=None):
+        '''
+        Picks a random item modifier up to the given modifier level.
+        :param maxModifierLevel: maximum modifier level
+        :param rng: optional random.Random, defaults to the random of this library
+        :return: ItemModifier
+        '''
+        if rng is None:
+            rng = self.random
+        # Modifiers are shared templates
+        return self._modifierTable(maxModifierLevel).pick(rng)
+
+    def _lootTable(self, maxItemLevel):
+        '''
+        Returns the table to pick items up to the given item level from.
+        The table holds the items of the highest available item level, of the level above it and of the two
+        levels below it.
+        :param maxItemLevel: maximum item level
+        :return: tuple (item level, AliasTable)
+        '''
+        entry = self._lootTables.get(maxItemLevel)
+        if entry is None:
+            itemLevel = self._availableLevel(self.itemLevelIndex, maxItemLevel)
+            if itemLevel is None:
+                raise GameError("No items available below the give item level")
+            possibilities = self._band(self.itemLevelIndex, [itemLevel, itemLevel + 1, itemLevel - 1, itemLevel - 2])
+            entry = (itemLevel, AliasTable(possibilities))
+            self._lootTables[maxItemLevel] = entry
+        return entry
+
+    def _modifierTable(self, maxModifierLevel):
+        '''
+        Returns the table to pick item modifiers up to the given modifier level from.
+        Like the loot table it covers a band of levels, the negative modifiers are always included.
+        :param maxModifierLevel: maximum modifier level
+        :return: AliasTable
+        '''
+        table = self._modifierTables.get(maxModifierLevel)
+        if table is None:
+            modifierLevel = self._availableLevel(self.modifierLevelIndex, maxModifierLevel)
+            if modifierLevel is None:
+                raise GameError("No modifiers available below the give modifier level")
+            levels = [modifierLevel, modifierLevel + 1, modifierLevel - 1, modifierLevel - 2]
+            # Negative modifiers that are also in the band are twice as likely
+            levels += [level for level in self.modifierLevelIndex.keys() if level <= 0]
+            table = AliasTable(self._band(self.modifierLevelIndex, levels))
+            self._modifierTables[maxModifierLevel] = table
+        return table
+
+    @staticmethod
+    def _availableLevel(levelIndex, maxLevel):
+        '''
+        Returns the highest positive level of the index up to maxLevel, None if there is none.
+        '''
+        levels = [level for level in levelIndex.keys() if 0 < level <= maxLevel]
+        if len(levels) == 0:
+            return None
+        return max(levels)
+
+    @staticmethod
+    def _band(levelIndex, levels):
+        '''
+        Returns a list with the templates of the given levels of the index.
+        '''
+        possibilities = []
+        for level in levels:
+            possibilities.extend(levelIndex.get(level, ()))
+        return possibilities
 
     def availableModifiersForItem(self, item_key):
         type = self.itemIndex[item_key].type
@@ -1,9 +1,13 @@
 #!/usr/bin/python
 
 import random
+import weakref
 import Utilities
 import CONSTANTS
-import math
+import numpy
+from FieldOfView import FieldOfViewMode, computeFieldOfView
+from PathFinding import findPath, computeGoalMap
+from Circles import circlePositions
 
 
 class Map(object):
@@ -19,6 +23,18 @@ class Map(object):
         """
         return self._level
 
+    @property
+    def random(self):
+        """
+        Random number generator used by this map.
+        Maps that belong to a level share the seeded generator of the level,
+        this ensures a level can be generated again from its seed.
+        :return: random.Random or the random module
+        """
+        if self._level is not None:
+            return self._level.random
+        return random
+
     @property
     def tiles(self):
         """
@@ -40,20 +56,57 @@ class Map(object):
         """
         Returns an integer indicating the width of the map
         """
-        if self._tiles:
-            return len(self._tiles)
-        else:
-            return 0
+        return self._blockedLayer.shape[0]
 
     @property
     def height(self):
         """
         Returns an integer indicating the height of the map
         """
-        if self._tiles:
-            return len(self._tiles[0])
-        else:
-            return 0
+        return self._blockedLayer.shape[1]
+
+    @property
+    def blockedLayer(self):
+        """
+        2D boolean array indexed [x, y] indicating which tiles are blocked.
+        """
+        return self._blockedLayer
+
+    @property
+    def blockSightLayer(self):
+        """
+        2D boolean array indexed [x, y] indicating which tiles block line of
+        sight.
+        """
+        return self._blockSightLayer
+
+    @property
+    def exploredLayer(self):
+        """
+        2D boolean array indexed [x, y] indicating which tiles are explored.
+        """
+        return self._exploredLayer
+
+    @property
+    def inViewLayer(self):
+        """
+        2D boolean array indexed [x, y] indicating which tiles are in view.
+        """
+        return self._inViewLayer
+
+    @property
+    def materialLayer(self):
+        """
+        2D array indexed [x, y] with the MaterialType of every tile.
+        """
+        return self._materialLayer
+
+    @property
+    def colorLayer(self):
+        """
+        3D array indexed [x, y] with the (R, G, B) color of every tile.
+        """
+        return self._colorLayer
 
     @property
     def each_map_position(self):
@@ -74,16 +127,55 @@ class Map(object):
         This includes tiles in and out of the visible range.
         """
 
-        # this flattens the 2D tiles list into one list, filtered out.
-        return [t for sublist in self.tiles for t in sublist if t.explored]
+        return [self.tiles[x][y] for x, y in zip(*numpy.nonzero(self.exploredLayer))]
+
+    @property
+    def exploredTileCount(self):
+        """
+        Returns the number of explored tiles.
+        """
+        return int(numpy.count_nonzero(self.exploredLayer))
     
     @property
     def visible_tiles(self):
         """
         Returns a list of visible tiles.
         """
-        # this flattens the 2D tiles list into one list, filtered out.
-        return [t for sublist in self.tiles for t in sublist if t.inView]
+        if self.visiblePositions is None:
+            return [self.tiles[x][y] for x, y in zip(*numpy.nonzero(self.inViewLayer))]
+        return [self.tiles[x][y] for x, y in self.visiblePositions]
+
+    @property
+    def visiblePositions(self):
+        """
+        Set of (x, y) positions that were visible during the last field of
+        view update. None if the field of view was never calculated.
+        """
+        return self._visiblePositions
+
+    @property
+    def viewOrigin(self):
+        """
+        The (x, y) position from which the last field of view update was
+        calculated. None if the field of view was never calculated.
+        """
+        return self._viewOrigin
+
+    @property
+    def newlyVisibleTiles(self):
+        """
+        List of tiles that came into view during the last field of view
+        update.
+        """
+        return self._newlyVisibleTiles
+
+    @property
+    def newlyHiddenTiles(self):
+        """
+        List of tiles that went out of view during the last field of view
+        update.
+        """
+        return self._newlyHiddenTiles
     
     #Every map has a Tile object which contains the entry point
     _entryTile = None
@@ -113,6 +205,19 @@ class Map(object):
         Range of view used to determine field of view on this map.
         """
         return self._rangeOfView
+
+    _fieldOfViewMode = FieldOfViewMode.SHADOWCASTING
+
+    @property
+    def fieldOfViewMode(self):
+        """
+        The FieldOfViewMode used to calculate the field of view on this map.
+        """
+        return self._fieldOfViewMode
+
+    @fieldOfViewMode.setter
+    def fieldOfViewMode(self, mode):
+        self._fieldOfViewMode = mode
     
     #constructor
     def __init__(self, MapWidth, MapHeight, level):
@@ -122,17 +227,170 @@ class Map(object):
             MapWidth - Map width in tiles
             MapHeight - Map height in tiles
         """
+        self._initialize(MapWidth, MapHeight, level)
+        self.generateMap()
+        self.refreshBlockedTileMatrix()
+
+    @classmethod
+    def fromLayers(cls, level, layers, areas, rangeOfView):
+        """
+        Creates a map of this class from previously stored tile data, for
+        example from a saved game. The map is not generated.
+        Arguments
+            level - Level to which the map belongs
+            layers - tuple of blocked, blockSight, explored, material and
+                     color arrays, as returned by the layer properties
+            areas - list of (x1, y1, x2, y2) tuples for the areas of the map
+            rangeOfView - range of view on this map
+        """
+        blocked, blockSight, explored, material, color = layers
+        width, height = blocked.shape
+        myMap = cls.__new__(cls)
+        myMap._initialize(width, height, level)
+        myMap._blockedLayer[:, :] = blocked
+        myMap._blockSightLayer[:, :] = blockSight
+        myMap._exploredLayer[:, :] = explored
+        myMap._materialLayer[:, :] = material
+        myMap._colorLayer[:, :] = color
+        myMap._areas = [Room(myMap, x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in areas]
+        myMap._rangeOfView = rangeOfView
+        myMap.refreshBlockedTileMatrix()
+        return myMap
+
+    #functions
+    def _initialize(self, width, height, level):
+        """
+        Initializes an empty map with empty tiles.
+        """
         #Initialize range of view
         self._rangeOfView = CONSTANTS.TORCH_RADIUS
         self._level = level
+        #Initialize field of view bookkeeping
+        self._visiblePositions = None
+        self._viewOrigin = None
+        self._newlyVisibleTiles = []
+        self._newlyHiddenTiles = []
+        self._actorsInView = set()
+        #Initialize change tracking, see trackChanges()
+        self._changeTrackers = weakref.WeakSet()
+        #Initialize path cache, paths are kept per key (usually a monster)
+        self._paths = {}
+        self._pathKeysByPosition = {}
+        self._goalMaps = {}
+        #Initialize free tile bookkeeping
+        self._forgetFreeTiles()
         #Create a big empty map
-        self._tiles = [[Tile(map, x, y)
-            for y in range(MapHeight)]
-            for x in range(MapWidth)]
-        self.generateMap()
+        self._createLayers(width, height)
+        self._tiles = [[Tile(self, x, y)
+            for y in range(height)]
+            for x in range(width)]
         self.refreshBlockedTileMatrix()
 
-    #functions
+    def _createLayers(self, width, height):
+        """
+        Creates the arrays that store the tile data of this map.
+        All tiles start out empty (unexplored, unblocked and not blocking line
+        of sight). Tiles are in view until the first field of view update.
+        """
+        self._blockedLayer = numpy.zeros((width, height), dtype=bool)
+        self._blockSightLayer = numpy.zeros((width, height), dtype=bool)
+        self._exploredLayer = numpy.zeros((width, height), dtype=bool)
+        self._inViewLayer = numpy.ones((width, height), dtype=bool)
+        self._materialLayer = numpy.full((width, height), MaterialType.NONE, dtype=numpy.uint8)
+        self._colorLayer = numpy.empty((width, height, 3), dtype=numpy.uint8)
+        self._colorLayer[:, :] = CONSTANTS.TILE_DEFAULT_COLOR
+
+    def fill(self, x1, y1, x2, y2, blocked, blockSight, color, material):
+        """
+        Sets the tile data for all tiles in a rectangular area in one go.
+        Arguments
+            x1, y1 - top left corner of the area (inclusive)
+            x2, y2 - bottom right corner of the area (exclusive)
+            blocked - boolean
+            blockSight - boolean
+            color - (R, G, B) tuple
+            material - MaterialType
+        """
+        self._setTileData((slice(x1, x2), slice(y1, y2)), blocked, blockSight, color, material)
+
+    def fillBorder(self, blocked, blockSight, color, material):
+        """
+        Sets the tile data for the outermost tiles of the map.
+        Arguments
+            see fill()
+        """
+        self.fill(0, 0, self.width, 1, blocked, blockSight, color, material)
+        self.fill(0, self.height - 1, self.width, self.height, blocked, blockSight, color, material)
+        self.fill(0, 0, 1, self.height, blocked, blockSight, color, material)
+        self.fill(self.width - 1, 0, self.width, self.height, blocked, blockSight, color, material)
+
+    def fillCircle(self, x, y, radius, blocked, blockSight, color, material):
+        """
+        Sets the tile data for all tiles in a filled circle in one go.
+        Tiles that fall outside of the map are ignored.
+        Arguments
+            x, y - center of the circle
+            radius - radius of the circle
+            other arguments see fill()
+        """
+        xs, ys = circlePositions(x, y, radius, self.width, self.height)
+        self._setTileData((xs, ys), blocked, blockSight, color, material)
+
+    def fillPositions(self, positions, blocked, blockSight, color, material):
+        """
+        Sets the tile data for a list of (x, y) positions in one go.
+        Arguments
+            positions - list of (x, y) tuples
+            other arguments see fill()
+        """
+        if len(positions) == 0:
+            return
+        xs, ys = zip(*positions)
+        self._setTileData((list(xs), list(ys)), blocked, blockSight, color, material)
+
+    def _setTileData(self, index, blocked, blockSight, color, material):
+        """
+        Writes the tile data in all layers for the given numpy index.
+        """
+        self._blockedLayer[index] = blocked
+        self._blockSightLayer[index] = blockSight
+        self._colorLayer[index] = color
+        self._materialLayer[index] = material
+        self.clearPaths()
+        self._forgetFreeTiles()
+        self.tilesChanged(index)
+
+    def trackChanges(self):
+        """
+        Returns a TileChanges that collects the positions of the tiles of
+        which the data changes from now on: blocked, blocks sight, explored,
+        material or color. Tiles that come into view for the first time are
+        explored by the field of view update.
+        The map only reports to the TileChanges that are still in use.
+        """
+        changes = TileChanges()
+        self._changeTrackers.add(changes)
+        return changes
+
+    def tilesChanged(self, index):
+        """
+        Reports that the tile data at the given numpy index changed. Code that
+        writes the layers directly has to call this.
+        Arguments
+            index - index into the 2D layers, for example a pair of slices
+                    or a pair of coordinate lists
+        """
+        if len(self._changeTrackers) == 0:
+            return
+        mask = numpy.zeros((self.width, self.height), dtype=bool)
+        mask[index] = True
+        xs, ys = numpy.nonzero(mask)
+        self._reportChanges(zip(xs.tolist(), ys.tolist()))
+
+    def _reportChanges(self, positions):
+        for changes in self._changeTrackers:
+            changes.update(positions)
+
     def generateMap(self):
         """
         Place holder function, subclass must provide actual implementation.
@@ -148,48 +406,241 @@ class Map(object):
         for each player movement, but this way is neater and more efficient.
         """
 
-        self.solidTileMatrix = Utilities.make_matrix(self.width, self.height, 0)
-        for x, y in self.each_map_position:
-            self.solidTileMatrix[x][y] = self.tiles[x][y].blockSight
+        # Nested lists are much faster to index than a numpy array
+        self.solidTileMatrix = self.blockSightLayer.tolist()
+        # Same for the tiles that can not be walked on, used for path finding
+        self.blockedTileMatrix = self.blockedLayer.tolist()
+
+    def getPath(self, key, start, goal, maxCost=None):
+        """
+        Returns the shortest path between two positions on this map.
+        The path is cached under the given key, it is reused as long as the
+        key asks for the same goal from the next position on the path and
+        none of the tiles on the path change.
+        Arguments
+            key - hashable object that identifies the cached path, for
+                  example the monster that follows the path
+            start - (x, y) tuple of the start position
+            goal - (x, y) tuple of the goal position
+            maxCost - optional limit on the cost of the path, see findPath()
+        Returns
+            list of (x, y) tuples from the first step up to and including the
+            goal, None if there is no path
+        """
+        cached = self._paths.get(key)
+        if cached is not None:
+            cachedStart, cachedGoal, path = cached
+            if cachedGoal == goal:
+                if cachedStart == start:
+                    return path
+                if len(path) > 0 and path[0] == start:
+                    # One step was taken along the path
+                    path = path[1:]
+                    self._paths[key] = (start, goal, path)
+                    return path
+        path = findPath(self.blockedTileMatrix, start, goal, maxCost)
+        self.forgetPath(key)
+        if path is not None:
+            self._paths[key] = (start, goal, path)
+            for position in path:
+                self._pathKeysByPosition.setdefault(position, set()).add(key)
+        return path
+
+    def forgetPath(self, key):
+        """
+        Removes the cached path of the given key.
+        """
+        cached = self._paths.pop(key, None)
+        if cached is not None:
+            for position in cached[2]:
+                keys = self._pathKeysByPosition.get(position)
+                if keys is not None:
+                    keys.discard(key)
+
+    def invalidatePaths(self, x, y):
+        """
+        Removes the cached paths that lead over the tile at position (x, y).
+        This is called when a tile changes.
+        """
+        keys = self._pathKeysByPosition.pop((x, y), None)
+        if keys is not None:
+            for key in list(keys):
+                self.forgetPath(key)
+        self._goalMaps.clear()
+
+    def clearPaths(self):
+        """
+        Removes all cached paths.
+        """
+        self._paths.clear()
+        self._pathKeysByPosition.clear()
+        self._goalMaps.clear()
+
+    def getGoalMap(self, goals, maxCost=None):
+        """
+        Returns the goal map towards the given goals on this map.
+        The goal map is computed once and shared by everyone who asks for the
+        same goals, until a tile of the map changes. For example the monsters
+        that hunt the player share the goal map of the player position during
+        a turn.
+        Arguments
+            goals - list of (x, y) tuples
+            maxCost - optional maximum cost, see computeGoalMap()
+        Returns
+            GoalMap
+        """
+        key = (tuple(goals), maxCost)
+        goalMap = self._goalMaps.get(key)
+        if goalMap is None:
+            # Only the goal maps of the current turn are of interest
+            if len(self._goalMaps) >= 4:
+                self._goalMaps.clear()
+            goalMap = computeGoalMap(self.blockedTileMatrix, goals, maxCost)
+            self._goalMaps[key] = goalMap
+        return goalMap
+
+    def getFieldOfView(self, x, y):
+        """
+        Returns the set of (x, y) positions that are visible from the given
+        position, using the field of view mode of this map.
+        """
+        return computeFieldOfView(self.solidTileMatrix, x, y,
+                                  self.rangeOfView, self.fieldOfViewMode)
 
     def updateFieldOfView(self, x, y):
         """
         Update the map tiles with what is in field of view, marking
         those as explored.
+        Only the tiles for which the visibility changed since the previous
+        update are touched, these are available in newlyVisibleTiles and
+        newlyHiddenTiles.
+        """
+        visiblePositions = self.getFieldOfView(x, y)
+        if self.visiblePositions is None:
+            # First update, tiles are created in view so all of them need a reset
+            newlyVisible = visiblePositions
+            newlyHidden = set(zip(*numpy.nonzero(self.inViewLayer))) - visiblePositions
+            self.inViewLayer[:, :] = False
+        else:
+            newlyVisible = visiblePositions - self.visiblePositions
+            newlyHidden = self.visiblePositions - visiblePositions
+        self._visiblePositions = visiblePositions
+        self._viewOrigin = (x, y)
+        self._newlyVisibleTiles = [self.tiles[tx][ty] for tx, ty in newlyVisible]
+        self._newlyHiddenTiles = [self.tiles[tx][ty] for tx, ty in newlyHidden]
+        if len(newlyVisible) > 0:
+            xs, ys = zip(*newlyVisible)
+            self.inViewLayer[xs, ys] = True
+            if len(self._changeTrackers) > 0:
+                # Only the tiles that are seen for the first time change
+                unexplored = ~self.exploredLayer[xs, ys]
+                self._reportChanges([position for position, fresh in zip(newlyVisible, unexplored) if fresh])
+            self.exploredLayer[xs, ys] = True
+        if len(newlyHidden) > 0:
+            xs, ys = zip(*newlyHidden)
+            self.inViewLayer[xs, ys] = False
+        # Actors move around, so check the actors that are in view now and
+        # the actors that were in view before.
+        if self.level is not None:
+            actorsInView = set(self.level.actorsInView())
+        else:
+            actorsInView = set()
+            for tx, ty in visiblePositions:
+                actorsInView.update(self.tiles[tx][ty].actors)
+        for actor in self._actorsInView - actorsInView:
+            actor.inView = False
+        for actor in actorsInView:
+            actor.inView = True
+        self._actorsInView = actorsInView
+
+    def getRandomEmptyTile(self, area=None):
+        """
+        Returns a random tile that is not blocked and holds no actors.
+        Arguments
+            area - optional Room to pick the tile from, by default the tile
+                   is picked from the free tile region of the map
+        Raises
+            GameError if there is no empty tile
+        """
+        freeTiles = self.getFreeTiles(area)
+        if len(freeTiles) == 0:
+            if area is None:
+                raise Utilities.GameError('No empty tile left on the map')
+            raise Utilities.GameError('No empty tile left in the area (%d, %d) - (%d, %d)' % (
+                area.x1, area.y1, area.x2, area.y2))
+        x, y = freeTiles.sample(self.random)
+        return self.tiles[x][y]
+
+    def getFreeTiles(self, area=None):
         """
-        view_range = self.rangeOfView
-        for tx, ty in self.each_map_position:
-            tile = self.tiles[tx][ty]
-            dist = Utilities.distanceBetweenPoints(x, y, tx, ty)
-            visible = dist <= view_range
-            line_of_sight = Utilities.line_of_sight(
-                self.solidTileMatrix, x, y, tx, ty)
-            if visible and line_of_sight:
-                tile.inView = True
-                tile.explored = True
+        Returns the positions of the tiles that are not blocked and hold no
+        actors. The positions are collected on the first request, after that
+        they are kept up to date when actors come and go and when tiles
+        become blocked.
+        Arguments
+            area - optional Room, by default the free tile region of the map
+        Returns
+            FreeTileSet
+        """
+        freeTiles = self._freeTiles.get(area)
+        if freeTiles is None:
+            if area is None:
+                region = self._freeTileRegion()
+            else:
+                region = numpy.zeros((self.width, self.height), dtype=bool)
+                region[max(area.x1, 0):area.x2 + 1, max(area.y1, 0):area.y2 + 1] = True
+            freeTiles = FreeTileSet()
+            xs, ys = numpy.nonzero(region)
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                self._freeTilesByPosition.setdefault((x, y), []).append(freeTiles)
+                if not self._blockedLayer[x, y] and self._tiles[x][y].empty:
+                    freeTiles.add((x, y))
+            self._freeTiles[area] = freeTiles
+        return freeTiles
+
+    def _freeTileRegion(self):
+        """
+        Returns a boolean array that marks the tiles from which
+        getRandomEmptyTile() picks by default, these are all tiles except the
+        outermost ones. Subclasses can narrow this down.
+        """
+        region = numpy.zeros((self.width, self.height), dtype=bool)
+        region[1:-1, 1:-1] = True
+        return region
+
+    def refreshFreeTile(self, x, y):
+        """
+        Updates the free tile sets after the blocked state or the actors of
+        the tile at position (x, y) changed.
+        """
+        freeTileSets = self._freeTilesByPosition.get((x, y))
+        if freeTileSets is None:
+            return
+        free = not self._blockedLayer[x, y] and self._tiles[x][y].empty
+        for freeTiles in freeTileSets:
+            if free:
+                freeTiles.add((x, y))
             else:
-                self.tiles[tx][ty].inView = False
-            # set all actors as in view too
-            for actor in tile.actors:
-                actor.inView = visible and line_of_sight
+                freeTiles.discard((x, y))
 
-    def getRandomEmptyTile(self):
+    def _forgetFreeTiles(self):
         """
-        Returns an empty tile on this level, excluding the outermost cells.
+        Drops the free tile sets, they are collected again on the next
+        request. This is used when many tiles change at once.
         """
-        levelArea = Room(self, 1, 1, self.width - 2, self.height - 2)
-        return levelArea.getRandomEmptyTile()
+        self._freeTiles = {}
+        self._freeTilesByPosition = {}
 
     def getRandomTile(self):
         '''
         Returns a random Tile in this map.
         :return: Tile object
         '''
-        x = random.randrange(self.width)
-        y = random.randrange(self.height)
+        x = self.random.randrange(self.width)
+        y = self.random.randrange(self.height)
         return self.tiles[x][y]
 
-    def getCircleTiles(self, x, y, radius, fullCircle=False, excludeBlockedTiles=False):
+    def getCircleTiles(self, x, y, radius, fullCircle=False, excludeBlockedTiles=False, lineOfSight=False):
         """
         Frost: This utility function returns an array of tiles that 
         approximates a circle on the map.
@@ -200,68 +651,31 @@ class Map(object):
             fullCircle - when false only the tiles on the border of the 
                 circle are returned, when true all tiles inside.
             excludeBlockedTiles - excludes blocked tiles
-        """
-        #prepare variables
-        circleTiles = []
-        maxX = self.width - 1
-        maxY = self.height - 1
-        #maxI is a relevant sample size, if it is to small it will lead to gaps in the circle.
-        #the following works for reasonably sized circles.
-        maxI = 6 * radius
-        halfMaxI = maxI / 2
-        if fullCircle:
-            #add center
-            circleTiles.append(self.tiles[x][y])
-        #go around the edge of the circle in maxI samples
-        for i in range(0, maxI):
-            #for each edge sample calculate the coordinates
-            xPos = int(round(x + radius * math.cos((math.pi/halfMaxI)*i)))
-            yPos = int(round(y + radius * math.sin((math.pi/halfMaxI)*i)))
-            #add relevant tiles between the found circle edge and the circle center
-            while xPos <> x or yPos <> y:
-                #tile has to be on the map
-                if xPos >= 0 and yPos >= 0 and xPos <= maxX and yPos <= maxY:
-                    #avoid adding duplicates
-                    if self.tiles[xPos][yPos] not in circleTiles:
-                        possibleTile = self.tiles[xPos][yPos]
-                        if excludeBlockedTiles:
-                            #exclude blocked tiles
-                            if not possibleTile.blocked:
-                                circleTiles.append(possibleTile)
-                        else:
-                            #include all tiles
-                            circleTiles.append(possibleTile)
-                if fullCircle:
-                    #move towards interior
-                    if xPos > x:
-                        xPos -= 1
-                    elif xPos < x:
-                        xPos += 1
-                    elif xPos == x:
-                        if yPos > y:
-                            yPos -= 1
-                        elif yPos < y:
-                            yPos += 1
-                else:
-                    #adding only the edge is enough
-                    break        
-        #return the found tiles that make up the circle   
+            lineOfSight - only includes the tiles that can be seen from the
+                center of the circle
+        """
+        blocked = None
+        if excludeBlockedTiles:
+            blocked = self.blockedLayer
+        visible = None
+        if lineOfSight:
+            visible = computeFieldOfView(self.solidTileMatrix, x, y, radius)
+        xs, ys = circlePositions(x, y, radius, self.width, self.height,
+                                 not fullCircle, blocked, visible)
+        tiles = self.tiles
+        circleTiles = [tiles[tx][ty] for tx, ty in zip(xs.tolist(), ys.tolist())]
+        if fullCircle and (len(circleTiles) == 0 or circleTiles[0] is not tiles[x][y]):
+            #the center is always part of a full circle
+            circleTiles.insert(0, tiles[x][y])
         return circleTiles
     
     def __str__(self):
         """
         Basic way to print out a map, can be used to debug.
         """
-        output = ''
-        for y in range(0, self.height):
-            line = ''
-            for x in range(0, self.width):
-                if self.tiles[x][y].blocked:
-                    line = line + 'x'
-                else:
-                    line = line + ' '
-            output += line + '\n'
-        return output
+        # Rows of the output are the columns of the (x, y) indexed layer
+        characters = numpy.where(self.blockedLayer.T, 'x', ' ')
+        return ''.join(''.join(row) + '\n' for row in characters)
 
 
 class DungeonMap(Map):
@@ -306,29 +720,19 @@ class DungeonMap(Map):
         ROOM_MIN_SIZE = CONSTANTS.DUNGEON_ROOM_MIN_SIZE
         MAX_ROOMS = CONSTANTS.DUNGEON_MAX_ROOMS
 
-        #Create a new map with empty tiles
-        self._tiles = [[Tile(self, x, y)
-               for y in range(self. height)]
-           for x in range(self. width)]
-
         #Block all tiles
-        for y in range(self.height):
-            for x in range(self.width):
-                myTile = self.tiles[x][y]
-                myTile.blocked = True
-                myTile.blockSight = True
-                myTile.color = CONSTANTS.DUNGEON_COLOR_WALL
-                myTile.material = MaterialType.STONE
+        self.fill(0, 0, self.width, self.height, True, True,
+                  CONSTANTS.DUNGEON_COLOR_WALL, MaterialType.STONE)
 
         #cut out rooms
         num_rooms = 0
         for r in range(MAX_ROOMS):
             #random width and height
-            w = random.randrange(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-            h = random.randrange(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+            w = self.random.randrange(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+            h = self.random.randrange(ROOM_MIN_SIZE, ROOM_MAX_SIZE)
             #random position without going out of the boundaries of the map
-            x = random.randrange(0, self.width - w - 1)
-            y = random.randrange(0, self.height - h - 1)
+            x = self.random.randrange(0, self.width - w - 1)
+            y = self.random.randrange(0, self.height - h - 1)
             #create a new room
             new_room = Room(self, x, y, w, h)
 
@@ -341,15 +745,10 @@ class DungeonMap(Map):
             if intersects is True:
                 break
 
-            #cut it out of the map
-            #go through the tiles in the room and make them passable
-            for x in range(new_room.x1 + 1, new_room.x2):
-                for y in range(new_room.y1 + 1, new_room.y2):
-                    self.tiles[x][y].blocked = False
-                    self.tiles[x][y].blockSight = False
-                    self.tiles[x][y].color = CONSTANTS.DUNGEON_COLOR_FLOOR
-                    self.tiles[x][y].material = MaterialType.DIRT
-                 
+            #cut it out of the map, the walls of the room remain blocked
+            self.fill(new_room.x1 + 1, new_room.y1 + 1, new_room.x2, new_room.y2,
+                      False, False, CONSTANTS.DUNGEON_COLOR_FLOOR, MaterialType.DIRT)
+
             (new_x, new_y) = new_room.center
 
             #create corridor towards previous room
@@ -377,31 +776,22 @@ class DungeonMap(Map):
 
     def _createHorizontalTunnel(self, x1, x2, y):
         #horizontal tunnel. min() and max() are used in case x1>x2
-        for x in range(min(x1, x2), max(x1, x2) + 1):
-            self.tiles[x][y].blocked = False
-            self.tiles[x][y].blockSight = False
-            self.tiles[x][y].color = CONSTANTS.DUNGEON_COLOR_FLOOR
-            self.tiles[x][y].material = MaterialType.DIRT
+        self.fill(min(x1, x2), y, max(x1, x2) + 1, y + 1,
+                  False, False, CONSTANTS.DUNGEON_COLOR_FLOOR, MaterialType.DIRT)
 
     def _createVerticalTunnel(self, y1, y2, x):
         #vertical tunnel
-        for y in range(min(y1, y2), max(y1, y2) + 1):
-            self.tiles[x][y].blocked = False
-            self.tiles[x][y].blockSight = False
-            self.tiles[x][y].color = CONSTANTS.DUNGEON_COLOR_FLOOR
-            self.tiles[x][y].material = MaterialType.DIRT
+        self.fill(x, min(y1, y2), x + 1, max(y1, y2) + 1,
+                  False, False, CONSTANTS.DUNGEON_COLOR_FLOOR, MaterialType.DIRT)
 
-    def getRandomEmptyTile(self):
+    def _freeTileRegion(self):
         """
-        finds a random empty tile on the map of this level
+        Random empty tiles are picked from the rooms of a dungeon.
         """
-        emptyTile = None
-        while emptyTile is None:
-            #pick a random room of the map
-            room = random.choice(self.rooms)
-            #find an empty tile in the room
-            emptyTile = room.getRandomEmptyTile()
-        return emptyTile
+        region = numpy.zeros((self.width, self.height), dtype=bool)
+        for room in self.rooms:
+            region[room.x1:room.x2 + 1, room.y1:room.y2 + 1] = True
+        return region
 
 
 class TownMap(Map):
@@ -446,37 +836,22 @@ class TownMap(Map):
         HOUSE_MIN_SIZE = CONSTANTS.TOWN_HOUSE_MIN_SIZE
         MAX_HOUSES = CONSTANTS.TOWN_MAX_HOUSES
 
-        #Create a new map with empty tiles
-        self._tiles = [[Tile(self, x, y)
-               for y in range(self. height)]
-           for x in range(self. width)]
-
+        #The whole town is explored
+        self.exploredLayer[:, :] = True
         #Block only the town border
-        for y in range(self.height):
-            for x in range(self.width):
-                myTile = self.tiles[x][y]
-                myTile.explored = True
-                if x == 0 or y == 0 \
-                        or x == self.width - 1 or y == self.height - 1:
-                    myTile.blocked = True
-                    myTile.blockSight = True
-                    myTile.color = CONSTANTS.TOWN_COLOR_BORDER
-                    myTile.material = MaterialType.STONE
-                else:
-                    myTile.blocked = False
-                    myTile.blockSight = False
-                    myTile.color = CONSTANTS.TOWN_COLOR_DIRT
-                    myTile.material = MaterialType.DIRT
+        self.fill(0, 0, self.width, self.height, False, False,
+                  CONSTANTS.TOWN_COLOR_DIRT, MaterialType.DIRT)
+        self.fillBorder(True, True, CONSTANTS.TOWN_COLOR_BORDER, MaterialType.STONE)
 
         #generate houses
         num_houses = 0
         for r in range(MAX_HOUSES):
             #random width and height
-            w = random.randrange(HOUSE_MIN_SIZE, HOUSE_MAX_SIZE)
-            h = random.randrange(HOUSE_MIN_SIZE, HOUSE_MAX_SIZE)
+            w = self.random.randrange(HOUSE_MIN_SIZE, HOUSE_MAX_SIZE)
+            h = self.random.randrange(HOUSE_MIN_SIZE, HOUSE_MAX_SIZE)
             #random position staying away from the edges of town
-            x = random.randrange(2, self.width - w - 2)
-            y = random.randrange(2, self.height - h - 2)
+            x = self.random.randrange(2, self.width - w - 2)
+            y = self.random.randrange(2, self.height - h - 2)
             #create a new house
             new_house = Room(self, x, y, w, h)
 
@@ -491,12 +866,8 @@ class TownMap(Map):
                 break
 
             #create the outline of the house on the map
-            for x in range(new_house.x1, new_house.x2 + 1):
-                for y in range(new_house.y1, new_house.y2 + 1):
-                    self.tiles[x][y].blocked = True
-                    self.tiles[x][y].blockSight = True
-                    self.tiles[x][y].color = CONSTANTS.TOWN_COLOR_STONE
-                    self.tiles[x][y].material = MaterialType.STONE
+            self.fill(new_house.x1, new_house.y1, new_house.x2 + 1, new_house.y2 + 1,
+                      True, True, CONSTANTS.TOWN_COLOR_STONE, MaterialType.STONE)
 
             #finally, append the new room to the list
             self.houses.append(new_house)
@@ -530,27 +901,13 @@ class SingleRoomMap(Map):
         self._rangeOfView = CONSTANTS.TORCH_RADIUS
 
     def generateMap(self):
-        #Create a new map with empty tiles
-        self._tiles = [[Tile(self, x, y)
-               for y in range(self. height)]
-           for x in range(self. width)]
-
         #Block all tiles
-        for y in range(self.height):
-            for x in range(self.width):
-                myTile = self.tiles[x][y]
-                myTile.blocked = True
-                myTile.blockSight = True
-                myTile.color = CONSTANTS.DUNGEON_COLOR_WALL
-                myTile.material = MaterialType.STONE
+        self.fill(0, 0, self.width, self.height, True, True,
+                  CONSTANTS.DUNGEON_COLOR_WALL, MaterialType.STONE)
 
         #Cut out the single room
-        for x in range(self.room.x1 + 1, self.room.x2):
-            for y in range(self.room.y1 + 1, self.room.y2):
-                self.tiles[x][y].blocked = False
-                self.tiles[x][y].blockSight = False
-                self.tiles[x][y].color = CONSTANTS.DUNGEON_COLOR_FLOOR
-                self.tiles[x][y].material = MaterialType.DIRT
+        self.fill(self.room.x1 + 1, self.room.y1 + 1, self.room.x2, self.room.y2,
+                  False, False, CONSTANTS.DUNGEON_COLOR_FLOOR, MaterialType.DIRT)
 
 class CaveMap(Map):
     """
@@ -569,43 +926,29 @@ class CaveMap(Map):
         self._rangeOfView = CONSTANTS.TORCH_RADIUS
 
     def generateMap(self):
-        #Create a new map with empty tiles
-        self._tiles = [[Tile(self, x, y)
-               for y in range(self. height)]
-           for x in range(self. width)]
-
         #Block all tiles
-        for y in range(self.height):
-            for x in range(self.width):
-                myTile = self.tiles[x][y]
-                myTile.blocked = True
-                myTile.blockSight = True
-                myTile.color = CONSTANTS.CAVE_COLOR_ROCK
-                myTile.material = MaterialType.STONE 
+        self.fill(0, 0, self.width, self.height, True, True,
+                  CONSTANTS.CAVE_COLOR_ROCK, MaterialType.STONE)
         
         #Cut out a starting cave area
-        x = random.randrange(2, self.width - 2)
-        y = random.randrange(2, self.height - 2)
-        radius = random.randrange(5, 10)
-        fullCircle = True
-        circleTiles = self.getCircleTiles(x, y, radius, fullCircle)
-        for tile in circleTiles:
-            self.clearTile(tile)
+        x = self.random.randrange(2, self.width - 2)
+        y = self.random.randrange(2, self.height - 2)
+        radius = self.random.randrange(5, 10)
+        self.fillCircle(x, y, radius, False, False,
+                        CONSTANTS.CAVE_COLOR_DIRT, MaterialType.DIRT)
 
         firstX = x
         firstY = y
         #Grow additional cave areas.
-        for i in range(2, random.randint(3,8)):
+        for i in range(2, self.random.randint(3,8)):
             prevX = x
             prevY = y
             prevRadius = radius
-            x = random.randrange(2, self.width - 3)
-            y = random.randrange(2, self.height - 3)
-            radius = random.randrange(5, 15)
-            fullCircle = True
-            circleTiles = self.getCircleTiles(x, y, radius, fullCircle)
-            for tile in circleTiles:
-                self.clearTile(tile)
+            x = self.random.randrange(2, self.width - 3)
+            y = self.random.randrange(2, self.height - 3)
+            radius = self.random.randrange(5, 15)
+            self.fillCircle(x, y, radius, False, False,
+                            CONSTANTS.CAVE_COLOR_DIRT, MaterialType.DIRT)
             # Link this cave to the previous one
             self.createCorridor(x, y, prevX, prevY)
 
@@ -613,41 +956,27 @@ class CaveMap(Map):
         self.createCorridor(x, y, firstX, firstY)
 
         #Create a bit of water
-        circleTiles = self.getCircleTiles(x, y, 2, fullCircle)
-        for tile in circleTiles:
-            tile.material = MaterialType.WATER
-            tile.blocked = False
-            tile.blockSight = False
-            tile.color = CONSTANTS.WATER_COLOR
+        self.fillCircle(x, y, 2, False, False,
+                        CONSTANTS.WATER_COLOR, MaterialType.WATER)
 
         # Ensure the border of the map is blocked
-        for y in range(self.height):
-            for x in range(self.width):
-                myTile = self.tiles[x][y]
-                if x == 0 or y == 0 \
-                        or x == self.width - 1 or y == self.height - 1:
-                    myTile.blocked = True
-                    myTile.blockSight = True
-                    myTile.color = CONSTANTS.CAVE_COLOR_ROCK
-                    myTile.material = MaterialType.STONE
+        self.fillBorder(True, True, CONSTANTS.CAVE_COLOR_ROCK, MaterialType.STONE)
 
     def createCorridor(self, x, y, prevX, prevY):
         modX, modY = 0, 0
         if prevX <> x: modX = (prevX - x) / abs(prevX - x)
         if prevY <> y: modY = (prevY - y) / abs(prevY - y)
+        #collect the corridor positions and clear them in one go
+        positions = []
         while not (prevX == x and prevY ==y):
             if prevX <> x: x += modX
             if prevY <> y: y += modY
-            for i in range(0, random.randrange(1,3)):
-                self.clearTile(self.tiles[x+i][y+i])
-                self.clearTile(self.tiles[x+i][y])
-                self.clearTile(self.tiles[x][y+i])
-
-    def clearTile(self, tile):
-        tile.blocked = False
-        tile.blockSight = False
-        tile.color = CONSTANTS.CAVE_COLOR_DIRT
-        tile.material = MaterialType.DIRT
+            for i in range(0, self.random.randrange(1,3)):
+                positions.append((x+i, y+i))
+                positions.append((x+i, y))
+                positions.append((x, y+i))
+        self.fillPositions(positions, False, False,
+                           CONSTANTS.CAVE_COLOR_DIRT, MaterialType.DIRT)
 
 class Room():
     """
@@ -680,16 +1009,100 @@ class Room():
                 self.y1 - border <= other.y2 and self.y2 + border >= other.y1)
 
     def getRandomEmptyTile(self):
-        aTile = None
-        xRange = range(self.x1, self.x2 + 1)
-        random.shuffle(xRange)
-        yRange = range(self.y1, self.y2 + 1)
-        random.shuffle(yRange)
-        for x in xRange:
-            for y in yRange:
-                if not self._map.tiles[x][y].blocked and self._map.tiles[x][y].empty:
-                    aTile = self._map.tiles[x][y]
-        return aTile
+        """
+        Returns a random empty tile in this room, the borders included.
+        Raises
+            GameError if there is no empty tile in the room
+        """
+        return self._map.getRandomEmptyTile(self)
+
+
+class TileChanges(object):
+    """
+    Positions of the tiles of a map that changed since they were last taken,
+    see Map.trackChanges().
+    """
+
+    def __init__(self):
+        """
+        Constructor to create an empty collection of changes.
+        """
+        self._positions = set()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def add(self, x, y):
+        """
+        Records a change of the tile at (x, y).
+        """
+        self._positions.add((x, y))
+
+    def update(self, positions):
+        """
+        Records a change of the tiles at a list of (x, y) positions.
+        """
+        self._positions.update(positions)
+
+    def take(self):
+        """
+        Returns the set of (x, y) positions that changed and starts over
+        with an empty set.
+        """
+        positions = self._positions
+        self._positions = set()
+        return positions
+
+
+class FreeTileSet(object):
+    """
+    Set of the positions of free tiles that supports picking a random
+    position. Adding, removing and picking take constant time: the positions
+    are kept in a list and a removed position is replaced by the last one.
+    """
+
+    def __init__(self):
+        self._positions = []
+        self._indices = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, position):
+        return position in self._indices
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def add(self, position):
+        """
+        Adds an (x, y) position, positions that are already in the set are
+        ignored.
+        """
+        if position in self._indices:
+            return
+        self._indices[position] = len(self._positions)
+        self._positions.append(position)
+
+    def discard(self, position):
+        """
+        Removes an (x, y) position if it is in the set.
+        """
+        index = self._indices.pop(position, None)
+        if index is None:
+            return
+        last = self._positions.pop()
+        if last != position:
+            self._positions[index] = last
+            self._indices[last] = index
+
+    def sample(self, rng):
+        """
+        Returns a random position from the set.
+        Arguments
+            rng - random.Random or the random module
+        """
+        return self._positions[rng.randrange(len(self._positions))]
 
 class MaterialType():
     """
@@ -704,7 +1117,11 @@ class MaterialType():
 class Tile(object):
     """
     represents a Tile on the map
+    The tile data is stored in the layers of the map, a Tile object is a
+    lightweight view on one position of those layers.
     """
+    # Avoid a __dict__ per tile, maps contain thousands of tiles
+    __slots__ = ('_map', '_x', '_y', '_actors', '_type', '_sceneObject')
 
     @property
     def x(self):
@@ -732,38 +1149,42 @@ class Tile(object):
         """
         Returns a boolean indicating if this tile has been explored.
         """
-        return self._explored
+        return bool(self._map._exploredLayer[self._x, self._y])
 
     @explored.setter
     def explored(self, isExplored):
-        self._explored = isExplored
+        self._map._exploredLayer[self._x, self._y] = isExplored
+        self._map._reportChanges(((self._x, self._y),))
 
     @property
     def blocked(self):
         """
         Returns a boolean indicating if this tile is blocked.
         """
-        return self._blocked
+        return bool(self._map._blockedLayer[self._x, self._y])
 
     @blocked.setter
     def blocked(self, isBlocked):
-        self._blocked = isBlocked
-        #Blocked tiles also block line of sight
-        # NOTE: not neccesarily, this is how windows and fences are made :)
-        # Lol, good point, and we need shrubberies! :)
-        if isBlocked is True:
-            self._block_sight = True
+        # Blocked tiles do not necessarily block line of sight, this is how
+        # windows and fences are made :) blockSight is set separately.
+        self._map._blockedLayer[self._x, self._y] = isBlocked
+        self._map.blockedTileMatrix[self._x][self._y] = bool(isBlocked)
+        self._map.invalidatePaths(self._x, self._y)
+        self._map.refreshFreeTile(self._x, self._y)
+        self._map._reportChanges(((self._x, self._y),))
 
     @property
     def blockSight(self):
         """
         Returns a boolean indicating if this tile blocks line of sight.
         """
-        return self._blockSight
+        return bool(self._map._blockSightLayer[self._x, self._y])
 
     @blockSight.setter
     def blockSight(self, blocksLineOfSight):
-        self._blockSight = blocksLineOfSight
+        self._map._blockSightLayer[self._x, self._y] = blocksLineOfSight
+        self._map.solidTileMatrix[self._x][self._y] = bool(blocksLineOfSight)
+        self._map._reportChanges(((self._x, self._y),))
 
     @property
     def inView(self):
@@ -771,11 +1192,11 @@ class Tile(object):
         Returns if this tile is in the player field of vision.
         This is set by the game engine during each turn.
         """
-        return self._in_view
+        return bool(self._map._inViewLayer[self._x, self._y])
 
     @inView.setter
     def inView(self, newInView):
-        self._in_view = newInView
+        self._map._inViewLayer[self._x, self._y] = newInView
     
     @property
     def actors(self):
@@ -798,22 +1219,24 @@ class Tile(object):
         """
         Property to store the material type of the tile.
         """
-        return self._material
+        return int(self._map._materialLayer[self._x, self._y])
     
     @material.setter
     def material(self, newMaterial):
-        self._material = newMaterial
+        self._map._materialLayer[self._x, self._y] = newMaterial
+        self._map._reportChanges(((self._x, self._y),))
         
     @property
     def color(self):
         """
         Returns the preferred color of this tile.
         """
-        return self._color
+        return tuple(self._map._colorLayer[self._x, self._y].tolist())
     
     @color.setter
     def color(self, newColor):
-        self._color = newColor
+        self._map._colorLayer[self._x, self._y] = newColor
+        self._map._reportChanges(((self._x, self._y),))
     
     @property
     def type(self):
@@ -840,23 +1263,20 @@ class Tile(object):
 
     def __init__(self, map, x, y):
         """
-        Constructor to create a new tile, all tiles are created empty
-        (unexplored, unblocked and not blocking line of sight)
+        Constructor to create a new tile view.
+        The state of the tile (explored, blocked, ...) is kept in the layers
+        of the map, freshly created maps contain empty tiles (unexplored,
+        unblocked and not blocking line of sight).
         Arguments
             map - Map object of which this tile is a part
             x - x coordinate of the tile on the map
             y - y coordinate of the tile on the map
         """
-        self._actors = []
+        # Most tiles never hold an actor, the list is created on demand
+        self._actors = _NO_ACTORS
         self._map = map
         self._x = x
         self._y = y
-        self._explored = False
-        self._blocked = False
-        self._blockSight = False
-        self._material = MaterialType.NONE
-        self._in_view = True
-        self._color = CONSTANTS.TILE_DEFAULT_COLOR
         self._sceneObject = None
 
     def __str__(self):
@@ -870,10 +1290,24 @@ class Tile(object):
         """
         This function adds and actor to this tile
         """
+        if self._actors is _NO_ACTORS:
+            self._actors = []
         self._actors.append(myActor)
+        if len(self._actors) == 1:
+            # The tile is no longer free
+            self._map.refreshFreeTile(self._x, self._y)
 
     def removeActor(self, myActor):
         """
-        This function adds and actor to this tile
+        This function removes an actor from this tile
+        Raises ValueError if the actor is not on this tile, like a list does.
         """
-        self._actors.remove(myActor)
\ No newline at end of file
+        if self._actors is _NO_ACTORS:
+            raise ValueError('Actor is not on ' + str(self))
+        self._actors.remove(myActor)
+        if len(self._actors) == 0:
+            self._map.refreshFreeTile(self._x, self._y)
+
+
+# Shared actor list for tiles without actors, it is never modified.
+_NO_ACTORS = ()
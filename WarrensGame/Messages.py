@@ -0,0 +1,231 @@
+#!/usr/bin/python
+
+################
+# Message bus  #
+################
+
+# Every game has a message bus. Messages are posted with a category, a
+# format string and the arguments for it. The text is only formatted when a
+# consumer reads it, and messages of categories that no consumer listens to
+# are dropped before anything is created.
+
+from collections import deque
+
+import CONSTANTS
+
+
+class MessageCategory(object):
+    """
+    Enumerator of the message categories, the values are bits so a set of
+    categories is a bitmask.
+    """
+    GAME = 1
+    COMBAT = 2
+    AI = 4
+    GENERATION = 8
+    ALL = GAME | COMBAT | AI | GENERATION
+
+    NAMES = {GAME: 'GAME', COMBAT: 'COMBAT', AI: 'AI', GENERATION: 'GENERATION'}
+
+    @classmethod
+    def fromName(cls, name):
+        """
+        Returns the category with the given name (case insensitive).
+        """
+        for category, categoryName in cls.NAMES.items():
+            if categoryName == name.upper():
+                return category
+        raise KeyError('Unknown message category ' + name)
+
+
+def consoleMask():
+    """
+    Returns the bitmask of the categories that are printed on the console,
+    according to the logging switches in CONSTANTS.
+    """
+    mask = 0
+    if CONSTANTS.SHOW_GAME_LOGGING:
+        mask |= MessageCategory.GAME
+    if CONSTANTS.SHOW_COMBAT_LOGGING:
+        mask |= MessageCategory.COMBAT
+    if CONSTANTS.SHOW_AI_LOGGING:
+        mask |= MessageCategory.AI
+    if CONSTANTS.SHOW_GENERATION_LOGGING:
+        mask |= MessageCategory.GENERATION
+    return mask
+
+
+class Message(object):
+    """
+    A message that is formatted when its text is first requested.
+    """
+    __slots__ = ('category', 'template', 'arguments', '_text')
+
+    def __init__(self, category, template, arguments):
+        """
+        Constructor
+        Arguments
+            category - MessageCategory
+            template - format string for the % operator
+            arguments - tuple of arguments for the format string
+        """
+        self.category = category
+        self.template = template
+        self.arguments = arguments
+        self._text = None
+
+    @property
+    def text(self):
+        """
+        The formatted text of the message.
+        """
+        if self._text is None:
+            if len(self.arguments) > 0:
+                self._text = self.template % self.arguments
+            else:
+                self._text = self.template
+        return self._text
+
+    def __str__(self):
+        return self.text
+
+
+class MessageConsumer(object):
+    """
+    Keeps the latest messages of the categories it is interested in.
+    """
+
+    @property
+    def mask(self):
+        """
+        Bitmask of the categories this consumer receives.
+        """
+        return self._mask
+
+    @mask.setter
+    def mask(self, mask):
+        self._mask = mask
+        if self._bus is not None:
+            self._bus.refreshMask()
+
+    @property
+    def messages(self):
+        """
+        The latest received messages, oldest first.
+        """
+        return self._messages
+
+    @property
+    def texts(self):
+        """
+        List with the text of the latest received messages, oldest first.
+        """
+        return [m.text for m in self._messages]
+
+    def __init__(self, mask, size=20):
+        """
+        Constructor
+        Arguments
+            mask - bitmask of the categories to receive
+            size - number of messages to keep, older messages are dropped
+        """
+        self._mask = mask
+        self._bus = None
+        self._messages = deque(maxlen=size)
+
+    def receive(self, message):
+        """
+        Called by the bus for every message of the categories in the mask.
+        """
+        self._messages.append(message)
+
+    def clear(self):
+        """
+        Forgets the received messages.
+        """
+        self._messages.clear()
+
+
+class ConsoleConsumer(MessageConsumer):
+    """
+    Prints the messages on the console, prefixed with their category.
+    """
+
+    def __init__(self, mask=None):
+        """
+        Constructor
+        Arguments
+            mask - bitmask of the categories to print, defaults to the
+                   logging switches in CONSTANTS
+        """
+        if mask is None:
+            mask = consoleMask()
+        super(ConsoleConsumer, self).__init__(mask, 0)
+
+    def receive(self, message):
+        print MessageCategory.NAMES[message.category] + ": " + message.text
+
+
+class MessageBus(object):
+    """
+    Delivers the messages of a game to the consumers.
+    """
+
+    @property
+    def mask(self):
+        """
+        Bitmask of the categories that at least one consumer receives.
+        """
+        return self._mask
+
+    def __init__(self):
+        """
+        Constructor for a bus without consumers.
+        """
+        self._consumers = []
+        self._mask = 0
+
+    def subscribe(self, consumer):
+        """
+        Adds a consumer to the bus.
+        """
+        self._consumers.append(consumer)
+        consumer._bus = self
+        self.refreshMask()
+
+    def unsubscribe(self, consumer):
+        """
+        Removes a consumer from the bus.
+        """
+        self._consumers.remove(consumer)
+        consumer._bus = None
+        self.refreshMask()
+
+    def refreshMask(self):
+        mask = 0
+        for consumer in self._consumers:
+            mask |= consumer.mask
+        self._mask = mask
+
+    def isEnabled(self, category):
+        """
+        Returns True if a consumer receives messages of the category.
+        """
+        return self._mask & category != 0
+
+    def post(self, category, template, *arguments):
+        """
+        Posts a message. Nothing is created if no consumer receives the
+        category.
+        Arguments
+            category - MessageCategory
+            template - format string for the % operator
+            arguments - arguments for the format string, they are only
+                        converted when the text of the message is read
+        """
+        if self._mask & category == 0:
+            return
+        message = Message(category, template, arguments)
+        for consumer in self._consumers:
+            if consumer.mask & category:
+                consumer.receive(message)
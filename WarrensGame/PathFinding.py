@@ -0,0 +1,211 @@
+#!/usr/bin/python
+
+################
+# Path finding #
+################
+
+import heapq
+
+# Movement in 8 directions, with the cost of every step. Diagonal steps cost
+# 1.5 instead of sqrt(2) so the cost of a path stays exact in floating point.
+_STEPS = [(-1, 0, 1.0), (1, 0, 1.0), (0, -1, 1.0), (0, 1, 1.0),
+          (-1, -1, 1.5), (-1, 1, 1.5), (1, -1, 1.5), (1, 1, 1.5)]
+
+
+def _heuristic(x, y, goalX, goalY):
+    """
+    Octile distance, the cost of the shortest path without obstacles.
+    """
+    dx = abs(x - goalX)
+    dy = abs(y - goalY)
+    return max(dx, dy) + 0.5 * min(dx, dy)
+
+
+def findPath(matrix, start, goal, maxCost=None):
+    """
+    Finds the shortest path from start to goal with the A* algorithm.
+    Movement is possible in 8 directions.
+    Arguments
+        matrix - blocked matrix, values of 0 or False are walkable, 1 or True
+                 are blocked. The start and goal positions are always
+                 considered walkable.
+        start - (x, y) tuple of the start position
+        goal - (x, y) tuple of the goal position
+        maxCost - optional maximum cost of the path, this limits the search
+                  when the goal can not be reached
+    Returns
+        list of (x, y) tuples from the first step up to and including the
+        goal, an empty list if start is the goal or None if there is no path
+    """
+    if start == goal:
+        return []
+    width = len(matrix)
+    height = len(matrix[0])
+    goalX, goalY = goal
+    cameFrom = {start: None}
+    costs = {start: 0.0}
+    openList = [(_heuristic(start[0], start[1], goalX, goalY), 0.0, start)]
+    while openList:
+        estimate, cost, position = heapq.heappop(openList)
+        if position == goal:
+            path = []
+            while position != start:
+                path.append(position)
+                position = cameFrom[position]
+            path.reverse()
+            return path
+        if cost > costs[position]:
+            # Outdated entry, a cheaper route to this position was found
+            continue
+        x, y = position
+        for dx, dy, stepCost in _STEPS:
+            nx = x + dx
+            ny = y + dy
+            if nx < 0 or ny < 0 or nx >= width or ny >= height:
+                continue
+            neighbour = (nx, ny)
+            if matrix[nx][ny] and neighbour != goal:
+                continue
+            newCost = cost + stepCost
+            if maxCost is not None and newCost > maxCost:
+                continue
+            if newCost < costs.get(neighbour, newCost + 1):
+                costs[neighbour] = newCost
+                cameFrom[neighbour] = position
+                heapq.heappush(openList, (newCost + _heuristic(nx, ny, goalX, goalY), newCost, neighbour))
+    return None
+
+
+def _flood(matrix, costs, queue, maxCost=None, domain=None):
+    """
+    Dijkstra flood fill, lowers the costs in place.
+    Arguments
+        matrix - blocked matrix, see findPath()
+        costs - dictionary with the cost per (x, y) position
+        queue - heap of (cost, position) tuples to expand
+        maxCost - optional maximum cost, positions beyond it are not added
+        domain - optional dictionary, only its positions are visited
+    """
+    width = len(matrix)
+    height = len(matrix[0])
+    while queue:
+        cost, position = heapq.heappop(queue)
+        if cost > costs[position]:
+            continue
+        x, y = position
+        for dx, dy, stepCost in _STEPS:
+            nx = x + dx
+            ny = y + dy
+            if nx < 0 or ny < 0 or nx >= width or ny >= height or matrix[nx][ny]:
+                continue
+            neighbour = (nx, ny)
+            if domain is not None and neighbour not in domain:
+                continue
+            newCost = cost + stepCost
+            if maxCost is not None and newCost > maxCost:
+                continue
+            if newCost < costs.get(neighbour, newCost + 1):
+                costs[neighbour] = newCost
+                heapq.heappush(queue, (newCost, neighbour))
+
+
+def computeGoalMap(matrix, goals, maxCost=None):
+    """
+    Computes the cost of the shortest path from every position towards the
+    nearest goal, with one Dijkstra flood fill from the goals.
+    Arguments
+        matrix - blocked matrix, see findPath()
+        goals - list of (x, y) tuples
+        maxCost - optional maximum cost, positions that are further away
+                  are not part of the goal map. This bounds the work to the
+                  positions within reach.
+    Returns
+        GoalMap
+    """
+    costs = {}
+    queue = []
+    for goal in goals:
+        costs[goal] = 0.0
+        queue.append((0.0, goal))
+    heapq.heapify(queue)
+    _flood(matrix, costs, queue, maxCost)
+    return GoalMap(matrix, goals, costs)
+
+
+class GoalMap(object):
+    """
+    Cost towards the nearest goal for the positions around the goals.
+    Every character can look up its best next step, which makes it cheap to
+    let many characters move towards (or away from) the same goals.
+    """
+
+    @property
+    def goals(self):
+        """
+        List of (x, y) positions of the goals.
+        """
+        return self._goals
+
+    @property
+    def costs(self):
+        """
+        Dictionary with the cost per (x, y) position in reach.
+        """
+        return self._costs
+
+    def __init__(self, matrix, goals, costs):
+        """
+        Constructor, use computeGoalMap() to create a goal map.
+        """
+        self._matrix = matrix
+        self._goals = goals
+        self._costs = costs
+        self._inverted = {}
+
+    def cost(self, x, y):
+        """
+        Returns the cost from position (x, y) to the nearest goal, None if
+        the position is not in reach.
+        """
+        return self._costs.get((x, y))
+
+    def nextStep(self, x, y):
+        """
+        Returns the neighbouring position with the lowest cost, this is the
+        best next step from position (x, y). Returns None if there is no
+        better position or if (x, y) is not in reach.
+        """
+        costs = self._costs
+        bestCost = costs.get((x, y))
+        if bestCost is None:
+            return None
+        best = None
+        for dx, dy, stepCost in _STEPS:
+            neighbour = (x + dx, y + dy)
+            cost = costs.get(neighbour)
+            if cost is not None and cost < bestCost:
+                best = neighbour
+                bestCost = cost
+        return best
+
+    def inverted(self, factor=-1.2):
+        """
+        Returns a flee map, following its steps leads away from the goals.
+        The costs are multiplied with a negative factor and flooded again.
+        A factor below -1 makes fleeing characters prefer escape routes over
+        dead ends close by. The flee map covers the same positions as this
+        goal map.
+        Arguments
+            factor - negative multiplication factor
+        Returns
+            GoalMap
+        """
+        fleeMap = self._inverted.get(factor)
+        if fleeMap is None:
+            costs = dict((position, cost * factor) for position, cost in self._costs.items())
+            queue = [(cost, position) for position, cost in costs.items()]
+            heapq.heapify(queue)
+            _flood(self._matrix, costs, queue, domain=self._costs)
+            fleeMap = GoalMap(self._matrix, self._goals, costs)
+            self._inverted[factor] = fleeMap
+        return fleeMap
@@ -0,0 +1,343 @@
+#!/usr/bin/python
+
+#############
+# Profiling #
+#############
+
+# Timers for the phases of game turns and GUI frames. The PhaseTimer keeps
+# totals, the PhaseProfiler also keeps a rolling histogram of the latest
+# durations of every phase so it can show how the timing behaves right now.
+# A FrameCapture runs cProfile for a number of frames.
+
+import bisect
+import cProfile
+import json
+import pstats
+import time
+from collections import deque
+
+import CONSTANTS
+
+
+class PhaseTimer(object):
+    """
+    Measures the duration of turns and of the phases within a turn.
+    A turn is started with startTurn(), every call to mark() closes the phase
+    that ran since the previous mark and endTurn() closes the turn.
+    """
+
+    @property
+    def turnTimes(self):
+        """
+        List with the duration in seconds of every measured turn.
+        """
+        return self._turnTimes
+
+    @property
+    def phaseTimes(self):
+        """
+        Dictionary with the total duration in seconds per phase name.
+        """
+        return self._phaseTimes
+
+    @property
+    def phases(self):
+        """
+        List of the phase names in the order in which they were first
+        measured.
+        """
+        return self._phases
+
+    @property
+    def operationTimes(self):
+        """
+        Dictionary with the total duration in seconds per recorded operation.
+        """
+        return self._operationTimes
+
+    @property
+    def clock(self):
+        """
+        Function that returns the current time in seconds.
+        """
+        return self._clock
+
+    @property
+    def inTurn(self):
+        """
+        True between startTurn() and endTurn().
+        """
+        return self._turnStart is not None
+
+    def __init__(self, clock=time.time):
+        """
+        Constructor to create a timer without measurements.
+        Arguments
+            clock - function that returns the current time in seconds
+        """
+        self._clock = clock
+        self._turnTimes = []
+        self._phaseTimes = {}
+        self._phases = []
+        self._operationTimes = {}
+        self._turnStart = None
+        self._last = None
+
+    def startTurn(self):
+        """
+        Starts measuring a turn.
+        """
+        self._turnStart = self._last = self._clock()
+
+    def mark(self, phase):
+        """
+        Closes the phase that ran since the previous mark.
+        Arguments
+            phase - name of the phase
+        """
+        now = self._clock()
+        if self._last is None:
+            self._last = now
+            return
+        self._addPhase(phase, now - self._last)
+        self._last = now
+
+    def record(self, operation, duration):
+        """
+        Records the duration of an operation within a phase, for example the
+        turn of one character. Operations are not part of the phase times.
+        Arguments
+            operation - name of the operation
+            duration - duration in seconds
+        """
+        self._operationTimes[operation] = self._operationTimes.get(operation, 0.0) + duration
+
+    def endTurn(self):
+        """
+        Closes the turn that was started with startTurn().
+        """
+        if self._turnStart is not None:
+            self._addTurn(self._clock() - self._turnStart)
+        self._turnStart = self._last = None
+
+    def _addPhase(self, phase, duration):
+        if phase not in self._phaseTimes:
+            self._phases.append(phase)
+            self._phaseTimes[phase] = 0.0
+        self._phaseTimes[phase] += duration
+
+    def _addTurn(self, duration):
+        self._turnTimes.append(duration)
+
+
+class RollingHistogram(object):
+    """
+    Keeps the latest durations of a phase.
+    """
+
+    # Upper bounds in milliseconds of the buckets of the histogram, the last
+    # bucket holds everything above the last bound.
+    BOUNDS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0)
+
+    @property
+    def count(self):
+        """
+        Number of durations in the window.
+        """
+        return len(self._samples)
+
+    @property
+    def mean(self):
+        """
+        Mean duration in seconds, 0.0 without durations.
+        """
+        if len(self._samples) == 0:
+            return 0.0
+        return sum(self._samples) / len(self._samples)
+
+    @property
+    def maximum(self):
+        """
+        Longest duration in seconds, 0.0 without durations.
+        """
+        if len(self._samples) == 0:
+            return 0.0
+        return max(self._samples)
+
+    def __init__(self, size=None):
+        """
+        Constructor
+        Arguments
+            size - number of durations to keep, older durations are dropped,
+                   defaults to CONSTANTS.PROFILE_WINDOW
+        """
+        if size is None:
+            size = CONSTANTS.PROFILE_WINDOW
+        self._samples = deque(maxlen=size)
+
+    def add(self, duration):
+        """
+        Adds a duration in seconds.
+        """
+        self._samples.append(duration)
+
+    def percentile(self, fraction):
+        """
+        Returns the duration below which the given fraction of the durations
+        fall, 0.0 without durations.
+        """
+        if len(self._samples) == 0:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def buckets(self):
+        """
+        Returns the number of durations per bucket, see BOUNDS.
+        """
+        counts = [0] * (len(self.BOUNDS) + 1)
+        for duration in self._samples:
+            counts[bisect.bisect_left(self.BOUNDS, duration * 1000.0)] += 1
+        return counts
+
+    def toDict(self):
+        """
+        Returns the statistics of the window as a dictionary, the durations
+        are in milliseconds.
+        """
+        return {'count': self.count,
+                'mean': self.mean * 1000.0,
+                'p50': self.percentile(0.5) * 1000.0,
+                'p95': self.percentile(0.95) * 1000.0,
+                'p99': self.percentile(0.99) * 1000.0,
+                'max': self.maximum * 1000.0,
+                'bounds': list(self.BOUNDS),
+                'buckets': self.buckets()}
+
+
+class PhaseProfiler(PhaseTimer):
+    """
+    PhaseTimer that also keeps a rolling histogram per phase, per operation
+    and of the complete turns.
+    """
+
+    @property
+    def turnHistogram(self):
+        """
+        RollingHistogram of the complete turns.
+        """
+        return self._turnHistogram
+
+    @property
+    def histograms(self):
+        """
+        Dictionary with a RollingHistogram per phase and operation name.
+        """
+        return self._histograms
+
+    def __init__(self, clock=time.time, size=None, keepTurnTimes=False):
+        """
+        Constructor to create a profiler without measurements.
+        Arguments
+            clock - function that returns the current time in seconds
+            size - number of durations in the rolling histograms
+            keepTurnTimes - True to also keep the duration of every turn like
+                            the PhaseTimer does, this list keeps growing
+        """
+        super(PhaseProfiler, self).__init__(clock)
+        self._size = size
+        self._keepTurnTimes = keepTurnTimes
+        self._turnHistogram = RollingHistogram(size)
+        self._histograms = {}
+
+    def _histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = RollingHistogram(self._size)
+        return histogram
+
+    def _addPhase(self, phase, duration):
+        super(PhaseProfiler, self)._addPhase(phase, duration)
+        self._histogram(phase).add(duration)
+
+    def _addTurn(self, duration):
+        if self._keepTurnTimes:
+            super(PhaseProfiler, self)._addTurn(duration)
+        self._turnHistogram.add(duration)
+
+    def record(self, operation, duration):
+        super(PhaseProfiler, self).record(operation, duration)
+        self._histogram(operation).add(duration)
+
+    def toDict(self):
+        """
+        Returns the statistics of all histograms as a dictionary.
+        """
+        phases = dict((phase, self._histograms[phase].toDict()) for phase in self.phases)
+        operations = dict((operation, self._histograms[operation].toDict())
+                          for operation in self.operationTimes)
+        return {'turn': self._turnHistogram.toDict(),
+                'phaseOrder': list(self.phases),
+                'phases': phases,
+                'operations': operations}
+
+    def dumpJson(self, fileName):
+        """
+        Writes the statistics of all histograms to a JSON file.
+        """
+        with open(fileName, 'w') as jsonFile:
+            json.dump(self.toDict(), jsonFile, indent=2, sort_keys=True)
+
+    def summaryLines(self):
+        """
+        Returns a list of short text lines with the p50 and p99 duration of
+        the turns and of every phase and operation, for an overlay.
+        """
+        lines = []
+        names = [('turn', self._turnHistogram)]
+        names += [(phase, self._histograms[phase]) for phase in self.phases]
+        names += [(operation, self._histograms[operation]) for operation in sorted(self.operationTimes)]
+        for name, histogram in names:
+            lines.append('%s %.2f / %.2f ms' % (
+                name, histogram.percentile(0.5) * 1000.0, histogram.percentile(0.99) * 1000.0))
+        return lines
+
+
+class FrameCapture(object):
+    """
+    Runs cProfile for a number of frames and writes the statistics to a file
+    that can be read with the pstats module.
+    """
+
+    @property
+    def finished(self):
+        """
+        True when all frames were captured.
+        """
+        return self._remaining == 0
+
+    def __init__(self, frames, fileName):
+        """
+        Constructor, the capture starts immediately.
+        Arguments
+            frames - number of frames to capture
+            fileName - path of the statistics file
+        """
+        self._remaining = frames
+        self._fileName = fileName
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def frameDone(self):
+        """
+        Should be called at the end of every frame, stops the capture and
+        writes the statistics after the last frame.
+        Returns
+            True if the capture is finished
+        """
+        if self._remaining > 0:
+            self._remaining -= 1
+            if self._remaining == 0:
+                self._profile.disable()
+                pstats.Stats(self._profile).dump_stats(self._fileName)
+        return self.finished
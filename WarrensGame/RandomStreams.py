@@ -0,0 +1,80 @@
+#!/usr/bin/python
+
+##################
+# Random streams #
+##################
+
+import hashlib
+import random
+
+
+class RandomStreams(object):
+    """
+    Seedable source of random number generators.
+    Every part of the game that needs randomness asks for its own stream by
+    name, for example 'combat' or 'level:Town'. Each stream is seeded from the
+    world seed and its name, so the numbers drawn from one stream do not
+    depend on how many numbers were drawn from the other streams. As a result
+    any level can be generated again from the world seed and its name.
+    """
+
+    @property
+    def seed(self):
+        """
+        The world seed from which all streams are derived.
+        """
+        return self._seed
+
+    def __init__(self, seed=None):
+        """
+        Constructor to create a new set of random streams.
+        Arguments
+            seed - integer world seed, a random seed is used when omitted
+        """
+        if seed is None:
+            seed = random.getrandbits(32)
+        self._seed = seed
+        self._streams = {}
+
+    def getSeed(self, name):
+        """
+        Returns the seed of the stream with the given name.
+        The seed is derived from the world seed, it is stable between runs
+        and between builds.
+        Arguments
+            name - string that identifies the stream
+        """
+        digest = hashlib.sha1(str(self.seed) + ':' + name).hexdigest()
+        return int(digest[:8], 16)
+
+    def getStream(self, name):
+        """
+        Returns the random number generator for the stream with the given
+        name. The stream is created the first time it is requested.
+        Arguments
+            name - string that identifies the stream
+        Returns
+            random.Random object
+        """
+        stream = self._streams.get(name)
+        if stream is None:
+            stream = random.Random(self.getSeed(name))
+            self._streams[name] = stream
+        return stream
+
+    def getState(self):
+        """
+        Returns the state of all streams that were used so far.
+        Returns
+            dictionary with the state of every stream, keyed on stream name
+        """
+        return dict((name, stream.getstate()) for name, stream in self._streams.items())
+
+    def setState(self, state):
+        """
+        Restores the streams to a state returned by getState().
+        Arguments
+            state - dictionary with the state of every stream
+        """
+        for name, streamState in state.items():
+            self.getStream(name).setstate(streamState)
@@ -0,0 +1,692 @@
+#!/usr/bin/python
+
+#############
+# Save game #
+#############
+
+# File layout
+#   header   - magic string, format version, offset and length of the index
+#   sections - raw tile layers and marshalled actor records, 8 byte aligned
+#   index    - marshalled description of the game, it points to the sections
+#
+# Tile layers are stored as packed arrays so they can be loaded straight
+# from the memory mapped file. Levels that were generated but are not the
+# current level stay in the file until the player visits them again. Before
+# a save file is replaced, those levels copy their data out of the file and
+# the memory map is closed, some systems do not allow replacing a mapped file.
+
+import marshal
+import mmap
+import os
+import random
+import struct
+import threading
+import weakref
+
+import numpy
+
+import Utilities
+import Actors
+import AI
+import Effects
+import Levels
+import Maps
+from Libraries import MonsterLibrary, ItemLibrary, ItemModifier
+from RandomStreams import RandomStreams
+
+SAVE_MAGIC = 'WARRENS\x00'
+SAVE_VERSION = 1
+
+_HEADER = struct.Struct('<8sH6xQQ')
+_ALIGNMENT = 8
+
+# Actor reference of the player
+PLAYER_REFERENCE = (-1, 0)
+
+# Monsters get their hit points from the saved game, the hit die that is
+# rolled while creating the monster should not consume game randomness.
+_restoreRandom = random.Random(0)
+
+
+def saveGame(game, fileName):
+    """
+    Saves the state of the game to a file.
+    The file is written next to the target and renamed when complete, this
+    way a failing save does not destroy the previous save.
+    Arguments
+        game - Game to save
+        fileName - path of the save file
+    """
+    writer = _SaveWriter(fileName + '.tmp')
+    try:
+        index = _saveIndex(game, writer)
+        writer.close(marshal.dumps(index))
+    except:
+        writer.abort()
+        raise
+    releaseSaveFile(fileName)
+    if os.path.exists(fileName):
+        os.remove(fileName)
+    os.rename(fileName + '.tmp', fileName)
+
+
+def loadGame(game, fileName):
+    """
+    Replaces the state of the game with the state saved in a file.
+    The current level is restored immediately, other generated levels are
+    restored when they are needed.
+    Arguments
+        game - Game to load the saved state into
+        fileName - path of the save file
+    """
+    with open(fileName, 'rb') as saveFile:
+        # An empty file can not be memory mapped
+        if os.fstat(saveFile.fileno()).st_size < _HEADER.size:
+            raise Utilities.GameError('Not a Warrens save file: ' + fileName)
+        buf = mmap.mmap(saveFile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, indexOffset, indexLength = _HEADER.unpack_from(buf, 0)
+        if magic != SAVE_MAGIC:
+            raise Utilities.GameError('Not a Warrens save file: ' + fileName)
+        if version > SAVE_VERSION:
+            raise Utilities.GameError('Unsupported save file version ' + str(version))
+        index = marshal.loads(buf[indexOffset:indexOffset + indexLength])
+        savedLevels = _loadIndex(game, buf, index)
+    except:
+        buf.close()
+        raise
+    _registerSavedLevels(fileName, [s for s in savedLevels if s is not None and s.level.savedLevel is s])
+
+
+# Saved levels that read from a memory mapped save file, per path of the file
+_savedLevelsByFile = {}
+_savedLevelsLock = threading.Lock()
+
+
+def _registerSavedLevels(fileName, savedLevels):
+    key = os.path.abspath(fileName)
+    with _savedLevelsLock:
+        registered = _savedLevelsByFile.setdefault(key, weakref.WeakSet())
+        for savedLevel in savedLevels:
+            registered.add(savedLevel)
+
+
+def releaseSaveFile(fileName):
+    """
+    Copies the data of the saved levels that still read from a save file out
+    of the file and closes the memory map of the file. The file can be
+    replaced afterwards.
+    Arguments
+        fileName - path of the save file
+    """
+    with _savedLevelsLock:
+        savedLevels = list(_savedLevelsByFile.pop(os.path.abspath(fileName), []))
+    buffers = {}
+    for savedLevel in savedLevels:
+        # The level can be restored from the data at the same time
+        with savedLevel.level.game.generationLock:
+            if savedLevel.level.savedLevel is savedLevel:
+                buf = savedLevel.buf
+                savedLevel.detach()
+                buffers[id(buf)] = buf
+    for buf in buffers.values():
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+
+class SavedLevel(object):
+    """
+    Saved data of a generated level that is not restored yet.
+    The level restores itself from this data when it is generated.
+    """
+
+    def __init__(self, level, buf, entry, portals):
+        """
+        Constructor
+        Arguments
+            level - the Level that will be restored
+            buf - buffer (memory mapped save file) that holds the sections
+            entry - index entry that describes the level
+            portals - list of (portal, x, y) for the portals on the level
+        """
+        self.level = level
+        self.buf = buf
+        self.entry = entry
+        self.portals = portals
+        # Restored actors, in the order of the saved records
+        self.actors = None
+
+    def readLayers(self):
+        """
+        Returns the tile layers of the level as numpy arrays.
+        The arrays are views on the save file and must not be modified.
+        """
+        width, height = self.entry['size']
+        count = width * height
+        offset = self.entry['layers']
+        layers = []
+        for dtype, depth in _LAYER_TYPES:
+            layer = numpy.frombuffer(self.buf, dtype, count * depth, offset)
+            if depth > 1:
+                layers.append(layer.reshape(width, height, depth))
+            else:
+                layers.append(layer.reshape(width, height))
+            offset += count * depth
+        return tuple(layers)
+
+    def readSection(self, key):
+        """
+        Returns the raw bytes of a section of this level.
+        """
+        offset, length = self.entry[key]
+        return self.buf[offset:offset + length]
+
+    def detach(self):
+        """
+        Copies the sections of this level out of the save file, afterwards
+        the level no longer reads from the file.
+        """
+        entry = dict(self.entry)
+        layers = self.buf[entry['layers']:entry['layers'] + _layerSize(entry['size'])]
+        actors = self.readSection('actors')
+        entry['layers'] = 0
+        entry['actors'] = (len(layers), len(actors))
+        self.buf = layers + actors
+        self.entry = entry
+
+    def restore(self):
+        """
+        Restores the map, the actors and the portals of the level.
+        """
+        level = self.level
+        entry = self.entry
+        mapClass = getattr(Maps, entry['map'])
+        myMap = mapClass.fromLayers(level, self.readLayers(), entry['areas'], entry['rangeOfView'])
+        myMap.fieldOfViewMode = entry['fieldOfViewMode']
+        level._map = myMap
+        level.random.setstate(entry['random'])
+        game = level.game
+        self.actors = [restoreActor(game, level, record)
+                       for record in marshal.loads(self.readSection('actors'))]
+        for portal, x, y in self.portals:
+            portal.moveToTile(myMap.tiles[x][y])
+
+
+class _SaveWriter(object):
+    """
+    Writes the sections of a save file, the index is written last.
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.file = open(fileName, 'wb')
+        self.file.write(_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, 0, 0))
+        self.offset = _HEADER.size
+
+    def write(self, data):
+        """
+        Writes a section and returns its offset.
+        """
+        padding = -self.offset % _ALIGNMENT
+        if padding:
+            self.file.write('\x00' * padding)
+            self.offset += padding
+        offset = self.offset
+        self.file.write(data)
+        self.offset += len(data)
+        return offset
+
+    def writeSection(self, data):
+        """
+        Writes a section and returns its (offset, length).
+        """
+        return self.write(data), len(data)
+
+    def close(self, index):
+        indexOffset, indexLength = self.writeSection(index)
+        self.file.seek(0)
+        self.file.write(_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, indexOffset, indexLength))
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.fileName)
+
+
+# Data type and depth of the stored layers, in the order of Map.fromLayers()
+_LAYER_TYPES = [(numpy.bool_, 1),
+                (numpy.bool_, 1),
+                (numpy.bool_, 1),
+                (numpy.uint8, 1),
+                (numpy.uint8, 3)]
+
+
+def allLevels(game):
+    """
+    Returns all levels of the game, sub levels follow their parent level.
+    """
+    levels = []
+    def add(level):
+        levels.append(level)
+        for subLevel in level.subLevels:
+            add(subLevel)
+    for level in game.levels:
+        add(level)
+    return levels
+
+
+def _saveIndex(game, writer):
+    """
+    Writes the sections of all levels and returns the index of the game.
+    """
+    levels = allLevels(game)
+    levelIndex = dict((id(level), i) for i, level in enumerate(levels))
+    # Portals connect levels, they are saved for the whole game
+    portals = []
+    for level in levels:
+        portals.extend(level.portals)
+    portalIndex = dict((id(portal), i) for i, portal in enumerate(portals))
+    # Actor references (level index, record index) for the active effects
+    actorIndex = {id(game.player): PLAYER_REFERENCE}
+
+    entries = []
+    uniques = []
+    for level in levels:
+        entry = {}
+        saved = level.savedLevel
+        if saved is not None:
+            # Not restored since the last load, copy the saved sections
+            entry.update(saved.entry)
+            entry['layers'] = writer.write(buffer(saved.buf, saved.entry['layers'],
+                                                  _layerSize(saved.entry['size'])))
+            entry['actors'] = writer.writeSection(saved.readSection('actors'))
+        entry.update({'type': level.__class__.__name__,
+                      'name': level.name,
+                      'difficulty': level.difficulty,
+                      'seed': level.seed,
+                      'parent': -1,
+                      'generated': saved is not None})
+        for parent in levels:
+            if level in parent.subLevels:
+                entry['parent'] = levelIndex[id(parent)]
+        if isinstance(level, Levels.SingleRoomLevel):
+            area = level._area
+            entry['area'] = (area.x1, area.y1, area.x2, area.y2)
+            entry['doors'] = [(portalIndex[id(portal)], x, y) for portal, x, y in level._doors]
+        if saved is None and level.isGenerated:
+            myMap = level.map
+            entry['generated'] = True
+            entry['map'] = myMap.__class__.__name__
+            entry['size'] = (myMap.width, myMap.height)
+            entry['areas'] = [(a.x1, a.y1, a.x2, a.y2) for a in myMap.areas or []]
+            entry['rangeOfView'] = myMap.rangeOfView
+            entry['fieldOfViewMode'] = myMap.fieldOfViewMode
+            entry['random'] = level.random.getstate()
+            entry['layers'] = writer.write(''.join(layer.tobytes() for layer in
+                                                   [myMap.blockedLayer, myMap.blockSightLayer,
+                                                    myMap.exploredLayer, myMap.materialLayer,
+                                                    myMap.colorLayer]))
+            records = []
+            entry['uniques'] = []
+            for column in myMap.tiles:
+                for tile in column:
+                    for actor in tile.actors:
+                        if actor is game.player or isinstance(actor, Actors.Portal):
+                            continue
+                        actorIndex[id(actor)] = (levelIndex[id(level)], len(records))
+                        records.append(actorRecord(actor))
+                        if isinstance(actor, Actors.Monster) and actor.baseMonster.get('unique'):
+                            entry['uniques'].append(actor.key)
+            entry['actors'] = writer.writeSection(marshal.dumps(records))
+        uniques.extend(entry.get('uniques', []))
+        entries.append(entry)
+
+    portalRecords = []
+    for portal in portals:
+        x, y = -1, -1
+        if portal.tile is not None:
+            x, y = portal.tile.x, portal.tile.y
+        elif portal.level.savedLevel is not None:
+            for savedPortal, savedX, savedY in portal.level.savedLevel.portals:
+                if savedPortal is portal:
+                    x, y = savedX, savedY
+        portalRecords.append((levelIndex[id(portal.level)], x, y,
+                              portalIndex[id(portal.destinationPortal)],
+                              portal.char, portal.name, portal.message))
+
+    player = game.player
+    effects = [effectRecord(effect, actorIndex, levelIndex) for effect in game.activeEffects]
+    for unique in game.monsterLibrary.uniqueMonsters:
+        uniques.append(unique.key)
+    return {'seed': game.randomStreams.seed,
+            'streams': game.randomStreams.getState(),
+            'state': game.state,
+            'currentLevel': levelIndex[id(game.currentLevel)],
+            'levels': entries,
+            'portals': portalRecords,
+            'player': (levelIndex[id(player.level)], player.tile.x, player.tile.y, playerRecord(player)),
+            'effects': effects,
+            'uniques': sorted(set(uniques))}
+
+
+def _layerSize(size):
+    width, height = size
+    return sum(width * height * depth for dtype, depth in _LAYER_TYPES)
+
+
+def _itemRecord(item):
+    isEquiped = isinstance(item, Actors.Equipment) and item.isEquiped
+    return (item.key, [modifier.key for modifier in item.modifiers], item.stackSize, isEquiped)
+
+
+def _inventoryRecord(character):
+    return [_itemRecord(item) for item in character.inventory.items]
+
+
+def _characterRecord(character):
+    return (character.name, character.char, tuple(character.color),
+            character.currentHitPoints, character.state, _inventoryRecord(character))
+
+
+def actorRecord(actor):
+    """
+    Returns a compact record of an actor on a tile.
+    """
+    x, y = actor.tile.x, actor.tile.y
+    if isinstance(actor, Actors.Monster):
+        confusedTurns = 0
+        if isinstance(actor.AI, AI.ConfusedMonsterAI):
+            confusedTurns = actor.AI.confusedTurns
+        # Generated monsters are not in the library, they are recreated
+        # from their difficulty
+        difficulty = 0
+        if actor.key == 'random':
+            difficulty = int(actor.baseMonster.hitdie.split('d')[0])
+        return ('Monster', x, y, actor.key, difficulty, confusedTurns, _characterRecord(actor))
+    elif isinstance(actor, Actors.NPC):
+        return ('NPC', x, y, _characterRecord(actor))
+    elif isinstance(actor, Actors.Container):
+        return ('Container', x, y, actor.name, actor.flavorText,
+                [_itemRecord(item) for item in actor.inventory.items])
+    elif isinstance(actor, Actors.Item):
+        return ('Item', x, y, _itemRecord(actor))
+    raise Utilities.GameError("Can't save actor " + str(actor))
+
+
+def playerRecord(player):
+    """
+    Returns a compact record of the player, without the location.
+    """
+    return (_characterRecord(player), player.xp, player.nextLevelXp, player.playerLevel,
+            (player.baseAccuracy, player.baseDodge, player.baseDamage,
+             player.baseArmor, player.baseBody, player.baseMind),
+            tuple(player.direction))
+
+
+def effectRecord(effect, actorIndex, levelIndex):
+    """
+    Returns a compact record of an active effect.
+    Arguments
+        effect - the active Effect
+        actorIndex - dictionary with an actor reference per actor id
+        levelIndex - dictionary with a level number per level id
+    """
+    source = effect.source
+    owner = actorIndex.get(id(source.owner), None)
+    centerTile = getattr(effect, 'centerTile', None)
+    center = None
+    level = -1
+    if centerTile is not None:
+        center = (centerTile.x, centerTile.y)
+        level = levelIndex[id(centerTile.map.level)]
+    actors = [actorIndex[id(actor)] for actor in effect.actors if id(actor) in actorIndex]
+    for actor in effect.actors:
+        if actor.level is not None:
+            level = levelIndex[id(actor.level)]
+    return (effect.__class__.__name__, _itemRecord(source), owner, effect.effectDuration,
+            level, center, [(tile.x, tile.y) for tile in effect.tiles], actors)
+
+
+def _loadIndex(game, buf, index):
+    """
+    Rebuilds the game from the index of a save file.
+    Returns the SavedLevel of every level, None for the levels that were not
+    generated.
+    """
+    game.waitForPrefetch()
+    game._randomStreams = RandomStreams(index['seed'])
+    game.randomStreams.setState(index['streams'])
+    game._monsterLibrary = MonsterLibrary()
+    game._itemLibrary = ItemLibrary()
+    game.monsterLibrary.random = game.randomStreams.getStream('monsters')
+    game.itemLibrary.random = game.randomStreams.getStream('items')
+    for key in index['uniques']:
+        game.monsterLibrary.reserveUniqueMonster(key)
+    game._activeEffects = []
+    game._state = index['state']
+
+    # Create the levels, none of them is generated yet
+    levels = []
+    game._levels = []
+    for entry in index['levels']:
+        levelClass = getattr(Levels, entry['type'])
+        if levelClass is Levels.SingleRoomLevel:
+            x1, y1, x2, y2 = entry['area']
+            area = Maps.Room(None, x1, y1, x2 - x1, y2 - y1)
+            level = levelClass(game, entry['difficulty'], entry['name'], area, entry['seed'])
+        else:
+            level = levelClass(game, entry['difficulty'], entry['name'], entry['seed'])
+        if entry['parent'] < 0:
+            game._levels.append(level)
+        else:
+            levels[entry['parent']].subLevels.append(level)
+        levels.append(level)
+    game.assignUniqueMonsters()
+
+    # Create the portals and register them with their level
+    portals = []
+    placements = [[] for level in levels]
+    for levelNbr, x, y, destination, char, name, portalMessage in index['portals']:
+        portal = Actors.Portal()
+        portal.char = char
+        portal.name = name
+        portal.message = portalMessage
+        portals.append(portal)
+        if x >= 0:
+            placements[levelNbr].append((portal, x, y))
+    for portal, record in zip(portals, index['portals']):
+        portal.connectTo(portals[record[3]])
+        portal.level = levels[record[0]]
+    savedLevels = []
+    for level, entry, placement in zip(levels, index['levels'], placements):
+        for portalNbr, x, y in entry.get('doors', []):
+            level._doors.append((portals[portalNbr], x, y))
+        savedLevel = None
+        if entry['generated']:
+            savedLevel = SavedLevel(level, buf, entry, placement)
+            level.savedLevel = savedLevel
+        savedLevels.append(savedLevel)
+
+    # Levels with active effects and the current level are restored now
+    levelNbr, x, y, playerRecord = index['player']
+    game._currentLevel = levels[index['currentLevel']]
+    game._player = restorePlayer(game, playerRecord)
+    game.player.moveToLevel(levels[levelNbr], levels[levelNbr].map.tiles[x][y])
+    def resolveActor(reference):
+        if reference == PLAYER_REFERENCE:
+            return game.player
+        levelNbr, actorNbr = reference
+        # Ensure the level is restored, effects need their actors
+        levels[levelNbr].generate()
+        return savedLevels[levelNbr].actors[actorNbr]
+    for record in index['effects']:
+        effect = restoreEffect(game, levels, record, resolveActor)
+        if effect is not None:
+            game.activeEffects.append(effect)
+    game.currentLevel.map.updateFieldOfView(game.player.tile.x, game.player.tile.y)
+    return savedLevels
+
+
+def _restoreItem(game, record):
+    key, modifierKeys, stackSize, isEquiped = record
+    lib = game.itemLibrary
+    item = lib.createItem(key)
+    for modifierKey in modifierKeys:
+        item.addModifier(ItemModifier(lib.modifierIndex[modifierKey]))
+    item.stackSize = stackSize
+    if isEquiped:
+        item.isEquiped = True
+    return item
+
+
+def _restoreInventory(game, actor, records):
+    actor.inventory.clear()
+    if isinstance(actor, Actors.Character):
+        del actor.equipedItems[:]
+    for record in records:
+        item = _restoreItem(game, record)
+        actor.inventory.add(item)
+        if isinstance(actor, Actors.Character) and record[3]:
+            actor.equipedItems.append(item)
+    if isinstance(actor, Actors.Character):
+        actor.invalidateStats()
+
+
+def _restoreCharacter(game, character, record):
+    name, char, color, hitPoints, state, inventory = record
+    character._name = name
+    character._char = char
+    character._color = color
+    character._currentHitPoints = hitPoints
+    character._state = state
+    if state == Actors.Character.DEAD:
+        character._AI = None
+    _restoreInventory(game, character, inventory)
+
+
+def _restoreConfusion(monster, confusedTurns):
+    if isinstance(monster.AI, AI.ConfusedMonsterAI):
+        if confusedTurns > 0:
+            monster.AI.confusedTurns = confusedTurns
+        else:
+            monster.AI = monster.AI.originalAI
+    elif confusedTurns > 0 and monster.AI is not None:
+        AI.ConfusedMonsterAI(None, monster, confusedTurns)
+
+
+def restoreActor(game, level, record):
+    """
+    Creates the actor described by a record and moves it to its tile.
+    Arguments
+        game - Game to which the actor belongs
+        level - Level on which the actor is located
+        record - record of the actor, as returned by actorRecord()
+    """
+    kind = record[0]
+    if kind == 'Monster':
+        key, difficulty = record[3:5]
+        lib = game.monsterLibrary
+        if key == 'random':
+            actor = lib.generateMonster(difficulty, _restoreRandom)
+        else:
+            actor = lib.createMonster(key, _restoreRandom)
+    elif kind == 'NPC':
+        actor = Actors.NPC(_restoreRandom)
+    elif kind == 'Container':
+        actor = Actors.Container()
+    elif kind == 'Item':
+        actor = _restoreItem(game, record[3])
+    else:
+        raise Utilities.GameError('Unknown actor record ' + str(kind))
+    updateActor(game, actor, record, level)
+    return actor
+
+
+def updateActor(game, actor, record, level=None):
+    """
+    Updates an existing actor to the state described by a record.
+    Arguments
+        game - Game to which the actor belongs
+        actor - the Actor to update
+        record - record of the actor, as returned by actorRecord()
+        level - Level on which the actor is located, defaults to the level
+                of the current tile of the actor
+    """
+    kind, x, y = record[:3]
+    if level is None:
+        level = actor.tile.map.level
+    tile = level.map.tiles[x][y]
+    if kind == 'Monster':
+        confusedTurns, characterRecord = record[5:]
+        _restoreCharacter(game, actor, characterRecord)
+        _restoreConfusion(actor, confusedTurns)
+    elif kind == 'NPC':
+        _restoreCharacter(game, actor, record[3])
+    elif kind == 'Container':
+        actor.name, actor.flavorText, items = record[3:]
+        _restoreInventory(game, actor, items)
+    elif kind == 'Item':
+        actor.stackSize = record[3][2]
+    if kind == 'Container':
+        # Containers are not registered with the level
+        if actor.tile is not tile:
+            actor.moveToTile(tile)
+    elif actor.level is not level:
+        actor.moveToLevel(level, tile)
+    elif actor.tile is not tile:
+        actor.moveToTile(tile)
+
+
+def restorePlayer(game, record):
+    """
+    Creates the player described by a record, the player is not placed on
+    a level.
+    """
+    player = Actors.Player(_restoreRandom)
+    updatePlayer(game, player, record)
+    return player
+
+
+def updatePlayer(game, player, record):
+    """
+    Updates the player to the state described by a record, as returned by
+    playerRecord(). The location of the player is not changed.
+    """
+    characterRecord, xp, nextLevelXp, playerLevel, stats, direction = record
+    _restoreCharacter(game, player, characterRecord)
+    player._xp = xp
+    player._nextLevelXp = nextLevelXp
+    player._playerLevel = playerLevel
+    (player._baseAccuracy, player._baseDodge, player._baseDamage,
+     player._baseArmor, player._baseBody, player._baseMind) = stats
+    player.invalidateStats()
+    player.direction = direction
+
+
+def restoreEffect(game, levels, record, resolveActor):
+    """
+    Recreates an active effect, the level of the effect is restored first.
+    Arguments
+        game - Game to which the effect belongs
+        levels - list of all levels, as returned by allLevels()
+        record - record of the effect, as returned by effectRecord()
+        resolveActor - function that returns the actor for an actor reference
+    Returns
+        the Effect or None if the effect is not located on a level
+    """
+    className, sourceRecord, owner, duration, levelNbr, center, tiles, actors = record
+    if levelNbr < 0:
+        return None
+    level = levels[levelNbr]
+    level.generate()
+    source = _restoreItem(game, sourceRecord)
+    if owner is not None:
+        source.owner = resolveActor(owner)
+    effect = getattr(Effects, className)(source)
+    effect.effectDuration = duration
+    effect._random = game.randomStreams.getStream('effects')
+    effect._tiles = [level.map.tiles[x][y] for x, y in tiles]
+    if center is not None:
+        effect._centerTile = level.map.tiles[center[0]][center[1]]
+    effect._actors = [resolveActor(reference) for reference in actors]
+    return effect
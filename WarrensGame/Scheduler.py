@@ -0,0 +1,148 @@
+#!/usr/bin/python
+
+##################
+# Turn scheduler #
+##################
+
+# Only the characters around the player are simulated. Characters are asleep
+# until the player comes close or sees them, the spatial index of the level
+# is used to find them. Characters that lose track of the player fall asleep
+# again.
+#
+# Awake characters wait in a priority queue on the time of their next action.
+# Every turn of the player advances the time by TURN_DURATION, a character of
+# normal speed acts once per turn, faster characters act more often.
+
+import heapq
+from itertools import chain
+
+import CONSTANTS
+import Actors
+from Utilities import distanceBetween
+
+# Time that passes during one turn of the player
+TURN_DURATION = 100
+
+
+class TurnScheduler(object):
+    """
+    Decides which characters on a level act during a turn and in which
+    order.
+    """
+
+    @property
+    def level(self):
+        """
+        The level of which the characters are scheduled.
+        """
+        return self._level
+
+    @property
+    def time(self):
+        """
+        Time at the start of the next turn.
+        """
+        return self._time
+
+    @property
+    def awakeCharacters(self):
+        """
+        List of the characters that are awake, in the order of their next
+        action.
+        """
+        return [entry[2] for entry in sorted(self._queue)
+                if self._awake.get(id(entry[2])) == entry[1]]
+
+    def __init__(self, level):
+        """
+        Constructor to create a scheduler without awake characters.
+        Arguments
+            level - Level of which the characters are scheduled
+        """
+        self._level = level
+        self._time = 0
+        # Heap of (time, sequence, character) tuples. Entries are not removed
+        # from the heap, they become outdated when the sequence of the
+        # character changes.
+        self._queue = []
+        self._awake = {}
+        self._sequence = 0
+
+    def isAwake(self, character):
+        """
+        Returns True if the character is awake.
+        """
+        return id(character) in self._awake
+
+    def wake(self, character):
+        """
+        Wakes the character up, it will act during the next turn.
+        Characters that are already awake are not affected.
+        """
+        if id(character) not in self._awake:
+            self._schedule(character, self._time)
+
+    def sleep(self, character):
+        """
+        Puts the character asleep, it no longer acts until it is woken up.
+        """
+        self._awake.pop(id(character), None)
+
+    def _schedule(self, character, time):
+        self._sequence += 1
+        self._awake[id(character)] = self._sequence
+        heapq.heappush(self._queue, (time, self._sequence, character))
+
+    def wakeNearby(self, player):
+        """
+        Wakes up the characters that hear or see the player.
+        """
+        x = player.tile.x
+        y = player.tile.y
+        nearby = self.level.actorsInRadius(x, y, CONSTANTS.MONSTER_WAKE_RADIUS)
+        for actor in chain(nearby, self.level.charactersInView()):
+            if (isinstance(actor, Actors.Character) and actor is not player
+                    and actor.state == Actors.Character.ACTIVE):
+                self.wake(actor)
+
+    def _fallsAsleep(self, character, player):
+        if character.level is not self.level or character.state != Actors.Character.ACTIVE:
+            return True
+        if character.inView or player.level is not self.level:
+            return False
+        return distanceBetween(character, player) > CONSTANTS.MONSTER_SLEEP_RADIUS
+
+    def playTurn(self, player):
+        """
+        Lets the awake characters act for one turn of the player.
+        Arguments
+            player - the Player, characters around the player are woken up
+        """
+        if player.level is self.level:
+            self.wakeNearby(player)
+        endTime = self._time + TURN_DURATION
+        queue = self._queue
+        awake = self._awake
+        timer = None
+        if self.level.game is not None:
+            timer = self.level.game.phaseTimer
+        while len(queue) > 0 and queue[0][0] < endTime:
+            time, sequence, character = heapq.heappop(queue)
+            if awake.get(id(character)) != sequence:
+                # Outdated entry
+                continue
+            if self._fallsAsleep(character, player):
+                del awake[id(character)]
+                continue
+            if timer is None:
+                character.takeTurn()
+            else:
+                start = timer.clock()
+                character.takeTurn()
+                timer.record('takeTurn', timer.clock() - start)
+            character.actionTaken = False
+            # Taking a turn can remove the character from the level
+            if awake.get(id(character)) == sequence:
+                delay = max(1, TURN_DURATION * CONSTANTS.NORMAL_SPEED // max(1, character.speed))
+                self._schedule(character, time + delay)
+        self._time = endTime
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+#####################
+# Batch simulation  #
+#####################
+
+# Plays games without a GUI to measure the speed of the game engine. Every
+# game is created from its own seed and a scripted player plays a number of
+# turns on the first dungeon level. The report shows the number of turns per
+# second, the turn latency and the time spent in every phase of a turn.
+#
+# Run it from the root of the repository:
+#     python Launcher.py -SIM [games] [turns] [policy]
+
+import random
+
+import CONSTANTS
+import Game
+from Actors import Character, Monster
+from AI import DIRECTIONS
+from Profiling import PhaseTimer
+from Utilities import distanceBetween
+
+
+class RandomPolicy(object):
+    """
+    Player policy that wanders around. The player keeps walking in the same
+    direction until something blocks the way.
+    """
+
+    def __init__(self, rng):
+        """
+        Constructor
+        Arguments
+            rng - random.Random used to choose the directions
+        """
+        self._random = rng
+        self._direction = rng.choice(DIRECTIONS)
+
+    def act(self, game):
+        """
+        Lets the player of the game take an action.
+        """
+        player = game.player
+        dx, dy = self._direction
+        if player.level.map.tiles[player.tile.x + dx][player.tile.y + dy].blocked:
+            self._direction = dx, dy = self._random.choice(DIRECTIONS)
+        player.tryMoveOrAttack(dx, dy)
+
+
+class HunterPolicy(RandomPolicy):
+    """
+    Player policy that attacks the nearest monster in view, it wanders
+    around when there are no monsters in view.
+    """
+
+    def act(self, game):
+        """
+        Lets the player of the game take an action.
+        """
+        player = game.player
+        monsters = [c for c in player.level.charactersInView()
+                    if isinstance(c, Monster) and c.state == Character.ACTIVE]
+        if len(monsters) > 0:
+            target = min(monsters, key=lambda m: distanceBetween(player, m))
+            start = (player.tile.x, player.tile.y)
+            goal = (target.tile.x, target.tile.y)
+            path = player.tile.map.getPath(player, start, goal, CONSTANTS.PATH_MAX_COST)
+            if path:
+                player.tryMoveOrAttack(path[0][0] - start[0], path[0][1] - start[1])
+                return
+        super(HunterPolicy, self).act(game)
+
+
+POLICIES = {'random': RandomPolicy,
+            'hunter': HunterPolicy}
+
+# Number of turns between two samples of the xp of the player
+XP_SAMPLE_INTERVAL = 50
+
+
+class SimulationResult(object):
+    """
+    Outcome and measurements of one simulated game.
+    """
+
+    def __init__(self, seed, turns, timer, player, xpCurve):
+        self.seed = seed
+        self.turns = turns
+        self.timer = timer
+        self.survived = player.state != Character.DEAD
+        self.playerLevel = player.playerLevel
+        self.xp = player.xp
+        # Xp of the player every XP_SAMPLE_INTERVAL turns
+        self.xpCurve = xpCurve
+        # Key of the monster that killed the player, empty if it survived
+        self.killer = ''
+        if player.killer is not None:
+            self.killer = player.killer.key
+
+
+def simulateGame(seed, turns, policy='hunter', startLevel=1):
+    """
+    Plays one game with a scripted player.
+    Arguments
+        seed - world seed of the game
+        turns - maximum number of turns to play, the game ends earlier when
+                the player dies
+        policy - name of the player policy, see POLICIES
+        startLevel - index of the level on which the player starts
+    Returns
+        SimulationResult
+    """
+    game = Game.Game()
+    game.resetGame(seed)
+    player = game.player
+    if startLevel > 0:
+        level = game.levels[startLevel]
+        portal = [p for p in game.currentLevel.portals if p.destinationPortal.level is level][0]
+        player.followPortal(portal)
+        level.map.updateFieldOfView(player.tile.x, player.tile.y)
+    playerPolicy = POLICIES[policy](random.Random(seed))
+    timer = PhaseTimer()
+    game.phaseTimer = timer
+    played = 0
+    xpCurve = []
+    while played < turns and player.state != Character.DEAD:
+        timer.startTurn()
+        playerPolicy.act(game)
+        player.actionTaken = True
+        timer.mark('player')
+        game.tryToPlayTurn()
+        timer.endTurn()
+        played += 1
+        if played % XP_SAMPLE_INTERVAL == 0:
+            xpCurve.append(player.xp)
+    return SimulationResult(seed, played, timer, player, xpCurve)
+
+
+def runBatch(nbrOfGames, turns, policy='hunter', firstSeed=1):
+    """
+    Simulates a number of games, the seeds are consecutive numbers.
+    Returns
+        list of SimulationResult
+    """
+    return [simulateGame(seed, turns, policy)
+            for seed in range(firstSeed, firstSeed + nbrOfGames)]
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the values fall.
+    """
+    ordered = sorted(values)
+    if len(ordered) == 0:
+        return 0.0
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+    return ordered[index]
+
+
+def formatReport(results):
+    """
+    Returns a textual report of the measurements of the simulated games.
+    """
+    turnTimes = []
+    phaseTimes = {}
+    phases = []
+    for result in results:
+        turnTimes.extend(result.timer.turnTimes)
+        for phase in result.timer.phases:
+            if phase not in phaseTimes:
+                phases.append(phase)
+                phaseTimes[phase] = 0.0
+            phaseTimes[phase] += result.timer.phaseTimes[phase]
+    totalTime = sum(turnTimes)
+    nbrOfTurns = len(turnTimes)
+    lines = []
+    lines.append('%d games, %d turns, %d survivors' % (
+        len(results), nbrOfTurns, len([r for r in results if r.survived])))
+    if nbrOfTurns == 0 or totalTime == 0:
+        return '\n'.join(lines)
+    lines.append('%.1f turns per second' % (nbrOfTurns / totalTime))
+    lines.append('turn latency p50 %.3f ms, p99 %.3f ms' % (
+        percentile(turnTimes, 0.5) * 1000.0, percentile(turnTimes, 0.99) * 1000.0))
+    for phase in phases:
+        lines.append('    %-10s %8.3f ms per turn %5.1f%%' % (
+            phase, phaseTimes[phase] * 1000.0 / nbrOfTurns, phaseTimes[phase] * 100.0 / totalTime))
+    return '\n'.join(lines)
+
+
+def main(arguments):
+    """
+    Runs a batch of games and prints the report.
+    Arguments
+        arguments - list of command line arguments: number of games, number
+                    of turns per game and the name of the player policy
+    """
+    CONSTANTS.SHOW_AI_LOGGING = False
+    CONSTANTS.SHOW_GAME_LOGGING = False
+    CONSTANTS.SHOW_COMBAT_LOGGING = False
+    CONSTANTS.SHOW_GENERATION_LOGGING = False
+    CONSTANTS.PREFETCH_LEVELS = False
+    nbrOfGames = int(arguments[0]) if len(arguments) > 0 else 10
+    turns = int(arguments[1]) if len(arguments) > 1 else 500
+    policy = arguments[2] if len(arguments) > 2 else 'hunter'
+    print formatReport(runBatch(nbrOfGames, turns, policy))
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+
+###################
+# Simulation farm #
+###################
+
+# Plays many simulated games in parallel, the seeds are divided in shards and
+# every shard is played by one of the processes in a pool. The results of
+# every shard are written to a columnar file as soon as they arrive: a
+# sequence of row groups, every row group holds one numpy array per column.
+#
+# Run it from the root of the repository:
+#     python Launcher.py -FARM [games] [turns] [processes] [file]
+
+import marshal
+import multiprocessing
+import struct
+import time
+from collections import Counter
+
+import numpy
+
+import CONSTANTS
+from Simulation import simulateGame, XP_SAMPLE_INTERVAL
+
+COLUMNS_MAGIC = 'WSIMCOL1'
+_HEADER = struct.Struct('<I')
+
+
+class ColumnWriter(object):
+    """
+    Writes row groups of columns to a file.
+    """
+
+    def __init__(self, fileName):
+        """
+        Constructor, an existing file is overwritten.
+        Arguments
+            fileName - path of the columnar file
+        """
+        self._file = open(fileName, 'wb')
+        self._file.write(COLUMNS_MAGIC)
+
+    def write(self, columns):
+        """
+        Writes a row group.
+        Arguments
+            columns - dictionary with a numpy array per column name, all
+                      arrays have the same number of rows
+        """
+        names = sorted(columns.keys())
+        arrays = [numpy.ascontiguousarray(columns[name]) for name in names]
+        header = marshal.dumps([(name, array.dtype.str, array.shape)
+                                for name, array in zip(names, arrays)])
+        self._file.write(_HEADER.pack(len(header)))
+        self._file.write(header)
+        for array in arrays:
+            self._file.write(array.tostring())
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def readColumns(fileName):
+    """
+    Reads all row groups of a columnar file.
+    Returns
+        dictionary with a numpy array per column name
+    """
+    with open(fileName, 'rb') as columnFile:
+        data = columnFile.read()
+    if data[:len(COLUMNS_MAGIC)] != COLUMNS_MAGIC:
+        raise IOError('Not a simulation results file: ' + fileName)
+    groups = {}
+    offset = len(COLUMNS_MAGIC)
+    while offset < len(data):
+        length, = _HEADER.unpack_from(data, offset)
+        offset += _HEADER.size
+        header = marshal.loads(data[offset:offset + length])
+        offset += length
+        for name, dtype, shape in header:
+            dtype = numpy.dtype(dtype)
+            count = int(numpy.prod(shape))
+            array = numpy.frombuffer(data, dtype, count, offset).reshape(shape)
+            offset += count * dtype.itemsize
+            groups.setdefault(name, []).append(array)
+    return dict((name, numpy.concatenate(arrays)) for name, arrays in groups.items())
+
+
+def _initializeWorker():
+    CONSTANTS.SHOW_AI_LOGGING = False
+    CONSTANTS.SHOW_GAME_LOGGING = False
+    CONSTANTS.SHOW_COMBAT_LOGGING = False
+    CONSTANTS.SHOW_GENERATION_LOGGING = False
+    CONSTANTS.PREFETCH_LEVELS = False
+
+
+def simulateShard(arguments):
+    """
+    Plays the games of a shard of seeds.
+    Arguments
+        arguments - tuple (seeds, turns, policy)
+    Returns
+        dictionary with a numpy array per result column
+    """
+    seeds, turns, policy = arguments
+    results = [simulateGame(seed, turns, policy) for seed in seeds]
+    samples = turns // XP_SAMPLE_INTERVAL
+    xpCurves = numpy.zeros((len(results), samples), numpy.int32)
+    for row, result in enumerate(results):
+        curve = result.xpCurve
+        xpCurves[row, :len(curve)] = curve
+        # The xp of players that died early does not change anymore
+        xpCurves[row, len(curve):] = result.xp
+    return {'seed': numpy.array([r.seed for r in results], numpy.int64),
+            'turns': numpy.array([r.turns for r in results], numpy.int32),
+            'survived': numpy.array([r.survived for r in results], numpy.bool_),
+            'xp': numpy.array([r.xp for r in results], numpy.int32),
+            'playerLevel': numpy.array([r.playerLevel for r in results], numpy.int16),
+            'killer': numpy.array([r.killer for r in results], numpy.string_),
+            'xpCurve': xpCurves,
+            'turnTime': numpy.array([sum(r.timer.turnTimes) for r in results], numpy.float64)}
+
+
+def runFarm(nbrOfGames, turns, policy='hunter', processes=None, fileName=None,
+            firstSeed=1, shardSize=5):
+    """
+    Simulates games in a pool of processes.
+    Arguments
+        nbrOfGames - number of games, the seeds are consecutive numbers
+        turns - maximum number of turns per game
+        policy - name of the player policy, see Simulation.POLICIES
+        processes - number of processes, defaults to the number of cores
+        fileName - optional path of the columnar file for the results
+        firstSeed - seed of the first game
+        shardSize - number of games that a process plays in one go
+    Returns
+        dictionary with a numpy array per result column, ordered by seed
+    """
+    seeds = range(firstSeed, firstSeed + nbrOfGames)
+    shards = [(seeds[i:i + shardSize], turns, policy) for i in range(0, len(seeds), shardSize)]
+    writer = None
+    if fileName is not None:
+        writer = ColumnWriter(fileName)
+    groups = []
+    pool = multiprocessing.Pool(processes, _initializeWorker)
+    try:
+        for columns in pool.imap_unordered(simulateShard, shards):
+            if writer is not None:
+                writer.write(columns)
+            groups.append(columns)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if writer is not None:
+            writer.close()
+    if len(groups) == 0:
+        return {}
+    merged = dict((name, numpy.concatenate([g[name] for g in groups])) for name in groups[0])
+    order = numpy.argsort(merged['seed'])
+    return dict((name, column[order]) for name, column in merged.items())
+
+
+def formatSummary(columns, duration=None):
+    """
+    Returns a textual summary of the result columns of a farm run.
+    Arguments
+        columns - dictionary with a numpy array per result column
+        duration - optional wall clock time of the run in seconds
+    """
+    nbrOfGames = len(columns.get('seed', []))
+    if nbrOfGames == 0:
+        return 'No games played'
+    lines = []
+    lines.append('%d games, %d survivors, %d turns' % (
+        nbrOfGames, numpy.count_nonzero(columns['survived']), columns['turns'].sum()))
+    if duration:
+        lines.append('%.1f games per second, %.1f turns per second' % (
+            nbrOfGames / duration, columns['turns'].sum() / duration))
+    lines.append('survival turns mean %.1f, median %.1f' % (
+        columns['turns'].mean(), numpy.median(columns['turns'])))
+    curve = columns['xpCurve']
+    if curve.shape[1] > 0:
+        lines.append('mean xp every %d turns: %s' % (
+            XP_SAMPLE_INTERVAL, ' '.join('%.0f' % xp for xp in curve.mean(axis=0))))
+    deaths = Counter(killer for killer in columns['killer'] if killer != '')
+    for killer, count in deaths.most_common():
+        lines.append('    killed by %-20s %d' % (killer, count))
+    return '\n'.join(lines)
+
+
+def main(arguments):
+    """
+    Runs the farm and prints the summary.
+    Arguments
+        arguments - list of command line arguments: number of games, number
+                    of turns per game, number of processes and the path of
+                    the columnar result file
+    """
+    _initializeWorker()
+    nbrOfGames = int(arguments[0]) if len(arguments) > 0 else 100
+    turns = int(arguments[1]) if len(arguments) > 1 else 500
+    processes = int(arguments[2]) if len(arguments) > 2 else None
+    fileName = arguments[3] if len(arguments) > 3 else None
+    start = time.time()
+    columns = runFarm(nbrOfGames, turns, processes=processes, fileName=fileName)
+    print formatSummary(columns, time.time() - start)
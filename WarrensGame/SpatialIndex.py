@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+#################
+# Spatial index #
+#################
+
+# The tiles of a map already know which actors are on them, this index adds
+# a coarse grid of buckets on top of that. Every bucket holds the actors of a
+# square block of tiles, so a query around a position only has to look at a
+# handful of buckets instead of every tile or every actor of the level.
+
+
+class ActorIndex(object):
+    """
+    Bucket grid that keeps track of the position of actors.
+    """
+
+    @property
+    def bucketSize(self):
+        """
+        Width and height in tiles of the area covered by one bucket.
+        """
+        return self._bucketSize
+
+    def __init__(self, bucketSize=8):
+        """
+        Constructor to create an empty index.
+        Arguments
+            bucketSize - width and height in tiles of one bucket
+        """
+        self._bucketSize = bucketSize
+        # Actor lists per (bucketX, bucketY)
+        self._buckets = {}
+        # Position (x, y) per actor id
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, actor):
+        return id(actor) in self._positions
+
+    def position(self, actor):
+        """
+        Returns the (x, y) position of the actor, None if it is not indexed.
+        """
+        return self._positions.get(id(actor))
+
+    def move(self, actor, x, y):
+        """
+        Adds the actor to the index at position (x, y), or moves it there if
+        it is already indexed.
+        """
+        size = self._bucketSize
+        key = (x // size, y // size)
+        previous = self._positions.get(id(actor))
+        self._positions[id(actor)] = (x, y)
+        if previous is not None:
+            previousKey = (previous[0] // size, previous[1] // size)
+            if previousKey == key:
+                return
+            self._removeFromBucket(actor, previousKey)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = []
+        bucket.append(actor)
+
+    def remove(self, actor):
+        """
+        Removes the actor from the index, actors that are not indexed are
+        ignored.
+        """
+        position = self._positions.pop(id(actor), None)
+        if position is not None:
+            size = self._bucketSize
+            self._removeFromBucket(actor, (position[0] // size, position[1] // size))
+
+    def _removeFromBucket(self, actor, key):
+        bucket = self._buckets[key]
+        for i, candidate in enumerate(bucket):
+            if candidate is actor:
+                del bucket[i]
+                break
+        if len(bucket) == 0:
+            del self._buckets[key]
+
+    def inRect(self, x0, y0, x1, y1):
+        """
+        Returns the actors in the rectangle from (x0, y0) up to and including
+        (x1, y1).
+        """
+        size = self._bucketSize
+        positions = self._positions
+        buckets = self._buckets
+        result = []
+        for bx in range(int(x0 // size), int(x1 // size) + 1):
+            for by in range(int(y0 // size), int(y1 // size) + 1):
+                bucket = buckets.get((bx, by))
+                if bucket is None:
+                    continue
+                for actor in bucket:
+                    x, y = positions[id(actor)]
+                    if x0 <= x <= x1 and y0 <= y <= y1:
+                        result.append(actor)
+        return result
+
+    def inRadius(self, x, y, radius):
+        """
+        Returns the actors within the given euclidean distance of (x, y).
+        """
+        positions = self._positions
+        maxDistance = radius * radius
+        result = []
+        for actor in self.inRect(x - radius, y - radius, x + radius, y + radius):
+            ax, ay = positions[id(actor)]
+            if (ax - x) * (ax - x) + (ay - y) * (ay - y) <= maxDistance:
+                result.append(actor)
+        return result
@@ -2,9 +2,11 @@
 
 import random
 import math
+import threading
 import CONSTANTS
+from Messages import MessageBus, MessageCategory, ConsoleConsumer, consoleMask
 
-def rollHitDie(hitdie):
+def rollHitDie(hitdie, rng=None):
     """
     this function simulates rolling hit dies and returns the resulting
     nbr of hitpoints. Hit dies are specified in the format xdy where
@@ -12,6 +14,8 @@ def rollHitDie(hitdie):
     thrown. For example 2d6 means rolling 2 six sided dices.
     Arguments
         hitdie - a string in hitdie format
+        rng - optional random.Random to roll with, defaults to the random
+              module
     Returns
         integer number of hitpoints
     """
@@ -19,12 +23,14 @@ def rollHitDie(hitdie):
     d_index = hitdie.lower().index('d')
     nbr_of_rolls = int(hitdie[0:d_index])
     dice_size = int(hitdie[d_index + 1:])
+    if rng is None:
+        rng = random
     # roll the dice
     role_count = 0
     hitpoints = 0
     while role_count < nbr_of_rolls:
         role_count += 1
-        hitpoints += random.randrange(1, dice_size)
+        hitpoints += rng.randrange(1, dice_size)
     return hitpoints
 
 
@@ -47,49 +53,63 @@ def randomChoiceIndex(chances):
         choice += 1
 
 
-# Queue to keep track of game messages
-from collections import deque
-messageBuffer = deque([])
+# Every game has its own message bus. The game that is played on a thread
+# makes its bus the target of message() on that thread, threads without a
+# game post to a bus that only prints to the console.
+_messageTarget = threading.local()
+_consoleBus = None
+_consoleConsumer = None
 
 
-def resetMessageBuffer():
-    global messageBuffer
-    messageBuffer = deque([])
+def setMessageBus(bus):
+    """
+    Sends the messages that are posted with message() on the current thread
+    to the given bus.
+    arguments
+        bus - MessageBus, None to only print the messages on the console
+    """
+    _messageTarget.bus = bus
+
+
+def getMessageBus():
+    """
+    Returns the message bus of the current thread.
+    """
+    global _consoleBus, _consoleConsumer
+    bus = getattr(_messageTarget, 'bus', None)
+    if bus is None:
+        if _consoleBus is None:
+            _consoleBus = MessageBus()
+            _consoleConsumer = ConsoleConsumer()
+            _consoleBus.subscribe(_consoleConsumer)
+        # Follow the logging switches, they can change at any time
+        mask = consoleMask()
+        if _consoleConsumer.mask != mask:
+            _consoleConsumer.mask = mask
+        bus = _consoleBus
+    return bus
 
 
 def message(text, category=None):
     """
     Utility function to deal with in game messages.
+    Code that knows the game should post on the message bus of the game
+    instead, that avoids building the text when nobody reads it.
     arguments
         text - String representing the message
         category - String representing the category in which this message falls
     """
-    global messageBuffer
-    
     if category is None:
         # Default to console output
         print text
-    elif category.upper() == "GAME":
-        # Game output is stored (so it can be referenced by application implementation)
-        if CONSTANTS.SHOW_GAME_LOGGING is True:
-            print "GAME: " + text
-        messageBuffer.append(text)
-    elif category.upper() == "AI":
-        if CONSTANTS.SHOW_AI_LOGGING is True:
-            print "AI: " + text
-    elif category.upper() == "COMBAT":
-        if CONSTANTS.SHOW_COMBAT_LOGGING is True:
-            print "COMBAT: " + text
-        messageBuffer.append(text)
-    elif category.upper() == "GENERATION":
-        if CONSTANTS.SHOW_GENERATION_LOGGING is True:
-            print "GENERATION: " + text
-    else:
+        return
+    try:
+        messageCategory = MessageCategory.fromName(category)
+    except KeyError:
         # Default to console output
         print text
-    # Only keep the 20 latest messages in the messageBuffer
-    if len(messageBuffer) > 20:
-        messageBuffer.popleft()
+        return
+    getMessageBus().post(messageCategory, text)
 
 
 def clamp(n, minn, maxn):
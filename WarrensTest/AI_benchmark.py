@@ -0,0 +1,106 @@
+'''
+Benchmark of the per turn cost of the monster AI.
+
+A dungeon level is crowded with monsters that hunt the player. The benchmark
+reports the time the monsters need per turn and how many of them manage to
+reach the player. Monsters either look for their own path towards the player
+or share the goal map of the player position.
+
+Run it from the root of the repository:
+    python -m WarrensTest.AI_benchmark [monsters] [turns]
+'''
+import sys
+import time
+import random
+
+import WarrensGame.Game as Game
+import WarrensGame.CONSTANTS as CONSTANTS
+from WarrensGame.Actors import Character, Monster
+from WarrensGame.Utilities import distanceBetween
+
+
+def takePathTurn(monster, player):
+    """
+    Monster turn that looks for its own path towards the player.
+    """
+    distance = distanceBetween(monster, player)
+    if distance > CONSTANTS.MONSTER_RANGE_OF_SIGHT:
+        return
+    elif distance < 2:
+        monster.attack(player)
+    else:
+        monster.moveTowards(player)
+
+
+def takeGoalMapTurn(monster, player):
+    """
+    Monster turn that follows the goal map of the player position, like
+    BasicMonsterAI.takeTurn() without the logging.
+    """
+    goalMap = monster.tile.map.getGoalMap([(player.tile.x, player.tile.y)],
+                                          CONSTANTS.MONSTER_RANGE_OF_SIGHT)
+    x = monster.tile.x
+    y = monster.tile.y
+    distance = goalMap.cost(x, y)
+    if distance is None:
+        return
+    elif distance < 2:
+        monster.attack(player)
+    else:
+        step = goalMap.nextStep(x, y)
+        if step is not None:
+            monster.moveAlongVector(step[0] - x, step[1] - y)
+
+
+def runBenchmark(nbrOfMonsters, turns, useGoalMap):
+    """
+    Runs the monsters on a dungeon level for a number of turns.
+    Arguments
+        nbrOfMonsters - number of monsters added to the level
+        turns - number of turns to play
+        useGoalMap - True to share the goal map of the player position,
+                     False to find a path per monster
+    Returns
+        tuple (milliseconds per turn, number of monsters next to the player)
+    """
+    game = Game.Game()
+    game.resetGame(1)
+    level = game.levels[1]
+    player = game.player
+    player.followPortal([p for p in game.currentLevel.portals if p.destinationPortal.level is level][0])
+    # The player should survive the benchmark
+    player._baseBody = 100000
+    player.invalidateStats()
+    player.currentHitPoints = player.maxHitPoints
+    rng = random.Random(1)
+    lib = game.monsterLibrary
+    for i in range(nbrOfMonsters):
+        monster = lib.generateMonster(1, rng)
+        monster.moveToLevel(level, level.getRandomEmptyTile())
+    monsters = [c for c in level.characters if isinstance(c, Monster)]
+    start = time.time()
+    for turn in range(turns):
+        for monster in monsters:
+            if monster.state != Character.ACTIVE:
+                continue
+            if useGoalMap:
+                takeGoalMapTurn(monster, player)
+            else:
+                takePathTurn(monster, player)
+    duration = time.time() - start
+    nearby = len([m for m in monsters if distanceBetween(m, player) < 2])
+    return duration * 1000.0 / turns, nearby
+
+
+if __name__ == "__main__":
+    CONSTANTS.SHOW_AI_LOGGING = False
+    CONSTANTS.SHOW_GAME_LOGGING = False
+    CONSTANTS.SHOW_COMBAT_LOGGING = False
+    CONSTANTS.SHOW_GENERATION_LOGGING = False
+    CONSTANTS.PREFETCH_LEVELS = False
+    nbrOfMonsters = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for name, useGoalMap in [('path finding', False), ('goal map', True)]:
+        perTurn, nearby = runBenchmark(nbrOfMonsters, turns, useGoalMap)
+        print '%-14s %d monsters: %.2f ms per turn, %d monsters next to the player' % (
+            name, nbrOfMonsters, perTurn, nearby)
@@ -0,0 +1,55 @@
+'''
+Benchmark of the attack throughput.
+
+An equipped player attacks a monster over and over. Every attack reads the
+accuracy, dodge, damage and armor of both characters, the benchmark reports
+the number of attacks per second.
+
+Run it from the root of the repository:
+    python -m WarrensTest.Combat_benchmark [attacks]
+'''
+import sys
+import time
+import random
+
+import WarrensGame.Game as Game
+import WarrensGame.CONSTANTS as CONSTANTS
+
+# Equipment of the player, with a modifier where one fits
+EQUIPMENT = ['dagger', 'shield', 'cloak', 'ring']
+
+
+def runBenchmark(attacks):
+    """
+    Lets the equipped player attack a monster a number of times.
+    Arguments
+        attacks - number of attacks
+    Returns
+        number of attacks per second
+    """
+    game = Game.Game()
+    game.resetGame(1)
+    player = game.player
+    lib = game.itemLibrary
+    for key in EQUIPMENT:
+        modifiers = lib.availableModifiersForItem(key)
+        item = lib.createItem(key, modifiers[0] if len(modifiers) > 0 else None)
+        player.addItem(item)
+        player.equipItem(item)
+    monster = game.monsterLibrary.generateMonster(1, random.Random(1))
+    start = time.time()
+    for i in range(attacks):
+        # The monster should survive the benchmark
+        monster._currentHitPoints = 1000000
+        player.attack(monster)
+    return attacks / (time.time() - start)
+
+
+if __name__ == "__main__":
+    CONSTANTS.SHOW_AI_LOGGING = False
+    CONSTANTS.SHOW_GAME_LOGGING = False
+    CONSTANTS.SHOW_COMBAT_LOGGING = False
+    CONSTANTS.SHOW_GENERATION_LOGGING = False
+    CONSTANTS.PREFETCH_LEVELS = False
+    attacks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print '%d attacks: %.0f attacks per second' % (attacks, runBenchmark(attacks))
@@ -10,7 +10,13 @@ import random
 import WarrensGame.Game as Game
 import WarrensGame.CONSTANTS as CONSTANTS
 from WarrensGame.Utilities import GameError
-from WarrensGame.Actors import Character
+from WarrensGame.Actors import Character, Monster, Player, Container
+from WarrensGame.Levels import DungeonLevel
+from WarrensGame.Maps import MaterialType
+from WarrensGame.AI import AI
+from WarrensGame.Libraries import ItemModifier
+from WarrensGame.Messages import MessageBus, MessageConsumer, MessageCategory
+from WarrensGame.Scheduler import TURN_DURATION
 
 class TestGame(unittest.TestCase):
     
@@ -23,9 +29,13 @@ class TestGame(unittest.TestCase):
         CONSTANTS.SHOW_GAME_LOGGING = False
         CONSTANTS.SHOW_COMBAT_LOGGING = True
         CONSTANTS.SHOW_GENERATION_LOGGING = False
+        CONSTANTS.PREFETCH_LEVELS = False
 
         self.game = Game.Game()
         self.game.resetGame()
+        # Generate all levels to populate the libraries
+        for level in self.game.levels:
+            level.generate()
         
     @classmethod
     def tearDownClass(self):
@@ -142,5 +152,448 @@ class TestGame(unittest.TestCase):
             player.attack(aMonster)
             aMonster.attack(player)
 
+    def test_cachedStats(self):
+        player = Player()
+        lib = self.game.itemLibrary
+        ring = lib.createItem('ring')
+        player.addItem(ring)
+        accuracy = player.accuracy
+        self.assertIs(player.stats, player.stats)
+        # Equiping and unequiping changes the stats
+        player.equipItem(ring)
+        self.assertEqual(player.accuracy, accuracy + ring.accuracy)
+        player.unEquipItem(ring)
+        self.assertEqual(player.accuracy, accuracy)
+        player.levelUp()
+        self.assertEqual(player.accuracy, accuracy + CONSTANTS.GAME_PLAYER_LEVEL_ACCURACY)
+        # Modifiers change the stats and the name of an item
+        name = ring.name
+        modifierKey = lib.availableModifiersForItem('ring')[0]
+        ring.addModifier(ItemModifier(lib.modifierIndex[modifierKey]))
+        self.assertNotEqual(ring.name, name)
+        self.assertEqual(ring.accuracy, ring.baseItem.bonusAccuracy + ring.modifierBonusAccuracy)
+        # A modifier on an equipped item changes the stats of the owner
+        accuracy = player.accuracy
+        player.equipItem(ring)
+        ringAccuracy = ring.accuracy
+        self.assertEqual(player.accuracy, accuracy + ringAccuracy)
+        ring.addModifier(ItemModifier(lib.modifierIndex['protection']))
+        self.assertGreater(ring.accuracy, ringAccuracy)
+        self.assertEqual(player.accuracy, accuracy + ring.accuracy)
+        # The name follows the stack size
+        potion = lib.createItem('healingvial')
+        potion.stackSize = 3
+        self.assertIn('3', potion.name)
+
+    def test_inventoryStacks(self):
+        player = Player()
+        lib = self.game.itemLibrary
+        modifiers = lib.availableModifiersForItem('healingvial')[:2]
+        first = lib.createItem('healingvial')
+        second = lib.createItem('healingvial')
+        for key in modifiers:
+            first.addModifier(ItemModifier(lib.modifierIndex[key]))
+        # The order of the modifiers does not matter
+        for key in reversed(modifiers):
+            second.addModifier(ItemModifier(lib.modifierIndex[key]))
+        second.stackSize = 2
+        player.addItem(first)
+        player.addItem(second)
+        self.assertEqual(player.inventory.items, [first])
+        self.assertEqual(first.stackSize, 3)
+        self.assertIs(player.inventory.find(second), first)
+        # A plain vial is another stack
+        plain = lib.createItem('healingvial')
+        player.addItem(plain)
+        self.assertEqual(len(player.inventory), 2)
+        player.removeItem(first)
+        self.assertNotIn(first, player.inventory)
+        self.assertIsNone(player.inventory.find(second))
+        self.assertRaises(ValueError, player.inventory.remove, first)
+
+    def test_inventoryTransfer(self):
+        player = Player()
+        chest = Container()
+        lib = self.game.itemLibrary
+        rng = random.Random(1)
+        for item in lib.getRandomItems(5, 500, rng):
+            chest.addItem(item)
+        items = list(chest.inventory.items)
+        ring = lib.createItem('ring')
+        player.addItem(ring)
+        player.equipItem(ring)
+        # Equipped items are unequipped when they move
+        player.inventory.transferMany([ring], chest.inventory)
+        self.assertFalse(ring.isEquiped)
+        self.assertNotIn(ring, player.equipedItems)
+        self.assertIs(ring.owner, chest)
+        self.assertRaises(ValueError, player.inventory.transferMany, [ring], chest.inventory)
+        chest.inventory.transferAll(player.inventory)
+        self.assertEqual(len(chest.inventory), 0)
+        self.assertEqual(player.inventory.items, items + [ring])
+        for item in player.inventory:
+            self.assertIs(item.owner, player)
+        # Stacks merge with the stacks that are already there
+        stack = lib.createItem('healingvial')
+        player.addItem(stack)
+        potion = lib.createItem('healingvial')
+        potion.stackSize = 4
+        chest.addItem(potion)
+        stack = player.inventory.find(potion)
+        size = stack.stackSize
+        chest.inventory.transferAll(player.inventory)
+        self.assertNotIn(potion, player.inventory)
+        self.assertEqual(stack.stackSize, size + 4)
+
+class TestLevelGeneration(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+        self.game = Game.Game()
+        self.game.resetGame()
+
+    def test_lazyLevels(self):
+        town = self.game.levels[0]
+        self.assertTrue(town.isGenerated)
+        for level in self.game.levels[1:]:
+            self.assertFalse(level.isGenerated)
+        for house in town.subLevels:
+            self.assertFalse(house.isGenerated)
+        # Following a portal generates the destination level
+        portal = [p for p in town.portals if p.destinationPortal.level is self.game.levels[1]][0]
+        self.game.player.followPortal(portal)
+        dungeon = self.game.levels[1]
+        self.assertTrue(dungeon.isGenerated)
+        self.assertIs(self.game.currentLevel, dungeon)
+        self.assertIs(self.game.player.tile, portal.destinationPortal.tile)
+        # Portals to the next level are placed, but that level is not generated
+        for p in dungeon.portals:
+            self.assertIsNotNone(p.tile)
+        self.assertFalse(self.game.levels[2].isGenerated)
+
+    def test_houseInterior(self):
+        town = self.game.levels[0]
+        house = town.subLevels[0]
+        door = house.portals[0]
+        self.game.player.followPortal(door.destinationPortal)
+        self.assertTrue(house.isGenerated)
+        self.assertEqual(door.tile.material, MaterialType.DOOR)
+        self.assertEqual((door.tile.x, door.tile.y),
+                         (door.destinationPortal.tile.x, door.destinationPortal.tile.y))
+        self.assertIn(self.game.player, house.characters)
+        self.assertEqual(len(house.characters), 2)
+
+    def test_levelSeed(self):
+        dungeon = self.game.levels[1]
+        copy = DungeonLevel(self.game, dungeon.difficulty, dungeon.name, dungeon.portals[0].destinationPortal.destinationSeed)
+        self.assertTrue((dungeon.map.blockedLayer == copy.map.blockedLayer).all())
+        self.assertTrue((dungeon.map.colorLayer == copy.map.colorLayer).all())
+
+    def test_worldSeed(self):
+        other = Game.Game()
+        other.resetGame(self.game.randomStreams.seed)
+        # The same seed results in the same town and player
+        self.assertEqual(other.player.name, self.game.player.name)
+        self.assertTrue((other.levels[0].map.colorLayer == self.game.levels[0].map.colorLayer).all())
+        # Levels do not depend on the order in which they are generated
+        first = Game.Game()
+        first.resetGame(42)
+        second = Game.Game()
+        second.resetGame(42)
+        for lvl in first.levels:
+            lvl.generate()
+        for lvl in reversed(second.levels):
+            lvl.generate()
+        for mine, theirs in zip(first.levels, second.levels):
+            self.assertTrue((theirs.map.blockedLayer == mine.map.blockedLayer).all())
+            positions = [(p.tile.x, p.tile.y) for p in theirs.portals]
+            self.assertEqual(positions, [(p.tile.x, p.tile.y) for p in mine.portals])
+            self.assertEqual(self.levelActors(theirs), self.levelActors(mine))
+        # Every unique monster lives on one level
+        uniques = [m.key for m in first.monsterLibrary.uniqueMonsters]
+        self.assertEqual(sorted(uniques), ['zombie_bob', 'zombie_master'])
+
+    def levelActors(self, level):
+        actors = []
+        for column in level.map.tiles:
+            for tile in column:
+                for actor in tile.actors:
+                    if not isinstance(actor, Player):
+                        actors.append((actor.__class__.__name__, actor.name, tile.x, tile.y))
+        return actors
+
+    def test_prefetch(self):
+        CONSTANTS.PREFETCH_LEVELS = True
+        town = self.game.levels[0]
+        self.game.prefetchLevels(town)
+        self.game.prefetchLevels(town)
+        # Waiting joins every prefetch thread
+        self.game.waitForPrefetch()
+        self.assertEqual(self.game._prefetchThreads, [])
+        for portal in town.portals:
+            self.assertTrue(portal.destinationPortal.level.isGenerated)
+        self.assertFalse(self.game.levels[2].isGenerated)
+
+    def test_stopPrefetch(self):
+        CONSTANTS.PREFETCH_LEVELS = True
+        town = self.game.levels[0]
+        destinations = [p.destinationPortal.level for p in town.portals if not p.destinationPortal.level.isGenerated]
+        self.assertTrue(len(destinations) > 1)
+        # The prefetch thread waits for the lock, at most one level is generated after stopping
+        with self.game.generationLock:
+            self.game.prefetchLevels(town)
+            self.game._prefetchStop.set()
+        self.game.stopPrefetch()
+        self.assertEqual(self.game._prefetchThreads, [])
+        self.assertTrue(len([level for level in destinations if level.isGenerated]) <= 1)
+        # Prefetching works again after stopping
+        self.game.prefetchLevels(town)
+        self.game.waitForPrefetch()
+        for level in destinations:
+            self.assertTrue(level.isGenerated)
+
+class TestActorIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+        self.game = Game.Game()
+        self.game.resetGame()
+        self.dungeon = self.game.levels[1]
+        portal = [p for p in self.game.currentLevel.portals if p.destinationPortal.level is self.dungeon][0]
+        self.game.player.followPortal(portal)
+
+    def actorsOnTiles(self, tiles):
+        actors = []
+        for tile in tiles:
+            actors.extend(tile.actors)
+        return actors
+
+    def test_queries(self):
+        level = self.dungeon
+        myMap = level.map
+        x, y = self.game.player.tile.x, self.game.player.tile.y
+        tiles = [myMap.tiles[tx][ty] for tx in range(x - 12, x + 13) for ty in range(y - 12, y + 13)
+                 if 0 <= tx < myMap.width and 0 <= ty < myMap.height]
+        inRect = self.actorsOnTiles(t for t in tiles if abs(t.x - x) <= 12 and abs(t.y - y) <= 12)
+        self.assertItemsEqual(level.actorsInRect(x - 12, y - 12, x + 12, y + 12), inRect)
+        inRadius = self.actorsOnTiles(t for t in tiles if (t.x - x) ** 2 + (t.y - y) ** 2 <= 100)
+        self.assertItemsEqual(level.actorsInRadius(x, y, 10), inRadius)
+        myMap.updateFieldOfView(x, y)
+        inView = self.actorsOnTiles(myMap.visible_tiles)
+        self.assertItemsEqual(level.actorsInView(), inView)
+        self.assertItemsEqual(level.charactersInView(), [a for a in inView if isinstance(a, Character)])
+
+    def test_moveAndRemove(self):
+        level = self.dungeon
+        monster = [c for c in level.characters if isinstance(c, Monster)][0]
+        tile = level.getRandomEmptyTile()
+        monster.moveToTile(tile)
+        self.assertIn(monster, level.actorsInRect(tile.x, tile.y, tile.x, tile.y))
+        monster.removeFromLevel()
+        self.assertNotIn(monster, level.characters)
+        self.assertNotIn(monster, level.actorIndex)
+        self.assertEqual(level.actorsInRect(tile.x, tile.y, tile.x, tile.y), [])
+        # The remaining characters are still registered
+        for character in level.characters:
+            self.assertIn(character, level.actorIndex)
+        # Following a portal moves the player to the index of the other level
+        player = self.game.player
+        self.assertIn(player, level.actorIndex)
+        portal = [p for p in level.portals if p.destinationPortal.level is self.game.levels[0]][0]
+        player.followPortal(portal)
+        self.assertNotIn(player, level.actorIndex)
+        self.assertIn(player, self.game.levels[0].actorIndex)
+
+class CountingAI(AI):
+    """
+    AI that only counts its turns.
+    """
+
+    def __init__(self, character):
+        super(CountingAI, self).__init__(character)
+        self.turns = 0
+
+    def takeTurn(self):
+        self.turns += 1
+
+class TestScheduler(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+        self.game = Game.Game()
+        # Some dungeons are a single room, play on one with room to sleep in
+        seed = 1
+        while True:
+            self.game.resetGame(seed)
+            self.dungeon = self.game.levels[1]
+            floor = [t for column in self.dungeon.map.tiles for t in column if not t.blocked]
+            if len(floor) > 200:
+                break
+            seed += 1
+        portal = [p for p in self.game.currentLevel.portals if p.destinationPortal.level is self.dungeon][0]
+        self.game.player.followPortal(portal)
+        self.player = self.game.player
+        # Make sure there are enough monsters on the level
+        for i in range(3):
+            monster = self.game.monsterLibrary.generateMonster(1)
+            monster.moveToLevel(self.dungeon, self.dungeon.getRandomEmptyTile())
+        self.monsters = [c for c in self.dungeon.characters if isinstance(c, Monster)]
+        for monster in self.monsters:
+            monster.AI = CountingAI(monster)
+
+    def playTurns(self, turns):
+        for i in range(turns):
+            self.player.actionTaken = True
+            self.game.tryToPlayTurn()
+
+    def placeNearPlayer(self, monster, distance):
+        myMap = self.dungeon.map
+        x, y = self.player.tile.x, self.player.tile.y
+        for tile in sorted(myMap.getCircleTiles(x, y, distance, True, True),
+                           key=lambda t: -abs(t.x - x) - abs(t.y - y)):
+            if tile.empty:
+                monster.moveToTile(tile)
+                return
+        self.fail('No room around the player')
+
+    def placeAwayFromPlayer(self, monster):
+        myMap = self.dungeon.map
+        x, y = self.player.tile.x, self.player.tile.y
+        tiles = [tile for column in myMap.tiles for tile in column if not tile.blocked and tile.empty]
+        monster.moveToTile(max(tiles, key=lambda t: (t.x - x) ** 2 + (t.y - y) ** 2))
+        monster.inView = False
+
+    def test_sleepingMonsters(self):
+        scheduler = self.dungeon.scheduler
+        monster = self.monsters[0]
+        self.placeAwayFromPlayer(monster)
+        self.playTurns(3)
+        self.assertFalse(scheduler.isAwake(monster))
+        self.assertEqual(monster.AI.turns, 0)
+        # Coming close wakes the monster up
+        self.placeNearPlayer(monster, CONSTANTS.MONSTER_WAKE_RADIUS - 1)
+        self.playTurns(3)
+        self.assertTrue(scheduler.isAwake(monster))
+        self.assertEqual(monster.AI.turns, 3)
+        # Far away and out of view it falls asleep again
+        self.placeAwayFromPlayer(monster)
+        self.playTurns(2)
+        self.assertFalse(scheduler.isAwake(monster))
+        self.assertEqual(monster.AI.turns, 3)
+
+    def test_speed(self):
+        slow, normal, fast = self.monsters[:3]
+        for monster, distance in [(slow, 2), (normal, 2), (fast, 2)]:
+            self.placeNearPlayer(monster, distance)
+        slow.speed = CONSTANTS.NORMAL_SPEED / 2
+        fast.speed = CONSTANTS.NORMAL_SPEED * 2
+        self.playTurns(4)
+        self.assertEqual(slow.AI.turns, 2)
+        self.assertEqual(normal.AI.turns, 4)
+        self.assertEqual(fast.AI.turns, 8)
+
+    def test_removedCharacter(self):
+        monster = self.monsters[0]
+        self.placeNearPlayer(monster, 2)
+        self.playTurns(1)
+        self.assertTrue(self.dungeon.scheduler.isAwake(monster))
+        monster.removeFromLevel()
+        self.assertFalse(self.dungeon.scheduler.isAwake(monster))
+        self.playTurns(1)
+        self.assertEqual(monster.AI.turns, 1)
+
+    def test_turnWaitsForPlayer(self):
+        scheduler = self.dungeon.scheduler
+        time = scheduler.time
+        self.player.tryMoveOrAttack(0, 0)
+        self.assertTrue(self.game.tryToPlayTurn())
+        # Without a new action no turn is played
+        self.assertFalse(self.player.actionTaken)
+        self.assertFalse(self.game.tryToPlayTurn())
+        self.assertFalse(self.game.tryToPlayTurn())
+        self.assertEqual(scheduler.time, time + TURN_DURATION)
+
+class CountingText(object):
+    """
+    Message argument that counts how often it is converted to text.
+    """
+
+    def __init__(self):
+        self.conversions = 0
+
+    def __str__(self):
+        self.conversions += 1
+        return 'text'
+
+class TestMessageBus(unittest.TestCase):
+
+    def test_lazyMessages(self):
+        bus = MessageBus()
+        consumer = MessageConsumer(MessageCategory.GAME, 3)
+        bus.subscribe(consumer)
+        argument = CountingText()
+        # Nobody listens to AI messages, they are dropped
+        bus.post(MessageCategory.AI, 'AI %s', argument)
+        self.assertFalse(bus.isEnabled(MessageCategory.AI))
+        self.assertEqual(len(consumer.messages), 0)
+        # Game messages are formatted when they are read
+        bus.post(MessageCategory.GAME, 'Game %s', argument)
+        self.assertEqual(argument.conversions, 0)
+        self.assertEqual(consumer.texts, ['Game text'])
+        self.assertEqual(consumer.texts, ['Game text'])
+        self.assertEqual(argument.conversions, 1)
+
+    def test_ringBuffer(self):
+        bus = MessageBus()
+        small = MessageConsumer(MessageCategory.GAME | MessageCategory.COMBAT, 2)
+        large = MessageConsumer(MessageCategory.ALL, 10)
+        bus.subscribe(small)
+        bus.subscribe(large)
+        for i in range(5):
+            bus.post(MessageCategory.COMBAT, 'hit %s', i)
+        bus.post(MessageCategory.AI, 'thinking')
+        self.assertEqual(small.texts, ['hit 3', 'hit 4'])
+        self.assertEqual(len(large.messages), 6)
+        # Changing the mask of a consumer changes what the bus delivers
+        large.mask = MessageCategory.GAME
+        bus.unsubscribe(small)
+        self.assertFalse(bus.isEnabled(MessageCategory.COMBAT))
+
+    def test_gameMessages(self):
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+        CONSTANTS.PREFETCH_LEVELS = False
+        game = Game.Game()
+        game.resetGame()
+        self.assertEqual(len(game.messageBuffer), 1)
+        for i in range(CONSTANTS.MESSAGE_LOG_SIZE + 5):
+            game.player.takeHeal(1, game.player)
+        self.assertEqual(len(game.messageBuffer), CONSTANTS.MESSAGE_LOG_SIZE)
+        self.assertIn('gains 1 hitpoints', game.messageBuffer[-1])
+
 if __name__ == "__main__":
     TestGame.main()
\ No newline at end of file
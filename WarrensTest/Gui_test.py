@@ -92,3 +92,13 @@ class TestGui(unittest.TestCase):
             self.player.moveToTile(item.tile)
             self.player.tryPickUp()
             self.drawFrame()
+
+    def test_persistentBuffers(self):
+        self.drawFrame()
+        buffers = self.mainWindow.dynamicBuffers
+        vertexBuffer = buffers.vertices.id
+        for i in range(0, 10):
+            self.drawFrame()
+        # The same buffers are reused every frame
+        self.assertEqual(self.mainWindow.dynamicBuffers.vertices.id, vertexBuffer)
+        self.assertGreaterEqual(buffers.vertices.capacity, buffers.vertices.size)
@@ -1,13 +1,28 @@
 __author__ = 'Frostlock'
 
 import unittest
+import os
+import shutil
+import tempfile
 
 import random
 
+import WarrensGame.CONSTANTS as CONSTANTS
 from WarrensGame.Actors import Monster, Consumable, Equipment
 from WarrensGame.Libraries import MonsterLibrary, ItemLibrary
+from WarrensGame.DataTables import compileDataTables, compileTable, MONSTER_COLUMNS
+from WarrensGame.AliasTable import AliasTable
 from WarrensGame.Utilities import GameError
 
+class LevelStub(object):
+    """
+    Level that only has a name and a difficulty.
+    """
+
+    def __init__(self, name, difficulty):
+        self.name = name
+        self.difficulty = difficulty
+
 class TestMonsterLibrary(unittest.TestCase):
 
     @classmethod
@@ -84,6 +99,29 @@ class TestMonsterLibrary(unittest.TestCase):
             self.mlib.getRandomMonster(0)
         #print 'Asking for a monster with challenge rating 0 raises correct GameError.'
 
+    def test_uniqueMonsters(self):
+        rng = random.Random(5)
+        bob = self.mlib.monsterIndex['zombie_bob']
+        # Unique monsters are never picked at random
+        monsters = self.mlib.getRandomMonsters(1, 200, rng)
+        self.assertEqual(len(monsters), 200)
+        self.assertNotIn(bob, self.mlib.challengeIndex[1])
+        self.assertEqual([m for m in monsters if m.baseMonster.unique], [])
+        # Every unique monster lives on a level that matches its challenge rating
+        levels = [LevelStub('Level ' + str(difficulty), difficulty) for difficulty in range(1, 10)]
+        self.mlib.assignUniqueMonsters(levels, rng)
+        self.assertEqual([m.key for m in self.mlib.createUniqueMonsters('Level 1', rng)], ['zombie_bob'])
+        self.assertEqual(self.mlib.createUniqueMonsters('Level 1', rng), [])
+        masters = []
+        for level in levels[4:]:
+            masters.extend(self.mlib.createUniqueMonsters(level.name, rng))
+        self.assertEqual([m.key for m in masters], ['zombie_master'])
+        # Reserved unique monsters are not created
+        other = MonsterLibrary()
+        other.assignUniqueMonsters(levels, rng)
+        other.reserveUniqueMonster('zombie_bob')
+        self.assertEqual(other.createUniqueMonsters('Level 1', rng), [])
+
     def test_generatedMonster(self):
         for difficulty in range(1, 10):
             monster = self.mlib.generateMonster(difficulty)
@@ -179,6 +217,18 @@ class TestItemLibrary(unittest.TestCase):
         with self.assertRaises(GameError):
             self.ilib.getRandomItem(0)
 
+    def test_randomItemsKeepTheIndex(self):
+        sizes = dict((level, len(items)) for level, items in self.ilib.itemLevelIndex.items())
+        modifierSizes = dict((level, len(mods)) for level, mods in self.ilib.modifierLevelIndex.items())
+        items = self.ilib.getRandomItems(5, 50, random.Random(3))
+        self.assertEqual(len(items), 50)
+        for i in range(10):
+            self.ilib.getRandomItem(5)
+        # Picking items does not change the level indexes
+        self.assertEqual(dict((level, len(items)) for level, items in self.ilib.itemLevelIndex.items()), sizes)
+        self.assertEqual(dict((level, len(mods)) for level, mods in self.ilib.modifierLevelIndex.items()),
+                         modifierSizes)
+
     def test_modifiedItem(self):
         """
         Test if we can create modified items
@@ -195,5 +245,81 @@ class TestItemLibrary(unittest.TestCase):
         with self.assertRaises(GameError):
             self.ilib.createItem("firenova","soldier")
 
+class TestAliasTable(unittest.TestCase):
+
+    def test_weights(self):
+        table = AliasTable(['a', 'b', 'c'], [1, 2, 7])
+        picks = table.sample(20000, random.Random(1))
+        self.assertAlmostEqual(picks.count('a') / 20000.0, 0.1, delta=0.01)
+        self.assertAlmostEqual(picks.count('b') / 20000.0, 0.2, delta=0.01)
+        self.assertAlmostEqual(picks.count('c') / 20000.0, 0.7, delta=0.01)
+        # A single pick uses the same columns as a sample
+        self.assertEqual(table.pick(random.Random(1)), table.sample(1, random.Random(1))[0])
+
+    def test_invalidTables(self):
+        self.assertEqual(AliasTable([]).sample(0, random), [])
+        with self.assertRaises(GameError):
+            AliasTable([]).pick(random)
+        with self.assertRaises(GameError):
+            AliasTable(['a'], [0])
+        with self.assertRaises(GameError):
+            AliasTable(['a', 'b'], [1])
+
+class TestDataTables(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fileNames = []
+        for fileName in [CONSTANTS.DATA_MONSTERS, CONSTANTS.DATA_ITEMS, CONSTANTS.DATA_ITEM_MODIFIERS]:
+            copy = os.path.join(self.directory, os.path.basename(fileName))
+            shutil.copy(fileName, copy)
+            self.fileNames.append(copy)
+        self.cacheFile = os.path.join(self.directory, 'tables.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_typedTemplates(self):
+        tables = compileDataTables(*self.fileNames)
+        rat = tables.monsterIndex['rat']
+        self.assertEqual(rat.xp, 50)
+        self.assertIs(rat.unique, False)
+        self.assertEqual(rat.color, (240, 240, 240))
+        self.assertEqual(tables.itemIndex['firenova'].effectElement, CONSTANTS.FIRE)
+        self.assertIsNone(tables.itemIndex['dagger'].targeted)
+        # Templates can not be changed
+        with self.assertRaises(GameError):
+            rat.xp = 0
+        with self.assertRaises(GameError):
+            rat['xp'] = 0
+
+    def test_cache(self):
+        compiled = compileDataTables(*self.fileNames, cacheFile=self.cacheFile)
+        self.assertTrue(os.path.exists(self.cacheFile))
+        cached = compileDataTables(*self.fileNames, cacheFile=self.cacheFile)
+        self.assertEqual(cached.monsterIndex, compiled.monsterIndex)
+        self.assertEqual(cached.modifierLevelIndex, compiled.modifierLevelIndex)
+        # Changing a data file compiles the tables again
+        with open(self.fileNames[0], 'a') as dataFile:
+            dataFile.write('\nbat,b,bat,1d2,10,False,1,10,10,10,10,10,10,"[1,2,3]",,,BasicMonsterAI')
+        changed = compileDataTables(*self.fileNames, cacheFile=self.cacheFile)
+        self.assertIn('bat', changed.monsterIndex)
+
+    def test_invalidData(self):
+        with open(self.fileNames[0], 'a') as dataFile:
+            dataFile.write('\nbat,b,bat,1d2,ten,False,1,10,10,10,10,10,10,"[1,2,3]",,,BasicMonsterAI')
+        with self.assertRaises(GameError) as context:
+            compileTable(self.fileNames[0], MONSTER_COLUMNS)
+        self.assertIn('column xp', str(context.exception))
+
+    def test_sharedTemplates(self):
+        first = ItemLibrary()
+        second = ItemLibrary()
+        self.assertIs(first.itemIndex['dagger'], second.itemIndex['dagger'])
+        # Creating a unique monster does not change the index
+        library = MonsterLibrary()
+        library.createMonster('zombie_master')
+        self.assertEqual(library.challengeIndex, MonsterLibrary().challengeIndex)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,342 @@
+__author__ = 'Frostlock'
+
+import unittest
+import random
+
+import WarrensGame.CONSTANTS as CONSTANTS
+from WarrensGame.Utilities import GameError
+from WarrensGame.Maps import SingleRoomMap, DungeonMap, CaveMap, Room, MaterialType, FreeTileSet
+from WarrensGame.FieldOfView import FieldOfViewMode, computeFieldOfView
+from WarrensGame.PathFinding import findPath, computeGoalMap
+from WarrensGame.Circles import discOffsets, ringOffsets
+
+
+class TestFieldOfView(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def createRoomMap(self, width=30, height=30):
+        """
+        Creates a map with one big room, the outer tiles are walls.
+        """
+        room = Room(None, 0, 0, width - 1, height - 1)
+        return SingleRoomMap(width, height, None, room)
+
+    def test_openRoom(self):
+        # Without obstacles both algorithms should agree
+        myMap = self.createRoomMap()
+        x, y = 15, 15
+        reference = computeFieldOfView(myMap.solidTileMatrix, x, y, myMap.rangeOfView, FieldOfViewMode.BRESENHAM)
+        shadowcast = computeFieldOfView(myMap.solidTileMatrix, x, y, myMap.rangeOfView, FieldOfViewMode.SHADOWCASTING)
+        self.assertEqual(reference, shadowcast)
+
+    def test_rangeOfView(self):
+        myMap = self.createRoomMap(60, 60)
+        x, y = 30, 30
+        visible = myMap.getFieldOfView(x, y)
+        for tx, ty in visible:
+            self.assertLessEqual((tx - x) ** 2 + (ty - y) ** 2, myMap.rangeOfView ** 2)
+        self.assertIn((x + myMap.rangeOfView, y), visible)
+        self.assertNotIn((x + myMap.rangeOfView + 1, y), visible)
+
+    def test_wallBlocksView(self):
+        myMap = self.createRoomMap()
+        wall = myMap.tiles[17][15]
+        wall.blocked = True
+        wall.blockSight = True
+        myMap.refreshBlockedTileMatrix()
+        for mode in [FieldOfViewMode.BRESENHAM, FieldOfViewMode.SHADOWCASTING]:
+            myMap.fieldOfViewMode = mode
+            myMap.updateFieldOfView(15, 15)
+            # The wall itself is visible, the tile behind it is not
+            self.assertTrue(wall.inView)
+            self.assertFalse(myMap.tiles[18][15].inView)
+            self.assertTrue(myMap.tiles[16][15].explored)
+
+    def test_symmetry(self):
+        random.seed(7)
+        for myMap in [DungeonMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT),
+                      CaveMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT)]:
+            for i in range(10):
+                origin = myMap.getRandomEmptyTile()
+                for tx, ty in myMap.getFieldOfView(origin.x, origin.y):
+                    if not myMap.tiles[tx][ty].blockSight:
+                        # If we can see a floor tile, it should be able to see us
+                        self.assertIn((origin.x, origin.y), myMap.getFieldOfView(tx, ty))
+
+    def test_incrementalUpdate(self):
+        random.seed(11)
+        myMap = DungeonMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT)
+        # The first update resets every tile
+        tile = myMap.getRandomEmptyTile()
+        myMap.updateFieldOfView(tile.x, tile.y)
+        self.assertEqual(len(myMap.newlyVisibleTiles) + len(myMap.newlyHiddenTiles), myMap.width * myMap.height)
+        for i in range(20):
+            previous = set(myMap.visiblePositions)
+            tile = myMap.getRandomEmptyTile()
+            myMap.updateFieldOfView(tile.x, tile.y)
+            visible = myMap.getFieldOfView(tile.x, tile.y)
+            # The delta matches the difference between both turns
+            self.assertEqual(set((t.x, t.y) for t in myMap.newlyVisibleTiles), visible - previous)
+            self.assertEqual(set((t.x, t.y) for t in myMap.newlyHiddenTiles), previous - visible)
+            # Tiles are in view exactly when they are in the field of view
+            for x, y in myMap.each_map_position:
+                self.assertEqual(myMap.tiles[x][y].inView, (x, y) in visible)
+            self.assertEqual(set(myMap.visible_tiles), set(myMap.tiles[x][y] for x, y in visible))
+        # Nothing changes when the position stays the same
+        myMap.updateFieldOfView(tile.x, tile.y)
+        self.assertEqual(myMap.newlyVisibleTiles, [])
+        self.assertEqual(myMap.newlyHiddenTiles, [])
+
+    def test_trackChanges(self):
+        myMap = self.createRoomMap()
+        changes = myMap.trackChanges()
+        myMap.updateFieldOfView(5, 5)
+        # Tiles that come into view for the first time are explored
+        visible = set(myMap.visiblePositions)
+        self.assertEqual(changes.take(), visible)
+        myMap.updateFieldOfView(6, 5)
+        self.assertEqual(changes.take(), set(myMap.visiblePositions) - visible)
+        myMap.updateFieldOfView(5, 5)
+        self.assertEqual(len(changes), 0)
+        # Changes of the tile data are reported
+        myMap.tiles[20][20].color = (1, 2, 3)
+        myMap.fill(1, 1, 3, 2, True, True, (4, 5, 6), MaterialType.STONE)
+        self.assertEqual(changes.take(), set([(20, 20), (1, 1), (2, 1)]))
+
+class TestMapLayers(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def test_tileView(self):
+        myMap = SingleRoomMap(10, 8, None, Room(None, 2, 2, 4, 3))
+        tile = myMap.tiles[3][4]
+        self.assertFalse(tile.blocked)
+        self.assertEqual(tile.color, CONSTANTS.DUNGEON_COLOR_FLOOR)
+        self.assertEqual(tile.material, MaterialType.DIRT)
+        # Writing to the tile writes to the map layers
+        tile.blocked = True
+        tile.explored = True
+        tile.color = (1, 2, 3)
+        tile.material = MaterialType.WATER
+        self.assertTrue(myMap.blockedLayer[3, 4])
+        self.assertEqual(myMap.exploredTileCount, 1)
+        self.assertEqual(myMap.explored_tiles, [tile])
+        self.assertEqual(tuple(myMap.colorLayer[3, 4]), (1, 2, 3))
+        self.assertEqual(myMap.materialLayer[3, 4], MaterialType.WATER)
+        # And a new view on the same position sees the same data
+        self.assertEqual(myMap.tiles[3][4].color, (1, 2, 3))
+        # Removing an actor that is not there fails, also on a tile that never held one
+        self.assertRaises(ValueError, myMap.tiles[5][5].removeActor, object())
+
+    def test_circleTiles(self):
+        myMap = SingleRoomMap(20, 20, None, Room(None, 0, 0, 19, 19))
+        disc = myMap.getCircleTiles(10, 10, 3, True)
+        positions = [(t.x, t.y) for t in disc]
+        # Center first, no duplicates, within half a tile of the radius
+        self.assertEqual(positions[0], (10, 10))
+        self.assertEqual(len(set(positions)), len(positions))
+        self.assertEqual(len(positions), len(discOffsets(3)[0]))
+        for x, y in positions:
+            self.assertLessEqual((x - 10) ** 2 + (y - 10) ** 2, 12)
+        # The ring is the border of the disc
+        ring = myMap.getCircleTiles(10, 10, 3)
+        inner = set((t.x, t.y) for t in myMap.getCircleTiles(10, 10, 2, True))
+        self.assertEqual(set((t.x, t.y) for t in ring), set(positions) - inner)
+        self.assertIs(ringOffsets(3), ringOffsets(3))
+        # Clipped to the map and without the blocked walls
+        corner = myMap.getCircleTiles(1, 1, 3, True, True)
+        for tile in corner:
+            self.assertFalse(tile.blocked)
+        onMap = [(x, y) for x in range(-2, 5) for y in range(-2, 5)
+                 if x >= 0 and y >= 0 and (x - 1) ** 2 + (y - 1) ** 2 <= 12]
+        self.assertEqual(len(myMap.getCircleTiles(1, 1, 3, True)), len(onMap))
+
+    def test_circleLineOfSight(self):
+        myMap = SingleRoomMap(20, 20, None, Room(None, 0, 0, 19, 19))
+        # A wall right next to the center hides the tiles behind it
+        myMap.fill(11, 5, 12, 15, True, True, (0, 0, 0), MaterialType.STONE)
+        myMap.refreshBlockedTileMatrix()
+        seen = set((t.x, t.y) for t in myMap.getCircleTiles(10, 10, 4, True, True, True))
+        everything = set((t.x, t.y) for t in myMap.getCircleTiles(10, 10, 4, True, True))
+        self.assertIn((9, 10), seen)
+        self.assertNotIn((13, 10), seen)
+        self.assertIn((13, 10), everything)
+        self.assertTrue(seen < everything)
+
+    def test_str(self):
+        myMap = SingleRoomMap(6, 5, None, Room(None, 0, 0, 5, 4))
+        self.assertEqual(str(myMap), 'xxxxxx\n' + 'x    x\n' * 3 + 'xxxxxx\n')
+
+    def test_fill(self):
+        myMap = SingleRoomMap(12, 10, None, Room(None, 0, 0, 11, 9))
+        myMap.fillCircle(1, 1, 2, False, False, (1, 2, 3), MaterialType.WATER)
+        # The circle is clipped to the map
+        self.assertEqual(myMap.tiles[0][0].material, MaterialType.WATER)
+        self.assertEqual(myMap.tiles[3][1].color, (1, 2, 3))
+        self.assertEqual(myMap.tiles[3][3].material, MaterialType.DIRT)
+        myMap.fillPositions([(5, 5), (6, 7)], True, True, (4, 5, 6), MaterialType.STONE)
+        self.assertTrue(myMap.tiles[6][7].blocked)
+        self.assertFalse(myMap.tiles[6][6].blocked)
+        myMap.fillBorder(True, True, (7, 8, 9), MaterialType.STONE)
+        for x, y in myMap.each_map_position:
+            border = x in (0, myMap.width - 1) or y in (0, myMap.height - 1)
+            self.assertEqual(myMap.tiles[x][y].color == (7, 8, 9), border)
+
+    def test_generatedMapsKeepTheirTiles(self):
+        random.seed(3)
+        myMap = CaveMap(CONSTANTS.MAP_WIDTH, CONSTANTS.MAP_HEIGHT)
+        # Tiles are created once and stay views on the generated layers
+        tile = myMap.getRandomEmptyTile()
+        self.assertIs(myMap.tiles[tile.x][tile.y], tile)
+        self.assertFalse(myMap.blockedLayer[tile.x, tile.y])
+        self.assertTrue(myMap.blockedLayer[0, :].all())
+        self.assertTrue(myMap.blockedLayer[:, -1].all())
+
+    def test_freeTileSet(self):
+        freeTiles = FreeTileSet()
+        for position in [(1, 1), (2, 1), (3, 1), (2, 1)]:
+            freeTiles.add(position)
+        self.assertEqual(len(freeTiles), 3)
+        freeTiles.discard((1, 1))
+        freeTiles.discard((5, 5))
+        self.assertEqual(sorted(freeTiles), [(2, 1), (3, 1)])
+        self.assertNotIn((1, 1), freeTiles)
+        rng = random.Random(1)
+        for i in range(10):
+            self.assertIn(freeTiles.sample(rng), freeTiles)
+
+    def test_freeTiles(self):
+        myMap = SingleRoomMap(6, 5, None, Room(None, 0, 0, 5, 4))
+        freeTiles = myMap.getFreeTiles()
+        self.assertEqual(len(freeTiles), 12)
+        # Actors and walls take tiles out of the set, leaving gives them back
+        actor = object()
+        myMap.tiles[2][2].addActor(actor)
+        myMap.tiles[3][2].blocked = True
+        self.assertEqual(len(freeTiles), 10)
+        self.assertNotIn((2, 2), freeTiles)
+        myMap.tiles[2][2].removeActor(actor)
+        self.assertIn((2, 2), freeTiles)
+        # Sets of areas are kept up to date as well
+        area = Room(myMap, 1, 1, 1, 1)
+        self.assertEqual(len(myMap.getFreeTiles(area)), 4)
+        myMap.tiles[1][1].addActor(actor)
+        self.assertEqual(len(myMap.getFreeTiles(area)), 3)
+        tile = area.getRandomEmptyTile()
+        self.assertTrue(tile.empty)
+        self.assertFalse(tile.blocked)
+
+    def test_noFreeTile(self):
+        myMap = SingleRoomMap(4, 4, None, Room(None, 0, 0, 3, 3))
+        for x, y in [(1, 1), (1, 2), (2, 1), (2, 2)]:
+            myMap.tiles[x][y].addActor(object())
+        self.assertRaises(GameError, myMap.getRandomEmptyTile)
+        self.assertRaises(GameError, Room(myMap, 1, 1, 1, 1).getRandomEmptyTile)
+
+class TestPathFinding(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def createWallMap(self):
+        """
+        Creates a room with a wall in the middle, the wall has an opening at
+        the bottom.
+        """
+        myMap = SingleRoomMap(20, 12, None, Room(None, 0, 0, 19, 11))
+        myMap.fill(10, 0, 11, 9, True, True, (0, 0, 0), MaterialType.STONE)
+        myMap.refreshBlockedTileMatrix()
+        return myMap
+
+    def test_openRoom(self):
+        myMap = SingleRoomMap(20, 12, None, Room(None, 0, 0, 19, 11))
+        path = findPath(myMap.blockedTileMatrix, (2, 2), (8, 5))
+        # Diagonal steps are used, the path is as short as the longest axis
+        self.assertEqual(len(path), 6)
+        self.assertEqual(path[-1], (8, 5))
+        self.assertEqual(findPath(myMap.blockedTileMatrix, (2, 2), (2, 2)), [])
+
+    def test_aroundWall(self):
+        myMap = self.createWallMap()
+        path = findPath(myMap.blockedTileMatrix, (5, 3), (15, 3))
+        self.assertEqual(path[-1], (15, 3))
+        previous = (5, 3)
+        for x, y in path:
+            self.assertFalse(myMap.tiles[x][y].blocked)
+            self.assertLessEqual(max(abs(x - previous[0]), abs(y - previous[1])), 1)
+            previous = (x, y)
+        # The search gives up when the path would be too long
+        self.assertIsNone(findPath(myMap.blockedTileMatrix, (5, 3), (15, 3), 10))
+
+    def test_unreachable(self):
+        myMap = self.createWallMap()
+        myMap.tiles[10][9].blocked = True
+        myMap.tiles[10][10].blocked = True
+        self.assertIsNone(findPath(myMap.blockedTileMatrix, (5, 3), (15, 3)))
+
+    def test_pathCache(self):
+        myMap = self.createWallMap()
+        key = 'monster'
+        path = myMap.getPath(key, (5, 3), (15, 3))
+        self.assertIs(myMap.getPath(key, (5, 3), (15, 3)), path)
+        # Taking a step along the path reuses the rest of the path
+        self.assertEqual(myMap.getPath(key, path[0], (15, 3)), path[1:])
+        # Blocking a tile on the path invalidates it
+        x, y = path[3]
+        myMap.tiles[x][y].blocked = True
+        newPath = myMap.getPath(key, path[0], (15, 3))
+        self.assertNotIn((x, y), newPath)
+
+    def test_goalMap(self):
+        myMap = self.createWallMap()
+        goalMap = computeGoalMap(myMap.blockedTileMatrix, [(15, 3)])
+        self.assertEqual(goalMap.cost(15, 3), 0)
+        self.assertIsNone(goalMap.cost(10, 3))
+        # Following the next steps leads around the wall to the goal
+        position = (5, 3)
+        steps = 0
+        while position != (15, 3):
+            position = goalMap.nextStep(*position)
+            steps += 1
+        self.assertEqual(steps, len(findPath(myMap.blockedTileMatrix, (5, 3), (15, 3))))
+        self.assertIsNone(goalMap.nextStep(15, 3))
+
+    def test_goalMapRange(self):
+        myMap = self.createWallMap()
+        goalMap = myMap.getGoalMap([(15, 3)], 4)
+        self.assertIs(myMap.getGoalMap([(15, 3)], 4), goalMap)
+        for cost in goalMap.costs.values():
+            self.assertLessEqual(cost, 4)
+        self.assertIsNone(goalMap.cost(5, 3))
+        # Changing a tile invalidates the goal maps
+        myMap.tiles[14][3].blocked = True
+        self.assertIsNot(myMap.getGoalMap([(15, 3)], 4), goalMap)
+
+    def test_fleeMap(self):
+        myMap = SingleRoomMap(20, 12, None, Room(None, 0, 0, 19, 11))
+        goalMap = computeGoalMap(myMap.blockedTileMatrix, [(5, 5)])
+        fleeMap = goalMap.inverted()
+        self.assertIs(goalMap.inverted(), fleeMap)
+        x, y = 7, 6
+        for i in range(5):
+            step = fleeMap.nextStep(x, y)
+            self.assertGreater(goalMap.cost(*step), goalMap.cost(x, y))
+            x, y = step
+
+if __name__ == "__main__":
+    unittest.main()
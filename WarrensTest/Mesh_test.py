@@ -0,0 +1,139 @@
+__author__ = 'Frostlock'
+
+import unittest
+
+import numpy
+
+import WarrensGame.Game as Game
+import WarrensGame.CONSTANTS as CONSTANTS
+from WarrensGUI.Util.SceneObject import SceneObject, Cube, assembleMeshes, splitInstances, CUBE, PYRAMID
+from WarrensGUI.Util.ChunkedMesh import ChunkedMesh
+
+
+class TestMeshAssembly(unittest.TestCase):
+
+    def test_assembleMeshes(self):
+        first = Cube()
+        second = Cube(size=2.0)
+        vertexData, colorOffset, normalsOffset, elementData = assembleMeshes([first, second])
+        self.assertEqual(vertexData.dtype, numpy.float32)
+        self.assertEqual(elementData.dtype, numpy.uint32)
+        # Same layout as extending the python lists one object after the other
+        expected = first.vertices + second.vertices
+        self.assertEqual(colorOffset, len(expected))
+        expected += first.colors + second.colors
+        self.assertEqual(normalsOffset, len(expected))
+        expected += first.normals + second.normals
+        numpy.testing.assert_allclose(vertexData, expected, rtol=1e-6)
+        offset = first.vertexCount
+        expectedElements = first.triangleIndices + [i + offset for i in second.triangleIndices]
+        self.assertEqual(elementData.tolist(), expectedElements)
+
+    def test_arrayCache(self):
+        cube = Cube()
+        array = cube.vertexArray
+        self.assertIs(cube.vertexArray, array)
+        # Rebuilding the mesh converts it again
+        cube._vertices = list(cube.vertices)
+        self.assertIsNot(cube.vertexArray, array)
+
+    def test_empty(self):
+        vertexData, colorOffset, normalsOffset, elementData = assembleMeshes([])
+        self.assertEqual(len(vertexData), 0)
+        self.assertEqual(len(elementData), 0)
+        vertexData, colorOffset, normalsOffset, elementData = assembleMeshes([SceneObject()])
+        self.assertEqual(len(vertexData), 0)
+
+    def test_splitInstances(self):
+        cube = Cube()
+        instance = InstanceObject(CUBE, (1.0, 2.0, 0.5, 3.0), (0.1, 0.2, 0.3, 1.0))
+        meshObjects, instances = splitInstances([cube, instance, instance])
+        self.assertEqual(meshObjects, [cube])
+        self.assertEqual(instances[CUBE.name].shape, (2, 8))
+        self.assertEqual(instances[CUBE.name].dtype, numpy.float32)
+        numpy.testing.assert_allclose(instances[CUBE.name][0], [1.0, 2.0, 0.5, 3.0, 0.1, 0.2, 0.3, 1.0], rtol=1e-6)
+        # Shapes without instances get an empty array
+        self.assertEqual(instances[PYRAMID.name].shape, (0, 8))
+
+class InstanceObject(SceneObject):
+    """
+    Scene object that is drawn as an instance of a shape.
+    """
+
+    def __init__(self, shape, transform, color):
+        super(InstanceObject, self).__init__()
+        self._instance = (shape, transform, color)
+
+    @property
+    def instance(self):
+        return self._instance
+
+class FakeTileObject(SceneObject):
+    """
+    Scene object of a tile that counts how often its mesh is refreshed.
+    """
+
+    def __init__(self, tile):
+        super(FakeTileObject, self).__init__()
+        self.tile = tile
+        self.chunk = None
+        self.refreshes = 0
+        tile.sceneObject = self
+
+    def refreshMesh(self):
+        self.refreshes += 1
+
+class TestChunkedMesh(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+        game = Game.Game()
+        game.resetGame(1)
+        self.map = game.levels[1].map
+        self.objects = [FakeTileObject(tile) for column in self.map.tiles for tile in column]
+        self.mesh = ChunkedMesh(16)
+        self.mesh.assign(self.objects + [Cube()], self.map)
+
+    def test_assign(self):
+        width, height = self.map.width, self.map.height
+        chunks = ((width + 15) // 16) * ((height + 15) // 16) + 1
+        self.assertEqual(len(self.mesh.chunks), chunks)
+        self.assertEqual(len(self.mesh.dirtyChunks), chunks)
+        self.assertEqual(sum(len(c.sceneObjects) for c in self.mesh.chunks), width * height + 1)
+        self.assertIs(self.mesh.chunkAt(17, 3), self.map.tiles[17][3].sceneObject.chunk)
+        self.assertEqual(self.mesh.chunkAt(17, 3).key, (1, 0))
+
+    def test_detectChanges(self):
+        for chunk in self.mesh.chunks:
+            chunk.dirty = False
+        self.assertEqual(self.mesh.detectChanges(), 0)
+        # Changing one tile only dirties its chunk
+        tile = self.map.tiles[20][20]
+        tile.explored = not tile.explored
+        self.assertEqual(self.mesh.detectChanges(), 1)
+        self.assertEqual(self.mesh.dirtyChunks, [tile.sceneObject.chunk])
+        self.assertEqual(tile.sceneObject.refreshes, 1)
+        # The change is only reported once
+        self.assertEqual(self.mesh.detectChanges(), 0)
+        # Exploring tiles with the field of view dirties their chunks
+        for chunk in self.mesh.chunks:
+            chunk.dirty = False
+        free = self.map.getRandomEmptyTile()
+        free.explored = False
+        self.mesh.detectChanges()
+        unexplored = self.map.exploredLayer.copy() == False
+        self.map.updateFieldOfView(free.x, free.y)
+        explored = [(x, y) for x, y in self.map.visiblePositions if unexplored[x, y]]
+        self.assertEqual(self.mesh.detectChanges(), len(explored))
+        self.assertIn(free.sceneObject.chunk, self.mesh.dirtyChunks)
+
+if __name__ == "__main__":
+    unittest.main()
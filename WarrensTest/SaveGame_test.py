@@ -0,0 +1,194 @@
+__author__ = 'Frostlock'
+
+import unittest
+import mmap
+import os
+import random
+import tempfile
+
+import WarrensGame.Game as Game
+import WarrensGame.CONSTANTS as CONSTANTS
+from WarrensGame.Utilities import GameError
+from WarrensGame.Actors import Monster
+from WarrensGame.Journal import getJournalFileName
+
+
+class TestSaveGame(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+        self.game = Game.Game()
+        self.game.resetGame()
+        handle, self.fileName = tempfile.mkstemp('.warrens')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.fileName)
+
+    def loadGame(self):
+        game = Game.Game()
+        game.loadGame(self.fileName)
+        return game
+
+    def followPortalTo(self, level):
+        portal = [p for p in self.game.currentLevel.portals if p.destinationPortal.level is level][0]
+        self.game.player.followPortal(portal)
+
+    def test_roundTrip(self):
+        player = self.game.player
+        player.currentHitPoints = 5
+        player.gainXp(10)
+        self.game.saveGame(self.fileName)
+        loaded = self.loadGame()
+        self.assertEqual(loaded.randomStreams.seed, self.game.randomStreams.seed)
+        self.assertEqual(loaded.player.name, player.name)
+        self.assertEqual(loaded.player.currentHitPoints, 5)
+        self.assertEqual(loaded.player.xp, player.xp)
+        self.assertEqual((loaded.player.tile.x, loaded.player.tile.y), (player.tile.x, player.tile.y))
+        self.assertEqual([i.name for i in loaded.player.inventory.items],
+                         [i.name for i in player.inventory.items])
+        town, loadedTown = self.game.levels[0], loaded.levels[0]
+        self.assertIs(loaded.currentLevel, loadedTown)
+        self.assertTrue((loadedTown.map.blockedLayer == town.map.blockedLayer).all())
+        self.assertTrue((loadedTown.map.colorLayer == town.map.colorLayer).all())
+        self.assertTrue((loadedTown.map.exploredLayer == town.map.exploredLayer).all())
+        self.assertEqual(len(loadedTown.portals), len(town.portals))
+        for portal, loadedPortal in zip(town.portals, loadedTown.portals):
+            self.assertEqual(loadedPortal.name, portal.name)
+            self.assertEqual((loadedPortal.tile.x, loadedPortal.tile.y), (portal.tile.x, portal.tile.y))
+
+    def test_unvisitedLevels(self):
+        self.game.saveGame(self.fileName)
+        loaded = self.loadGame()
+        dungeon = loaded.levels[1]
+        self.assertFalse(dungeon.isGenerated)
+        # Unvisited levels are generated from their seed when visited
+        self.assertTrue((dungeon.map.blockedLayer == self.game.levels[1].map.blockedLayer).all())
+
+    def test_visitedLevels(self):
+        dungeon = self.game.levels[1]
+        self.followPortalTo(dungeon)
+        monsters = sorted((c.tile.x, c.tile.y, c.name) for c in dungeon.characters if isinstance(c, Monster))
+        self.followPortalTo(self.game.levels[0])
+        self.game.saveGame(self.fileName)
+        loaded = self.loadGame()
+        loadedDungeon = loaded.levels[1]
+        # The level stays in the file until it is needed
+        self.assertFalse(loadedDungeon.isGenerated)
+        self.assertIsNotNone(loadedDungeon.savedLevel)
+        self.assertTrue((loadedDungeon.map.blockedLayer == dungeon.map.blockedLayer).all())
+        self.assertIsNone(loadedDungeon.savedLevel)
+        loadedMonsters = sorted((c.tile.x, c.tile.y, c.name) for c in loadedDungeon.characters)
+        self.assertEqual(loadedMonsters, monsters)
+
+    def test_saveLoadedGame(self):
+        self.followPortalTo(self.game.levels[1])
+        self.followPortalTo(self.game.levels[0])
+        self.game.saveGame(self.fileName)
+        loaded = self.loadGame()
+        # Levels that are not restored yet are copied from the loaded file
+        loaded.saveGame(self.fileName)
+        reloaded = self.loadGame()
+        self.assertTrue((reloaded.levels[1].map.colorLayer == self.game.levels[1].map.colorLayer).all())
+        # The loaded game no longer reads from the replaced file
+        savedLevel = loaded.levels[1].savedLevel
+        self.assertNotIsInstance(savedLevel.buf, mmap.mmap)
+        self.assertTrue((loaded.levels[1].map.colorLayer == self.game.levels[1].map.colorLayer).all())
+        loaded.saveGame(self.fileName)
+
+    def test_invalidFile(self):
+        with open(self.fileName, 'wb') as saveFile:
+            saveFile.write('This is not a saved game.')
+        with self.assertRaises(GameError):
+            self.loadGame()
+        # An empty file
+        open(self.fileName, 'wb').close()
+        with self.assertRaises(GameError):
+            self.loadGame()
+
+class TestJournal(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_AI_LOGGING = False
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_COMBAT_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+        self.compactTurns = CONSTANTS.AUTOSAVE_COMPACT_TURNS
+        self.game = Game.Game()
+        self.game.resetGame()
+        handle, self.fileName = tempfile.mkstemp('.warrens')
+        os.close(handle)
+        self.game.startAutosave(self.fileName)
+
+    def tearDown(self):
+        CONSTANTS.AUTOSAVE_COMPACT_TURNS = self.compactTurns
+        self.game.stopAutosave()
+        os.remove(self.fileName)
+        os.remove(getJournalFileName(self.fileName))
+
+    def playTurns(self, turns):
+        player = self.game.player
+        for i in range(turns):
+            player.tryMoveOrAttack(*random.choice([(-1, 0), (1, 0), (0, -1), (0, 1)]))
+            player.actionTaken = True
+            self.game.tryToPlayTurn()
+        # Enter the dungeon and back, this changes the current level
+        portal = [p for p in self.game.currentLevel.portals if p.destinationPortal.level is self.game.levels[1]][0]
+        for p in [portal, portal.destinationPortal]:
+            player.followPortal(p)
+            player.actionTaken = True
+            self.game.tryToPlayTurn()
+
+    def assertRecovered(self, loaded):
+        player = self.game.player
+        self.assertEqual((loaded.player.tile.x, loaded.player.tile.y), (player.tile.x, player.tile.y))
+        self.assertEqual(loaded.player.currentHitPoints, player.currentHitPoints)
+        for level, loadedLevel in zip(self.game.levels[:2], loaded.levels[:2]):
+            self.assertTrue((loadedLevel.map.exploredLayer == level.map.exploredLayer).all())
+            positions = sorted((c.tile.x, c.tile.y, c.currentHitPoints) for c in level.characters)
+            loadedPositions = sorted((c.tile.x, c.tile.y, c.currentHitPoints) for c in loadedLevel.characters)
+            self.assertEqual(loadedPositions, positions)
+
+    def test_replay(self):
+        self.playTurns(20)
+        # Simulate a crash, the journal is written but the save file is old
+        self.game._journal.flush()
+        self.assertGreater(os.path.getsize(getJournalFileName(self.fileName)), 0)
+        loaded = Game.Game()
+        loaded.loadGame(self.fileName)
+        self.assertRecovered(loaded)
+
+    def test_compaction(self):
+        CONSTANTS.AUTOSAVE_COMPACT_TURNS = 5
+        self.playTurns(8)
+        self.game._journal.flush()
+        loaded = Game.Game()
+        loaded.loadGame(self.fileName)
+        self.assertRecovered(loaded)
+
+    def test_incompleteEntry(self):
+        self.playTurns(5)
+        self.game._journal.flush()
+        with open(getJournalFileName(self.fileName), 'ab') as journalFile:
+            journalFile.write('\xff\xff')
+        loaded = Game.Game()
+        loaded.loadGame(self.fileName)
+        self.assertRecovered(loaded)
+
+if __name__ == "__main__":
+    unittest.main()
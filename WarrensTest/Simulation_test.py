@@ -0,0 +1,200 @@
+__author__ = 'Frostlock'
+
+import unittest
+import os
+import json
+import pstats
+import tempfile
+
+import numpy
+
+import WarrensGame.Game as Game
+import WarrensGame.CONSTANTS as CONSTANTS
+from WarrensGame.Simulation import simulateGame, runBatch, formatReport, percentile
+from WarrensGame.SimulationFarm import runFarm, readColumns, formatSummary, ColumnWriter
+from WarrensGame.Profiling import PhaseProfiler, RollingHistogram, FrameCapture
+
+
+class TestSimulation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_AI_LOGGING = False
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_COMBAT_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+
+    def test_simulateGame(self):
+        result = simulateGame(3, 50)
+        self.assertGreater(result.turns, 0)
+        self.assertLessEqual(result.turns, 50)
+        self.assertEqual(len(result.timer.turnTimes), result.turns)
+        for phase in ['player', 'AI', 'FOV', 'effects']:
+            self.assertIn(phase, result.timer.phases)
+        # The same seed plays the same game
+        again = simulateGame(3, 50)
+        self.assertEqual((again.turns, again.survived, again.xp), (result.turns, result.survived, result.xp))
+
+    def test_report(self):
+        results = runBatch(2, 20, 'random')
+        self.assertEqual([r.seed for r in results], [1, 2])
+        report = formatReport(results)
+        self.assertIn('turns per second', report)
+        self.assertIn('p99', report)
+
+    def test_percentile(self):
+        values = range(100)
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+class TestSimulationFarm(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_AI_LOGGING = False
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_COMBAT_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+        handle, self.fileName = tempfile.mkstemp('.columns')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.fileName)
+
+    def test_separateGames(self):
+        # Every game keeps its own messages
+        first = Game.Game()
+        first.resetGame(1)
+        second = Game.Game()
+        second.resetGame(2)
+        self.assertEqual(len(first.messageBuffer), 1)
+        self.assertEqual(len(second.messageBuffer), 1)
+        self.assertIn(first.player.name, first.messageBuffer[0])
+        self.assertIn(second.player.name, second.messageBuffer[0])
+
+    def test_columnFile(self):
+        writer = ColumnWriter(self.fileName)
+        writer.write({'a': numpy.arange(3), 'b': numpy.array(['x', 'yy', 'z'])})
+        writer.write({'a': numpy.arange(2), 'b': numpy.array(['longer', ''])})
+        writer.close()
+        columns = readColumns(self.fileName)
+        self.assertEqual(columns['a'].tolist(), [0, 1, 2, 0, 1])
+        self.assertEqual(columns['b'].tolist(), ['x', 'yy', 'z', 'longer', ''])
+
+    def test_farm(self):
+        columns = runFarm(4, 60, processes=2, fileName=self.fileName, shardSize=1)
+        self.assertEqual(columns['seed'].tolist(), [1, 2, 3, 4])
+        self.assertEqual(columns['xpCurve'].shape, (4, 1))
+        # The file contains the same results, in the order they arrived
+        stored = readColumns(self.fileName)
+        order = numpy.argsort(stored['seed'])
+        self.assertEqual(stored['turns'][order].tolist(), columns['turns'].tolist())
+        # Every process plays the same game as a single game would
+        result = simulateGame(2, 60)
+        self.assertEqual(columns['turns'][1], result.turns)
+        self.assertEqual(columns['xp'][1], result.xp)
+        self.assertEqual(columns['killer'][1], result.killer)
+        self.assertIn('4 games', formatSummary(columns))
+
+class FakeClock(object):
+    """
+    Clock that advances a fixed step every time it is read.
+    """
+
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+class TestProfiling(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        """
+        unittest framework will run this once before all the tests in this class.
+        """
+        CONSTANTS.SHOW_AI_LOGGING = False
+        CONSTANTS.SHOW_GAME_LOGGING = False
+        CONSTANTS.SHOW_COMBAT_LOGGING = False
+        CONSTANTS.SHOW_GENERATION_LOGGING = False
+
+    def setUp(self):
+        CONSTANTS.PREFETCH_LEVELS = False
+        handle, self.fileName = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.fileName)
+
+    def test_rollingHistogram(self):
+        histogram = RollingHistogram(4)
+        for duration in [0.010, 0.0002, 0.0002, 0.0002, 0.003]:
+            histogram.add(duration)
+        # The oldest duration dropped out of the window
+        self.assertEqual(histogram.count, 4)
+        self.assertAlmostEqual(histogram.maximum, 0.003)
+        self.assertAlmostEqual(histogram.percentile(0.5), 0.0002)
+        buckets = histogram.buckets()
+        self.assertEqual(sum(buckets), 4)
+        self.assertEqual(buckets[1], 3)
+        self.assertEqual(buckets[5], 1)
+
+    def test_profiler(self):
+        profiler = PhaseProfiler(FakeClock(0.001), 10)
+        for i in range(20):
+            profiler.startTurn()
+            profiler.mark('draw')
+            profiler.record('item', 0.002)
+            profiler.endTurn()
+        self.assertEqual(profiler.turnTimes, [])
+        self.assertEqual(profiler.turnHistogram.count, 10)
+        self.assertAlmostEqual(profiler.histograms['draw'].mean, 0.001)
+        self.assertAlmostEqual(profiler.phaseTimes['draw'], 0.020)
+        self.assertEqual(len(profiler.summaryLines()), 3)
+        profiler.dumpJson(self.fileName)
+        with open(self.fileName) as jsonFile:
+            dump = json.load(jsonFile)
+        self.assertEqual(dump['phaseOrder'], ['draw'])
+        self.assertAlmostEqual(dump['operations']['item']['p50'], 2.0)
+
+    def test_gameTurns(self):
+        game = Game.Game()
+        game.resetGame(1)
+        profiler = PhaseProfiler()
+        game.phaseTimer = profiler
+        for i in range(3):
+            game.player.actionTaken = True
+            game.tryToPlayTurn()
+        # The game measures its own turns when nobody else does
+        self.assertFalse(profiler.inTurn)
+        self.assertEqual(profiler.turnHistogram.count, 3)
+        for phase in ['AI', 'FOV', 'effects']:
+            self.assertEqual(profiler.histograms[phase].count, 3)
+
+    def test_frameCapture(self):
+        capture = FrameCapture(2, self.fileName)
+        self.assertFalse(capture.frameDone())
+        sorted(range(100))
+        self.assertTrue(capture.frameDone())
+        self.assertTrue(capture.finished)
+        stats = pstats.Stats(self.fileName)
+        self.assertGreater(stats.total_calls, 0)
+
+if __name__ == "__main__":
+    unittest.main()